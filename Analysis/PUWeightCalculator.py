@@ -10,6 +10,10 @@ The json file passed as the first argument above can be created from farmout
 output with a command like
 $ /data/cms/farmout/jobReportSummary.py --json-out lumisIUsed.json `find /path/to/submit/directories/*.xml`
 
+The MC distribution can instead be the nTruePU spectrum of all events
+generated for some ntuples (--mcNtuples), which is saved so it only has to
+be read once (see pileupReweighting.py).
+
 Nate Woods, U. Wisconsin
 
 '''
@@ -21,59 +25,54 @@ logging.basicConfig(level=logging.WARNING)
 rlog["/ROOT.TUnixSystem.SetDisplay"].setLevel(rlog.ERROR)
 
 from rootpy.io import root_open
-from rootpy.plotting import Hist
-from rootpy import asrootpy
 from os import path, environ
-
-
-outputFileName = 'puWeight_69200_24jan2017.root'
-mcDistFileName = 'mix_2016_25ns_Moriond17MC_PoissonOOTPU.txt'
-dataDistFileTemplate = 'puDistData_{}_24jan2017.root'
-dataDistFileName = dataDistFileTemplate.format(69200)
-dataDistFileNameDn = dataDistFileTemplate.format(66017)
-dataDistFileNameUp = dataDistFileTemplate.format(72383)
-
-# make a histogram from the MC distribution text file
-puMCVals = []
-with open(path.join(environ['zzt'], 'data', 'pileup', mcDistFileName)) as fMC:
-    for n in fMC:
-        puMCVals.append(float(n))
-
-puMC = Hist(len(puMCVals),0.,float(len(puMCVals)))
-for i, n in enumerate(puMCVals):
-    puMC[i+1].value = n
-
-# Get the data distributions from root files
-with root_open(path.join(environ['zzt'], 'data',
-                         'pileup', dataDistFileName)) as fData:
-    puData = asrootpy(fData.pileup).clone()
-    puData.SetDirectory(0)
-with root_open(path.join(environ['zzt'], 'data',
-                         'pileup', dataDistFileNameDn)) as fDataDn:
-    puDataDn = asrootpy(fDataDn.pileup).clone()
-    puDataDn.SetDirectory(0)
-with root_open(path.join(environ['zzt'], 'data',
-                         'pileup', dataDistFileNameUp)) as fDataUp:
-    puDataUp = asrootpy(fDataUp.pileup).clone()
-    puDataUp.SetDirectory(0)
-
-# normalize them
-puData.Scale(1./puData.Integral())
-puDataDn.Scale(1./puDataDn.Integral())
-puDataUp.Scale(1./puDataUp.Integral())
-
-with root_open(path.join(environ['zzt'], 'data', 'pileup', outputFileName),
-               'recreate') as f:
-    out = puData.clone(name='puScaleFactor')
-    out /= puMC
-    out.write()
-
-    outDn = puDataDn.clone(name='puScaleFactor_down')
-    outDn /= puMC
-    outDn.write()
-
-    outUp = puDataUp.clone(name='puScaleFactor_up')
-    outUp /= puMC
-    outUp.write()
-
-
+from glob import glob
+from argparse import ArgumentParser
+
+from Analysis.pileupReweighting import PUReweighter, dataPU, dataPUFileName, \
+    mcPUFromText, mcPUFromNtuples, DEFAULT_MC_TEXT_FILE, DEFAULT_DATA_TAG, \
+    MIN_BIAS_XSEC, MIN_BIAS_XSEC_UP, MIN_BIAS_XSEC_DN
+
+
+parser = ArgumentParser(description=("Make a file with data/MC pileup "
+                                     "weight histograms."))
+parser.add_argument('--output', type=str,
+                    default='puWeight_69200_24jan2017.root',
+                    help=('Output file name (put in ZZTools/data/pileup '
+                          'if not a full path).'))
+parser.add_argument('--mcText', type=str, default=DEFAULT_MC_TEXT_FILE,
+                    help='Text file with the MC pileup distribution.')
+parser.add_argument('--mcNtuples', type=str, nargs='*', default=[],
+                    help=('Use the nTruePU spectrum of these ntuple files '
+                          '(may be glob patterns) instead of the text file.'))
+parser.add_argument('--dataTag', type=str, default=DEFAULT_DATA_TAG,
+                    help='Tag of the data pileup distribution files.')
+parser.add_argument('--xsec', type=int, default=MIN_BIAS_XSEC,
+                    help='Nominal minimum bias cross section.')
+parser.add_argument('--xsecUp', type=int, default=MIN_BIAS_XSEC_UP,
+                    help='Minimum bias cross section for the up shift.')
+parser.add_argument('--xsecDn', type=int, default=MIN_BIAS_XSEC_DN,
+                    help='Minimum bias cross section for the down shift.')
+
+args = parser.parse_args()
+
+if args.mcNtuples:
+    mcFiles = []
+    for f in args.mcNtuples:
+        mcFiles += glob(f)
+    puMC = mcPUFromNtuples(mcFiles)
+else:
+    puMC = mcPUFromText(args.mcText)
+
+outputFileName = args.output
+if not path.dirname(outputFileName):
+    outputFileName = path.join(environ['zzt'], 'data', 'pileup',
+                               outputFileName)
+
+with root_open(outputFileName, 'recreate') as f:
+    for name, xsec in [('puScaleFactor', args.xsec),
+                       ('puScaleFactor_down', args.xsecDn),
+                       ('puScaleFactor_up', args.xsecUp)]:
+        rw = PUReweighter(dataPU(dataPUFileName(xsec, args.dataTag)), puMC)
+        out = rw.hist.clone(name=name)
+        out.write()
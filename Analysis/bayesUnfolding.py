@@ -0,0 +1,382 @@
+'''
+
+bayesUnfolding.py
+
+Iterative Bayesian (D'Agostini) unfolding with numpy, for many sets of
+inputs at once. Each input is a response matrix, truth and reco MC
+spectra, and a (background-subtracted) data spectrum; all of them are
+unfolded in the same vectorized matrix operations, so doing all of an
+analysis's systematic variations costs about as much as doing one.
+
+This follows RooUnfoldBayes (with a RooUnfoldResponse made from measured,
+truth and response histograms) step by step:
+    - P(reco bin j | true bin i) is the response divided by the truth
+      spectrum, so it includes the efficiency
+    - fakes (reco MC not in the response matrix) are one more truth bin,
+      with prior equal to the total number of fakes, which is dropped at
+      the end
+    - the first prior is the MC truth spectrum
+    - the covariance is from the data errors only, propagated through all
+      iterations as described by T. Adye (arXiv:1105.1160)
+
+toyCovariance gets the statistical covariance from Poisson toys instead
+(thousands of fluctuations of the data, and optionally of the response
+matrix, unfolded in one go), as a cross-check of the propagated errors.
+
+Run this as a script to check against RooUnfold and time it:
+    python Analysis/bayesUnfolding.py --nVariations 50 --nToys 10000
+
+Nate Woods, U. Wisconsin
+
+'''
+
+import numpy as _np
+
+from Utilities.histArrays import histContents as _histContents
+
+
+def unfold(response, truth, measured, data, nIter, dataErr2=None,
+           propagateErrors=True):
+    '''
+    Unfold data with nIter iterations. All arguments may have any number of
+    leading dimensions (one per set of inputs), which are broadcast against
+    each other.
+
+    response (array [..., nReco, nTrue]): response matrix (events generated
+        in true bin i and reconstructed in reco bin j at [j,i]).
+    truth (array [..., nTrue]): MC truth spectrum.
+    measured (array [..., nReco]): MC reco spectrum, including fakes.
+    data (array [..., nReco]): data to unfold.
+    dataErr2 (array [..., nReco]): squared errors of data (default: data).
+    propagateErrors (bool): if False, only the spectra are unfolded, without
+        the (much slower) error propagation, and the covariance is None.
+
+    Returns (unfolded spectra [..., nTrue], covariance [..., nTrue, nTrue]).
+    '''
+    response = _np.asarray(response, dtype=_np.float64)
+    truth = _np.asarray(truth, dtype=_np.float64)
+    measured = _np.asarray(measured, dtype=_np.float64)
+    data = _np.asarray(data, dtype=_np.float64)
+    if dataErr2 is None:
+        dataErr2 = data
+    dataErr2 = _np.asarray(dataErr2, dtype=_np.float64)
+
+    nReco, nTrue = response.shape[-2:]
+    shape = _np.broadcast(response[...,0,0], truth[...,0], measured[...,0],
+                          data[...,0], dataErr2[...,0]).shape
+
+    response = _np.broadcast_to(response, shape + (nReco, nTrue))
+    truth = _np.broadcast_to(truth, shape + (nTrue,))
+    measured = _np.broadcast_to(measured, shape + (nReco,))
+    data = _np.broadcast_to(data, shape + (nReco,))
+    dataErr2 = _np.broadcast_to(dataErr2, shape + (nReco,))
+
+    # fakes are an extra cause, with P(reco bin j | fake) = fakes_j / nFakes
+    fakes = measured - response.sum(axis=-1)
+    nFakes = fakes.sum(axis=-1)
+
+    # prior (as numbers of events) for all causes
+    n0 = _np.concatenate([truth, nFakes[...,_np.newaxis]], axis=-1)
+
+    # P(E_j | C_i), 0 for causes with no events
+    pEC = _np.concatenate([response, fakes[...,_np.newaxis]], axis=-1)
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        pEC = _np.where((n0 > 0.)[...,_np.newaxis,:],
+                        pEC / n0[...,_np.newaxis,:], 0.)
+
+    eff = pEC.sum(axis=-2)
+    with _np.errstate(divide='ignore'):
+        effInv = _np.where(eff > 0., 1. / eff, 0.)
+
+    for iIter in xrange(nIter):
+        # unfolding matrix M_ij = P(E_j|C_i) n0_i / (eff_i sum_l P(E_j|C_l) n0_l)
+        pE = _np.einsum('...ji,...i->...j', pEC, n0)
+        with _np.errstate(divide='ignore'):
+            pEInv = _np.where(pE > 0., 1. / pE, 0.)
+
+        if not propagateErrors:
+            # M times the data, without making M
+            n0 = (_np.einsum('...ji,...j->...i', pEC, data * pEInv) *
+                  n0 * effInv)
+            continue
+
+        M = (_np.swapaxes(pEC, -1, -2) * (n0 * effInv)[...,_np.newaxis] *
+             pEInv[...,_np.newaxis,:])
+
+        nHat = _np.einsum('...ij,...j->...i', M, data)
+
+        # derivatives of the unfolded spectrum with respect to the data
+        if iIter == 0:
+            dNdE = M
+        else:
+            with _np.errstate(divide='ignore', invalid='ignore'):
+                ratio = _np.where(n0 > 0., nHat / n0, 0.)
+                effOverN0 = _np.where(n0 > 0., eff / n0, 0.)
+            A = (_np.einsum('...ik,...k,...lk->...il', M, data, M) *
+                 effOverN0[...,_np.newaxis,:])
+            dNdE = (M + ratio[...,_np.newaxis] * dNdE -
+                    _np.einsum('...il,...lj->...ij', A, dNdE))
+
+        n0 = nHat
+
+    if not propagateErrors:
+        return n0[...,:nTrue], None
+
+    cov = _np.einsum('...ij,...j,...kj->...ik', dNdE, dataErr2, dNdE)
+
+    return nHat[...,:nTrue], cov[...,:nTrue,:nTrue]
+
+
+def correlation(cov):
+    '''
+    Correlation matrix (or matrices) from covariance matrix (or matrices)
+    cov [..., n, n]. Bins with no variance have no correlation.
+    '''
+    sig = _np.sqrt(_np.maximum(_np.diagonal(cov, axis1=-2, axis2=-1), 0.))
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        out = cov / (sig[...,:,_np.newaxis] * sig[...,_np.newaxis,:])
+    return _np.where(_np.isfinite(out), out, 0.)
+
+
+def _fluctuateResponse(response, truth, measured, responseErr2, rand, nToys):
+    '''
+    Response matrices fluctuated by their MC statistics (Poisson in the
+    effective number of events in each bin), with the truth and reco spectra
+    changed to match, so misses and fakes stay the same.
+    '''
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        nEff = _np.where(responseErr2 > 0., response**2 / responseErr2, 0.)
+        scale = _np.where(nEff > 0., response / nEff, 0.)
+
+    toyResponse = rand.poisson(_np.broadcast_to(nEff, (nToys,) + nEff.shape)) * scale
+    toyResponse = _np.where(nEff > 0., toyResponse, response)
+
+    diff = toyResponse - response
+    return (toyResponse, truth + diff.sum(axis=-2),
+            measured + diff.sum(axis=-1))
+
+
+def toyCovariance(response, truth, measured, data, nIter, nToys=1000,
+                  bkg=None, responseErr2=None, seed=None, toysPerBatch=1000):
+    '''
+    Statistical covariance of the unfolded spectrum from Poisson toys.
+
+    Each toy fluctuates the data (and, if responseErr2 is given, the
+    response matrix by its MC statistics), subtracts the background, and
+    is unfolded like the real data. Toys are unfolded toysPerBatch at a
+    time, all in the same array operations.
+
+    response, truth, measured, nIter: as for unfold (for one set of inputs).
+    data (array [nReco]): observed data, before background subtraction.
+    bkg (array [nReco]): background to subtract from each toy (negative
+        bins are set to 0, as for the real data).
+    responseErr2 (array [nReco, nTrue]): squared errors of the response
+        matrix bins.
+    seed (int): random seed, so results can be reproduced.
+
+    Returns (mean of the unfolded toys [nTrue], covariance [nTrue, nTrue],
+    correlation [nTrue, nTrue]).
+    '''
+    response = _np.asarray(response, dtype=_np.float64)
+    truth = _np.asarray(truth, dtype=_np.float64)
+    measured = _np.asarray(measured, dtype=_np.float64)
+    data = _np.asarray(data, dtype=_np.float64)
+    if bkg is None:
+        bkg = _np.zeros(data.shape)
+
+    rand = _np.random.RandomState(seed)
+
+    unfolded = []
+    for start in xrange(0, nToys, toysPerBatch):
+        n = min(toysPerBatch, nToys - start)
+
+        toyData = _np.maximum(rand.poisson(data, (n,) + data.shape) - bkg, 0.)
+
+        if responseErr2 is None:
+            toyResponse, toyTruth, toyMeasured = response, truth, measured
+        else:
+            toyResponse, toyTruth, toyMeasured = _fluctuateResponse(response,
+                                                                    truth,
+                                                                    measured,
+                                                                    responseErr2,
+                                                                    rand, n)
+
+        unfolded.append(unfold(toyResponse, toyTruth, toyMeasured, toyData,
+                               nIter, propagateErrors=False)[0])
+
+    unfolded = _np.concatenate(unfolded)
+    cov = _np.cov(unfolded, rowvar=False)
+
+    return unfolded.mean(axis=0), cov, correlation(cov)
+
+
+def _contents1D(h):
+    contents, errs2 = _histContents(h)
+    return contents[1:-1], errs2[1:-1]
+
+
+def responseArrays(hSig, hTrue, hResponse):
+    '''
+    Arrays (response [nReco, nTrue], truth, measured) for unfold from the
+    histograms that would go into a RooUnfoldResponse (hResponse has reco on
+    the x axis and truth on the y axis).
+    '''
+    nReco = hResponse.GetNbinsX()
+    nTrue = hResponse.GetNbinsY()
+    response = _histContents(hResponse)[0].reshape(nTrue+2, nReco+2)
+    response = response[1:-1,1:-1].T
+
+    return response, _contents1D(hTrue)[0], _contents1D(hSig)[0]
+
+
+def responseErr2Array(hResponse):
+    '''
+    Squared errors of the bins of hResponse, in the same order as the
+    response from responseArrays.
+    '''
+    nReco = hResponse.GetNbinsX()
+    nTrue = hResponse.GetNbinsY()
+    err2 = _histContents(hResponse)[1].reshape(nTrue+2, nReco+2)
+    return err2[1:-1,1:-1].T
+
+
+def dataArrays(hData, hBkg=None):
+    '''
+    Data spectrum with background subtracted (negative bins set to 0) and
+    its squared errors, as arrays.
+    '''
+    data, err2 = _contents1D(hData)
+    if hBkg is not None:
+        bkg, bkgErr2 = _contents1D(hBkg)
+        data = _np.maximum(data - bkg, 0.)
+        err2 = err2 + bkgErr2
+
+    return data, err2
+
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser as _Args
+    from time import time as _time
+    from sys import exit as _exit
+
+    parser = _Args(description=("Check the numpy iterative Bayesian "
+                                "unfolding against RooUnfold and time both. "
+                                "Exits with status 1 if they differ by more "
+                                "than the tolerance."))
+    parser.add_argument('--nVariations', type=int, default=50,
+                        help='Number of sets of inputs to unfold.')
+    parser.add_argument('--nBins', type=int, default=10,
+                        help='Number of bins.')
+    parser.add_argument('--nIter', type=int, default=4,
+                        help='Number of iterations.')
+    parser.add_argument('--nToys', type=int, default=10000,
+                        help=('Number of toys for the toy covariance check '
+                              '(0 to skip it).'))
+    parser.add_argument('--noRoot', action='store_true',
+                        help=('Only check the covariance against finite '
+                              'differences, without RooUnfold.'))
+    parser.add_argument('--tolerance', type=float, default=1e-6,
+                        help=('Largest relative difference from RooUnfold '
+                              'allowed in the unfolded spectra and '
+                              'covariances.'))
+
+    args = parser.parse_args()
+
+    rand = _np.random.RandomState(12345)
+    n = args.nBins
+
+    # smeared, inefficient response with some fakes and a falling spectrum
+    trueSpec = 1000. * _np.exp(-_np.arange(n) / 3.)
+    smear = _np.exp(-0.5 * _np.subtract.outer(_np.arange(n), _np.arange(n))**2)
+    smear /= smear.sum(axis=0)
+    responses = []
+    truths = []
+    measureds = []
+    datas = []
+    for i in xrange(args.nVariations):
+        eff = rand.uniform(0.5, 0.7, n)
+        t = trueSpec * rand.uniform(0.9, 1.1, n)
+        resp = smear * (t * eff)
+        responses.append(resp)
+        truths.append(t)
+        measureds.append(resp.sum(axis=1) + rand.uniform(0., 10., n))
+        datas.append(rand.poisson(measureds[-1] * 1.1).astype(_np.float64))
+    responses = _np.array(responses)
+    truths = _np.array(truths)
+    measureds = _np.array(measureds)
+    datas = _np.array(datas)
+
+    start = _time()
+    unfolded, cov = unfold(responses, truths, measureds, datas, args.nIter)
+    print "numpy: unfolded {} variations in {:.1f} ms".format(args.nVariations,
+                                                              (_time() - start) * 1000.)
+
+    # the covariance is from the exact derivatives, so it should agree with
+    # finite differences
+    eps = 1e-3
+    jac = _np.zeros((n, n))
+    for j in xrange(n):
+        up = datas[0].copy()
+        up[j] += eps
+        dn = datas[0].copy()
+        dn[j] -= eps
+        jac[:,j] = (unfold(responses[0], truths[0], measureds[0], up, args.nIter,
+                           propagateErrors=False)[0] -
+                    unfold(responses[0], truths[0], measureds[0], dn, args.nIter,
+                           propagateErrors=False)[0]) / (2. * eps)
+    covFD = _np.einsum('ij,j,kj->ik', jac, datas[0], jac)
+    print "Covariance vs. finite differences: max relative difference {:.2e}".format(
+        _np.max(_np.abs(covFD - cov[0]) / _np.maximum(_np.abs(cov[0]), 1e-12 * _np.abs(cov[0]).max())))
+
+    if args.nToys:
+        start = _time()
+        toyMean, toyCov, toyCorr = toyCovariance(responses[0], truths[0],
+                                                 measureds[0], datas[0],
+                                                 args.nIter, args.nToys,
+                                                 seed=12345)
+        print "Unfolded {} toys in {:.1f} ms".format(args.nToys,
+                                                     (_time() - start) * 1000.)
+        print "Toy / propagated errors: {}".format(
+            ' '.join('{:.3f}'.format(r) for r in
+                     _np.sqrt(_np.diagonal(toyCov) / _np.diagonal(cov[0]))))
+
+    if not args.noRoot:
+        from rootpy.plotting import Hist, Hist2D
+        from rootpy.ROOT import RooUnfoldResponse, RooUnfoldBayes
+
+        maxDiff = 0.
+        maxCovDiff = 0.
+        start = _time()
+        for i in xrange(args.nVariations):
+            hSig = Hist(n, 0., n)
+            hTrue = Hist(n, 0., n)
+            hData = Hist(n, 0., n)
+            hResp = Hist2D(n, 0., n, n, 0., n)
+            for j in xrange(n):
+                hSig.SetBinContent(j+1, measureds[i,j])
+                hTrue.SetBinContent(j+1, truths[i,j])
+                hData.SetBinContent(j+1, datas[i,j])
+                hData.SetBinError(j+1, _np.sqrt(datas[i,j]))
+                for k in xrange(n):
+                    hResp.SetBinContent(j+1, k+1, responses[i,j,k])
+
+            resp = RooUnfoldResponse(hSig, hTrue, hResp)
+            unf = RooUnfoldBayes(resp, hData, args.nIter)
+            hOut = unf.Hreco()
+            covROOT = unf.Ereco(2)
+
+            for j in xrange(n):
+                maxDiff = max(maxDiff, abs(hOut.GetBinContent(j+1) - unfolded[i,j]) /
+                              max(abs(unfolded[i,j]), 1e-9))
+                for k in xrange(n):
+                    maxCovDiff = max(maxCovDiff, abs(covROOT(j,k) - cov[i,j,k]) /
+                                     max(_np.sqrt(cov[i,j,j] * cov[i,k,k]), 1e-9))
+
+        print "RooUnfold: unfolded {} variations in {:.1f} ms".format(args.nVariations,
+                                                                      (_time() - start) * 1000.)
+        print "Max relative difference from RooUnfold: {:.2e} (spectrum), {:.2e} (covariance)".format(maxDiff, maxCovDiff)
+
+        if not (maxDiff < args.tolerance and maxCovDiff < args.tolerance):
+            print "Differences from RooUnfold are above tolerance {:.1e}".format(args.tolerance)
+            _exit(1)
@@ -0,0 +1,362 @@
+'''
+
+fakeFactors.py
+
+Fake factor weights for the Z+X control regions (2P2F and 3P1F), as numpy
+arrays for whole samples at once. Each lepton that fails the tight ID and
+isolation gets its fake factor (fakeFactor_e or fakeFactor_m from the fake
+rate file, as a function of |eta| and pt), and each event is weighted by
+the product over its four leptons. The nominal weights and the ones with
+the electron or muon fake factors scaled up (x1.4) or down (x0.6) all come
+from one read of the lepton columns.
+
+The same weights are available as strings for TTree::Draw
+(FakeFactors.weightStrings; used by setupStandardSamples.standardZZBkg).
+FakeFactors.makeHistVariations uses the arrays to make the Z+X histograms
+with shifted fake factors from the nominal standardZZBkg samples.
+
+Example:
+    ff = FakeFactors('fakeRate_someDate', sipCut=4.)
+    cols = sample.getColumns({b:0 for b in ff.branchesNeeded('eemm')})
+    weights = ff.eventWeightVariations('eemm', cols)
+    # weights['nominal'], weights['eFRUp'], ...
+
+Nate Woods, U. Wisconsin
+
+'''
+
+import numpy as _np
+
+from Utilities import WeightStringMaker as _Weight
+from Utilities import combineWeights as _combineWeights
+from Utilities import HistLookup as _HistLookup
+from Utilities.helpers import parseChannels as _parseChannels
+from Utilities.histArrays import addToHist as _addToHist
+from Utilities.drawExpressions import UnsupportedExpression as _UnsupportedExpression
+
+from rootpy import asrootpy as _asRP
+from rootpy.io import root_open as _open
+from rootpy.plotting import Hist as _Hist
+
+from os import environ as _env
+from os import path as _path
+from re import compile as _reComp
+
+
+# fake factor scaling for the systematic shifts
+_frScales = {
+    '' : 1.,
+    'up' : 1.4,
+    'dn' : 0.6,
+    'down' : 0.6,
+    }
+
+# (electron shift, muon shift) for eventWeightVariations
+_variations = {
+    'nominal' : ('', ''),
+    'eFRUp' : ('up', ''),
+    'eFRDn' : ('dn', ''),
+    'mFRUp' : ('', 'up'),
+    'mFRDn' : ('', 'dn'),
+    }
+
+# leptons making up each Z, in the order used for the weight strings
+_zPairs = {
+    'eeee' : [('e1', 'e2'), ('e3', 'e4')],
+    'eemm' : [('e1', 'e2'), ('m1', 'm2')],
+    'mmmm' : [('m1', 'm2'), ('m3', 'm4')],
+    }
+
+
+def _scale(syst):
+    # anything else is no shift, as in the old weight string code
+    return _frScales.get(syst.lower(), 1.)
+
+
+def _product(leptons, scales, sign=1.):
+    '''
+    Product over leptons (from FakeFactors._leptonFakeFactors) of 1 for
+    passing leptons and the fake factor times scales[flavor] for failing
+    ones.
+    '''
+    w = sign
+    for flavor, passes, fr in leptons:
+        w = w * _np.where(passes, 1., scales[flavor] * fr)
+    return w
+
+
+# fake rate file -> {flavor : (histogram, HistLookup)}
+_fakeFactorHists = {}
+
+def _loadFakeFactors(fakeRateFile):
+    if '.root' not in fakeRateFile:
+        fakeRateFile = fakeRateFile + '.root'
+    if not _path.isfile(fakeRateFile):
+        fakeRateFile = _path.join(_env['zzt'], 'data', 'fakeRate',
+                                  fakeRateFile)
+
+    if fakeRateFile not in _fakeFactorHists:
+        out = {}
+        with _open(fakeRateFile) as f:
+            for flavor in 'em':
+                h = _asRP(f.Get('fakeFactor_'+flavor)).clone()
+                h.SetDirectory(0)
+                out[flavor] = (h, _HistLookup(h))
+        _fakeFactorHists[fakeRateFile] = out
+
+    return _fakeFactorHists[fakeRateFile]
+
+
+class FakeFactors(object):
+    '''
+    Control region weights from fake factors.
+    '''
+    def __init__(self, fakeRateFile, sipCut=4.):
+        '''
+        fakeRateFile (str): file with fakeFactor_e and fakeFactor_m (full
+            path or name in ZZTools/data/fakeRate; '.root' is optional).
+        sipCut (float): SIP3D cut of the tight ID. If it isn't the standard
+            4, the no-vertex-cut ID is used with the impact parameter cuts
+            and this SIP cut (none if sipCut <= 0) applied on top.
+        '''
+        self.fakeRateFile = fakeRateFile
+        self.sipCut = sipCut
+        self._hists = _loadFakeFactors(fakeRateFile)
+
+
+    def histograms(self):
+        '''
+        The fake factor histograms, as a dict of flavor -> histogram.
+        '''
+        return {flavor : h for flavor, (h, lookup) in self._hists.iteritems()}
+
+
+    def _standardSIP(self):
+        return abs(self.sipCut - 4.) <= 0.001
+
+
+    def branchesNeeded(self, channel):
+        '''
+        Names of the branches needed for channel.
+        '''
+        out = []
+        for pair in _zPairs[channel]:
+            for lep in pair:
+                out += [lep+'ZZIsoPass', lep+'Pt', lep+'Eta']
+                if self._standardSIP():
+                    out.append(lep+'ZZTightID')
+                else:
+                    out += [lep+'ZZTightIDNoVtx', lep+'PVDXY', lep+'PVDZ']
+                    if self.sipCut > 0:
+                        out.append(lep+'SIP3D')
+        return out
+
+
+    def _passes(self, lep, columns):
+        '''
+        Boolean array: does lep pass the tight ID and isolation?
+        '''
+        if self._standardSIP():
+            out = columns[lep+'ZZTightID'].astype(bool)
+        else:
+            out = (columns[lep+'ZZTightIDNoVtx'].astype(bool) &
+                   (_np.abs(columns[lep+'PVDXY']) < 0.5) &
+                   (_np.abs(columns[lep+'PVDZ']) < 1.))
+            if self.sipCut > 0:
+                out &= columns[lep+'SIP3D'] < self.sipCut
+
+        return out & columns[lep+'ZZIsoPass'].astype(bool)
+
+
+    def _leptonFakeFactors(self, channel, columns):
+        '''
+        List of (flavor, pass array, fake factor array) for each lepton.
+        '''
+        out = []
+        for pair in _zPairs[channel]:
+            for lep in pair:
+                lookup = self._hists[lep[0]][1]
+                fr = lookup(_np.abs(columns[lep+'Eta']), columns[lep+'Pt'])
+                out.append((lep[0], self._passes(lep, columns), fr))
+        return out
+
+
+    def eventWeightVariations(self, channel, columns, variations=[], sign=1.):
+        '''
+        Control region weight for each event, nominal and with shifted fake
+        factors.
+
+        channel (str): one channel.
+        columns (dict): branch name -> array, with at least the branches from
+            branchesNeeded(channel).
+        variations (list of str): which ones to compute (default: all of
+            'nominal', 'eFRUp', 'eFRDn', 'mFRUp', 'mFRDn').
+        sign (float): overall factor (-1 for the samples that are
+            subtracted, as in standardZZBkg).
+
+        Returns a dict of variation name -> array of event weights.
+        '''
+        if not variations:
+            variations = _variations.keys()
+
+        leptons = self._leptonFakeFactors(channel, columns)
+
+        out = {}
+        for v in variations:
+            try:
+                scales = dict(zip('em', [_scale(s) for s in _variations[v]]))
+            except KeyError:
+                raise ValueError("Unknown fake factor variation {}".format(v))
+
+            out[v] = _product(leptons, scales, sign)
+
+        return out
+
+
+    def eventWeights(self, channel, columns, eSyst='', mSyst='', sign=1.):
+        '''
+        Control region weight for each event, with the electron and/or muon
+        fake factors optionally shifted ('up' or 'dn').
+        '''
+        scales = {'e' : _scale(eSyst), 'm' : _scale(mSyst)}
+        return _product(self._leptonFakeFactors(channel, columns), scales,
+                        sign)
+
+
+    def sampleWeightVariations(self, sample, variations=[], sign=1.):
+        '''
+        eventWeightVariations for all events of an NtupleSample.
+        '''
+        branches = {b : 0 for b in self.branchesNeeded(sample.channel)}
+        return self.eventWeightVariations(sample.channel,
+                                          sample.getColumns(branches),
+                                          variations, sign)
+
+
+    def makeHistVariations(self, sample, var, selection, binning,
+                           variations=[]):
+        '''
+        Z+X histograms with shifted fake factors, from the nominal control
+        region samples (the sample or group from
+        setupStandardSamples.standardZZBkg with this fake rate file and SIP
+        cut), instead of a whole new set of samples for each shift. For each
+        sample, eventWeightVariations gets all the fake factor weights from
+        one read of the lepton columns, and each variation is binned in the
+        same pass as the nominal weight times its ratio to the nominal fake
+        factor weight. Samples whose weights can't be done with arrays use
+        the equivalent weight strings with makeHistVariations.
+
+        var, selection and binning are as for makeHist (strings, and
+        perUnitWidth=False). The histograms are not postprocessed.
+
+        Returns a dict of variation name -> histogram.
+        '''
+        if not variations:
+            variations = _variations.keys()
+        variations = list(variations)
+
+        bins = binning[:]
+        if len(bins) != 3:
+            bins = [bins]
+        out = {v : _Hist(*bins, type='D', title=sample.prettyName)
+               for v in variations}
+        template = out[variations[0]]
+
+        try:
+            samples = list(sample.getBaseSamples())
+        except AttributeError:
+            samples = [sample]
+
+        for s in samples:
+            try:
+                weights = self.sampleWeightVariations(s, variations+['nominal'])
+                nominal = weights['nominal']
+                factors = _np.column_stack([_np.divide(weights[v], nominal,
+                                                       out=_np.zeros_like(nominal),
+                                                       where=(nominal != 0.))
+                                            for v in variations])
+                contents, sumW2, nEntries = s.binWithFactors(template, var,
+                                                             selection,
+                                                             factors)
+            except _UnsupportedExpression:
+                shifted = {v : _combineWeights(s.weight,
+                                               self.shiftStrings(s.channel,
+                                                                 *_variations[v]))
+                           for v in variations}
+                for v, h in s.makeHistVariations(var, selection, binning,
+                                                 shifted,
+                                                 perUnitWidth=False).iteritems():
+                    out[v] += h
+                continue
+
+            for i, v in enumerate(variations):
+                _addToHist(out[v], contents[i], sumW2[i], int(nEntries[i]))
+
+        return out
+
+
+    def _crWeightStrings(self, channels, frStr):
+        '''
+        Control region weight string for each channel, with frStr[flavor]
+        (with {lep} for the lepton) for each failing lepton.
+        '''
+        zCRWeightTemp = ('({{lep1}}ZZTightID && {{lep1}}ZZIsoPass ? 1. : {fr1}) * '
+                         '({{lep2}}ZZTightID && {{lep2}}ZZIsoPass ? 1. : {fr2})')
+
+        if not self._standardSIP():
+            idPattern = _reComp(r'(?<=(?P<lep>\{\{lep\d\}\})ZZTightID)')
+            idRepl = r'NoVtx && abs(\g<lep>PVDXY) < 0.5 && abs(\g<lep>PVDZ) < 1.'
+            if self.sipCut > 0:
+                idRepl += ' && \g<lep>SIP3D < {}'.format(self.sipCut)
+            zCRWeightTemp = idPattern.sub(idRepl, zCRWeightTemp,2)
+
+        zCRWeight = {
+            f : zCRWeightTemp.format(fr1=frStr[f].format(lep='{lep1}'),
+                                     fr2=frStr[f].format(lep='{lep2}'))
+            for f in 'em'
+            }
+
+        return {
+            c : ' * '.join(zCRWeight[pair[0][0]].format(lep1=pair[0],
+                                                        lep2=pair[1])
+                           for pair in _zPairs[c])
+            for c in channels
+            }
+
+
+    def shiftStrings(self, channel, eSyst='', mSyst=''):
+        '''
+        Weight string for one channel that turns the nominal control region
+        weight into the one with shifted fake factors (the scale factor for
+        each failing lepton). Empty if nothing is shifted.
+        '''
+        scales = {'e' : _scale(eSyst), 'm' : _scale(mSyst)}
+        if all(sc == 1. for sc in scales.values()):
+            return ''
+
+        return self._crWeightStrings([channel],
+                                     {f : str(sc) for f, sc in scales.iteritems()})[channel]
+
+
+    def weightStrings(self, channel, eSyst='', mSyst=''):
+        '''
+        The same weights as strings for TTree::Draw: a string for one
+        channel, or a dict of channel -> string for several.
+        '''
+        channels = _parseChannels(channel)
+
+        wCR = _Weight('fakeFactor')
+        frStr = {}
+        for flavor, syst in zip('em', (eSyst, mSyst)):
+            frStr[flavor] = wCR.makeWeightStringFromHist(self._hists[flavor][0],
+                                                         'abs({lep}Eta)',
+                                                         '{lep}Pt')
+            if _scale(syst) != 1.:
+                frStr[flavor] = '{} * {}'.format(_scale(syst), frStr[flavor])
+
+        crWeight = self._crWeightStrings(channels, frStr)
+
+        if len(channels) == 1:
+            return crWeight[channels[0]]
+
+        return crWeight
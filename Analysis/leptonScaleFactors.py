@@ -0,0 +1,228 @@
+'''
+
+leptonScaleFactors.py
+
+Lepton efficiency scale factors computed with numpy for whole arrays of
+events at once, from the same histograms in ZZTools/data/leptonScaleFactors
+and with the same definitions as the weight strings from
+weightHelpers.leptonEfficiencyWeightsFromHists:
+    electrons: reco SF (SCEta, pt=100) * selection SF (SCEta, pt), from the
+               gap histogram for gap electrons. The uncertainty is the reco
+               uncertainty (plus 1% below 20 GeV or above 75 GeV) and the
+               selection uncertainty added in quadrature.
+    muons:     FINAL (eta, pt), with uncertainty ERROR (eta, pt)
+Shifted scale factors are the nominal ones plus or minus the uncertainty.
+
+Histograms are only read once, and shared by all channels and all
+LeptonScaleFactors objects using the same files.
+
+Example:
+    sfs = LeptonScaleFactors()
+    cols = sample.getColumns({b:0 for b in sfs.branchesNeeded('eemm')})
+    weights = sfs.eventWeightVariations('eemm', cols)
+    # weights['nominal'], weights['eEffUp'], ...
+
+Nate Woods, U. Wisconsin
+
+'''
+
+import numpy as _np
+
+from Utilities import HistLookup as _HistLookup
+from Utilities.helpers import mapObjects as _mapObjects
+
+from rootpy import asrootpy as _asRP
+from rootpy.io import root_open as _open
+
+from os import environ as _env
+from os import path as _path
+
+
+# (file name, histogram name) -> (content lookup, error lookup)
+_lookups = {}
+
+def _sfLookups(fileName, histName):
+    '''
+    HistLookups for the content and error of histogram histName in
+    fileName (full path, or name in ZZTools/data/leptonScaleFactors).
+    '''
+    if not fileName.endswith('.root'):
+        fileName += '.root'
+    if not _path.isfile(fileName):
+        fileName = _path.join(_env['zzt'], 'data', 'leptonScaleFactors',
+                              fileName)
+
+    key = (fileName, histName)
+    if key not in _lookups:
+        with _open(fileName) as f:
+            h = _asRP(f.Get(histName))
+            _lookups[key] = (_HistLookup(h), _HistLookup(h, getError=True))
+
+    return _lookups[key]
+
+
+# (electron shift, muon shift) for eventWeightVariations
+_variations = {
+    'nominal' : (0, 0),
+    'eEffUp' : (1, 0),
+    'eEffDn' : (-1, 0),
+    'mEffUp' : (0, 1),
+    'mEffDn' : (0, -1),
+    }
+
+
+def _shiftSign(syst):
+    if not syst:
+        return 0
+    if syst.lower() == 'up':
+        return 1
+    if syst.lower() in ['dn', 'down']:
+        return -1
+    raise ValueError("Unknown efficiency systematic {}".format(syst))
+
+
+def _product(leptons, shifts):
+    '''
+    Product of the scale factors in leptons (from
+    LeptonScaleFactors._leptonSFs), each shifted by shifts[flavor] times its
+    uncertainty.
+    '''
+    w = 1.
+    for flavor, sf, err in leptons:
+        if shifts[flavor]:
+            w = w * (sf + shifts[flavor] * err)
+        else:
+            w = w * sf
+    return w
+
+
+class LeptonScaleFactors(object):
+    '''
+    Array-based lepton efficiency scale factors.
+    '''
+    def __init__(self, eSelSFFile='eleSelectionSF_HZZ_Moriond17',
+                 eSelSFFileGap='', eRecoSFFile='eleRecoSF_HZZ_Moriond17',
+                 mSFFile='muSelectionAndRecoSF_HZZ_Moriond17'):
+        '''
+        Files are the same as for
+        weightHelpers.leptonEfficiencyWeightsFromHists.
+        '''
+        if not eSelSFFileGap:
+            eSelSFFileGap = eSelSFFile.replace('SF', 'SFGap')
+
+        self.eSelSFFile = eSelSFFile
+        self.eSelSFFileGap = eSelSFFileGap
+        self.eRecoSFFile = eRecoSFFile
+        self.mSFFile = mSFFile
+
+
+    @staticmethod
+    def branchesNeeded(channel):
+        '''
+        Names of the branches needed for channel.
+        '''
+        out = []
+        for obj in _mapObjects(channel):
+            if obj[0] == 'e':
+                out += ['{}Pt'.format(obj), '{}SCEta'.format(obj),
+                        '{}IsGap'.format(obj)]
+            else:
+                out += ['{}Pt'.format(obj), '{}Eta'.format(obj)]
+        return out
+
+
+    def electronSFs(self, pt, scEta, isGap):
+        '''
+        Arrays of scale factors and their uncertainties for electrons.
+        '''
+        sel, selErr = _sfLookups(self.eSelSFFile, 'EGamma_SF2D')
+        selGap, selGapErr = _sfLookups(self.eSelSFFileGap, 'EGamma_SF2D')
+        reco, recoErr = _sfLookups(self.eRecoSFFile, 'EGamma_SF2D')
+
+        pt = _np.asarray(pt, dtype=_np.float64)
+        isGap = _np.asarray(isGap).astype(bool)
+        recoPt = _np.full(pt.shape, 100.)
+
+        selSF = _np.where(isGap, selGap(scEta, pt), sel(scEta, pt))
+        sf = reco(scEta, recoPt) * selSF
+
+        recoUnc = recoErr(scEta, recoPt) + ((pt < 20.) | (pt > 75.)) * 0.01
+        selUnc = _np.where(isGap, selGapErr(scEta, pt), selErr(scEta, pt))
+        err = _np.sqrt(recoUnc**2 + selUnc**2)
+
+        return sf, err
+
+
+    def muonSFs(self, pt, eta):
+        '''
+        Arrays of scale factors and their uncertainties for muons.
+        '''
+        sf = _sfLookups(self.mSFFile, 'FINAL')[0]
+        err = _sfLookups(self.mSFFile, 'ERROR')[0]
+
+        return sf(eta, pt), err(eta, pt)
+
+
+    def _leptonSFs(self, channel, columns):
+        '''
+        List of (flavor, SF array, uncertainty array) for each lepton.
+        '''
+        out = []
+        for obj in _mapObjects(channel):
+            if obj[0] == 'e':
+                sf, err = self.electronSFs(columns[obj+'Pt'],
+                                           columns[obj+'SCEta'],
+                                           columns[obj+'IsGap'])
+            else:
+                sf, err = self.muonSFs(columns[obj+'Pt'], columns[obj+'Eta'])
+            out.append((obj[0], sf, err))
+
+        return out
+
+
+    def eventWeightVariations(self, channel, columns, variations=[]):
+        '''
+        Product of the scale factors of all leptons in each event, nominal and
+        shifted.
+
+        channel (str): one channel.
+        columns (dict): branch name -> array, with at least the branches from
+            branchesNeeded(channel).
+        variations (list of str): which ones to compute (default: all of
+            'nominal', 'eEffUp', 'eEffDn', 'mEffUp', 'mEffDn').
+
+        Returns a dict of variation name -> array of event weights.
+        '''
+        if not variations:
+            variations = _variations.keys()
+
+        leptons = self._leptonSFs(channel, columns)
+
+        out = {}
+        for v in variations:
+            try:
+                shifts = dict(zip('em', _variations[v]))
+            except KeyError:
+                raise ValueError("Unknown scale factor variation {}".format(v))
+            out[v] = _product(leptons, shifts)
+
+        return out
+
+
+    def eventWeights(self, channel, columns, eSyst='', mSyst=''):
+        '''
+        Product of the scale factors of all leptons in each event, with
+        optional shifts ('up' or 'dn'), as for baseMCWeight.
+        '''
+        shifts = {'e' : _shiftSign(eSyst), 'm' : _shiftSign(mSyst)}
+        return _product(self._leptonSFs(channel, columns), shifts)
+
+
+    def sampleWeightVariations(self, sample, variations=[]):
+        '''
+        eventWeightVariations for all events of an NtupleSample.
+        '''
+        branches = {b : 0 for b in self.branchesNeeded(sample.channel)}
+        return self.eventWeightVariations(sample.channel,
+                                          sample.getColumns(branches),
+                                          variations)
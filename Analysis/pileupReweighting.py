@@ -0,0 +1,356 @@
+'''
+
+pileupReweighting.py
+
+Pileup weights for MC from any data pileup distribution (any lumi mask or
+minimum bias cross section, from pileupCalc.py) and any MC pileup
+distribution (the mixing text file, or a sample's own nTruePU spectrum).
+
+The MC spectrum has to be that of all generated events, not of events
+passing the reconstruction-level selection (the efficiency depends on
+pileup). It comes from the metaInfo tree if that has an nTruePU branch
+(one entry per generated event), otherwise from the gen-level ntuples
+({channel}Gen/ntuple), whose selection doesn't depend on pileup. The
+spectrum of each MC file is read once and saved in
+$zzt/Analysis/savedResults/puSpectra in fine bins, so weights for a new
+data distribution don't need the ntuples again. Weights come back as
+numpy arrays for arrays of nTruePU (PUReweighter.weights) or as a weight
+string (PUReweighter.weightString).
+
+Example:
+    rw = puReweighter(mcSample, minBiasXsec=69200)
+    w = rw.weights(nTruePU)
+    mcSample.applyWeight(rw.weightString())
+
+Nate Woods, U. Wisconsin
+
+'''
+
+import logging
+from rootpy import log as rlog; rlog = rlog["/pileupReweighting"]
+# don't show most silly ROOT messages
+logging.basicConfig(level=logging.WARNING)
+
+import numpy as _np
+try:
+    from root_numpy import tree2array as _tree2array
+except ImportError:
+    _tree2array = None
+
+from Utilities import WeightStringMaker as _Weight
+from Utilities import HistLookup as _HistLookup
+from Utilities import cacheDirectory as _cacheDirectory
+from Utilities import fileSignature as _fileSignature
+from Utilities.histArrays import axisEdges as _axisEdges
+
+from rootpy import asrootpy as _asRP
+from rootpy.io import root_open as _open
+from rootpy.io import DoesNotExist as _RootpyDNE
+from rootpy.plotting import Hist as _Hist
+
+from os import environ as _env
+from os import path as _path
+from os import rename as _rename
+from os import getpid as _getpid
+
+
+# MC nTruePU spectra are saved with this binning, and rebinned to match
+# the data distribution
+FINE_BINS = 1000
+PU_MAX = 100.
+
+DEFAULT_DATA_TAG = '24jan2017'
+DEFAULT_MC_TEXT_FILE = 'mix_2016_25ns_Moriond17MC_PoissonOOTPU.txt'
+
+# minimum bias cross sections for the nominal and shifted distributions
+MIN_BIAS_XSEC = 69200
+MIN_BIAS_XSEC_UP = 72383
+MIN_BIAS_XSEC_DN = 66017
+
+
+def _puFile(fileName):
+    if _path.isfile(fileName):
+        return fileName
+    return _path.join(_env['zzt'], 'data', 'pileup', fileName)
+
+
+def dataPUFileName(minBiasXsec=MIN_BIAS_XSEC, tag=DEFAULT_DATA_TAG):
+    '''
+    Name of the data pileup distribution file (from pileupCalc.py) for a
+    minimum bias cross section, following the usual naming in
+    ZZTools/data/pileup.
+    '''
+    return 'puDistData_{}_{}.root'.format(int(minBiasXsec), tag)
+
+
+def dataPU(fileName, histName='pileup'):
+    '''
+    Data pileup distribution from a pileupCalc.py output file (full path or
+    name in ZZTools/data/pileup), normalized to unit area.
+    '''
+    with _open(_puFile(fileName)) as f:
+        h = _asRP(f.Get(histName)).clone()
+        h.SetDirectory(0)
+
+    h.Scale(1. / h.Integral())
+    return h
+
+
+def mcPUFromText(fileName=DEFAULT_MC_TEXT_FILE):
+    '''
+    MC pileup distribution from a text file with the probability of each
+    number of interactions (one per line, starting from 0), as in the
+    mixing module configuration.
+    '''
+    vals = []
+    with open(_puFile(fileName)) as f:
+        for n in f:
+            if n.strip():
+                vals.append(float(n))
+
+    h = _Hist(len(vals), 0., float(len(vals)))
+    for i, n in enumerate(vals):
+        h.SetBinContent(i+1, n)
+
+    return h
+
+
+def _fineSpectrum(fileName, treePath, weight):
+    '''
+    nTruePU spectrum of one file's treePath in the fine binning, read from
+    the tree only if it wasn't saved before. None if the file doesn't have
+    that tree, or it doesn't have the branches.
+    '''
+    sig = _fileSignature(fileName, tree=treePath, weight=weight,
+                         bins=FINE_BINS, max=PU_MAX)
+    savedFile = _path.join(_cacheDirectory('puSpectra'), sig + '.npy')
+    if _path.isfile(savedFile):
+        return _np.load(savedFile)
+
+    with _open(fileName) as f:
+        try:
+            tree = f.Get(treePath)
+        except _RootpyDNE:
+            return None
+        if not tree.GetBranch('nTruePU') or \
+                (weight and not tree.GetBranch(weight)):
+            return None
+
+        if _tree2array is not None:
+            branches = ['nTruePU']
+            if weight:
+                branches.append(weight)
+            arr = _tree2array(tree, branches=branches)
+            w = arr[weight].astype(_np.float64) if weight else None
+            out = _np.histogram(arr['nTruePU'], FINE_BINS, (0., PU_MAX),
+                                weights=w)[0].astype(_np.float64)
+        else:
+            h = _Hist(FINE_BINS, 0., PU_MAX, type='D')
+            tree.Draw('nTruePU', weight, 'goff', h)
+            out = _np.array([h.GetBinContent(i) for i in xrange(1, FINE_BINS+1)])
+
+    tmpFile = '{}.tmp{}.npy'.format(savedFile[:-4], _getpid())
+    _np.save(tmpFile, out)
+    _rename(tmpFile, savedFile)
+
+    return out
+
+
+def _generatedSpectrum(fileName, channels, weight):
+    '''
+    nTruePU spectrum of all generated events in one file: from the metaInfo
+    tree if it has nTruePU, otherwise from the gen ntuples of channels.
+    '''
+    spectrum = _fineSpectrum(fileName, 'metaInfo/metaInfo', weight)
+    if spectrum is not None:
+        return spectrum
+
+    spectra = [_fineSpectrum(fileName, '{}Gen/ntuple'.format(ch), weight)
+               for ch in channels]
+    spectra = [sp for sp in spectra if sp is not None]
+    if not spectra:
+        raise ValueError(("{} has no nTruePU for all generated events (no "
+                          "metaInfo nTruePU or gen ntuples)").format(fileName))
+
+    return sum(spectra)
+
+
+def mcPUFromNtuples(files, channels=['eeee','eemm','mmmm'], weight='',
+                    selected=False):
+    '''
+    MC nTruePU spectrum of all generated events in files, in the fine
+    binning (FINE_BINS bins from 0 to PU_MAX), normalized to unit area.
+    weight is an optional branch (e.g. 'genWeight') to weight events by.
+    If selected evaluates to True, the reconstruction-level ntuples of
+    channels are used instead (biased by the selection efficiency; only for
+    comparisons). Each file is only read the first time.
+    '''
+    channels = [ch.replace('Gen', '') for ch in channels]
+
+    counts = _np.zeros(FINE_BINS)
+    for fName in files:
+        if selected:
+            for ch in channels:
+                spectrum = _fineSpectrum(fName, '{}/ntuple'.format(ch), weight)
+                if spectrum is not None:
+                    counts += spectrum
+        else:
+            counts += _generatedSpectrum(fName, channels, weight)
+
+    if counts.sum() <= 0.:
+        raise ValueError("No nTruePU entries found in {} files".format(len(files)))
+
+    h = _Hist(FINE_BINS, 0., PU_MAX, type='D')
+    for i, n in enumerate(counts / counts.sum()):
+        h.SetBinContent(i+1, n)
+
+    return h
+
+
+def mcPUForSample(sample, weight=''):
+    '''
+    MC nTruePU spectrum of all generated events for an MCSample (or group
+    or stack of them; the spectra of all the input files are combined).
+    '''
+    try:
+        baseSamples = list(sample.getBaseSamples())
+    except AttributeError:
+        baseSamples = [sample]
+
+    files = []
+    channels = []
+    for s in baseSamples:
+        for f in s.files:
+            if f not in files:
+                files.append(f)
+        if s.channel not in channels:
+            channels.append(s.channel)
+
+    return mcPUFromNtuples(files, channels, weight)
+
+
+def _contents(h):
+    return _np.array([h.GetBinContent(i) for i in xrange(1, h.GetNbinsX()+1)])
+
+
+def _rebinnedContents(h, edges):
+    '''
+    Contents of h (which must have bin edges at all of edges) in the
+    binning given by edges.
+    '''
+    hEdges = _axisEdges(h.GetXaxis())
+    contents = _contents(h)
+
+    if len(hEdges) == len(edges) and _np.allclose(hEdges, edges):
+        return contents
+
+    idx = _np.minimum(_np.searchsorted(hEdges, edges - 1e-9), len(hEdges) - 1)
+    if not _np.allclose(hEdges[idx], edges):
+        raise ValueError("Can't rebin the MC pileup distribution to match "
+                         "the data distribution (bin edges don't line up)")
+
+    return _np.add.reduceat(contents[:idx[-1]], idx[:-1])
+
+
+class PUReweighter(object):
+    '''
+    Data/MC pileup weights as a function of nTruePU.
+    '''
+    def __init__(self, dataHist, mcHist):
+        '''
+        dataHist (TH1): data pileup distribution.
+        mcHist (TH1): MC pileup distribution, in the same binning or a finer
+            binning that lines up with it.
+        Both are normalized to unit area.
+        '''
+        edges = _axisEdges(dataHist.GetXaxis())
+
+        data = _contents(dataHist)
+        data = data / data.sum()
+        mc = _rebinnedContents(mcHist, edges) / _contents(mcHist).sum()
+
+        with _np.errstate(divide='ignore', invalid='ignore'):
+            self.ratio = _np.where(mc > 0., data / mc, 0.)
+
+        self.hist = _Hist(list(edges), type='D', name='puScaleFactor')
+        self.hist.SetDirectory(0)
+        for i, r in enumerate(self.ratio):
+            self.hist.SetBinContent(i+1, r)
+            self.hist.SetBinError(i+1, 0.)
+
+        self._lookup = _HistLookup(self.hist)
+        self._weightString = None
+
+
+    def weights(self, nTruePU):
+        '''
+        Array of weights for an array of nTruePU values (values past the
+        ends get the first or last bin, like the weight strings).
+        '''
+        return self._lookup(nTruePU)
+
+
+    __call__ = weights
+
+
+    def lookup(self):
+        return self._lookup
+
+
+    def weightString(self, var='nTruePU'):
+        '''
+        Weight string for TTree::Draw and makeHist.
+        '''
+        if self._weightString is None:
+            self._weightString = _Weight('puWeight').makeWeightStringFromHist(self.hist,
+                                                                            var)
+        return self._weightString
+
+
+def puReweighter(mc=DEFAULT_MC_TEXT_FILE, minBiasXsec=MIN_BIAS_XSEC,
+                 tag=DEFAULT_DATA_TAG, dataFile='', weight=''):
+    '''
+    Get a PUReweighter.
+
+    mc: MC distribution; a sample (or group) to use the nTruePU spectrum of
+        its input files, a list of file names to do the same, a text file
+        name (see mcPUFromText), or a histogram.
+    minBiasXsec, tag: which data distribution to use (see dataPUFileName).
+    dataFile: data distribution file, if it doesn't follow the usual naming.
+    weight: branch to weight MC events by when making the spectrum from
+        ntuples.
+    '''
+    if isinstance(mc, str):
+        mcHist = mcPUFromText(mc)
+    elif isinstance(mc, (list, tuple)):
+        mcHist = mcPUFromNtuples(mc, weight=weight)
+    elif hasattr(mc, 'GetXaxis'):
+        mcHist = mc
+    else:
+        mcHist = mcPUForSample(mc, weight)
+
+    if not dataFile:
+        dataFile = dataPUFileName(minBiasXsec, tag)
+
+    return PUReweighter(dataPU(dataFile), mcHist)
+
+
+def puReweighters(mc=DEFAULT_MC_TEXT_FILE, tag=DEFAULT_DATA_TAG, weight=''):
+    '''
+    Dict of PUReweighters for the nominal ('') and shifted ('up', 'dn')
+    minimum bias cross sections. The MC distribution is only made once.
+    '''
+    if isinstance(mc, str):
+        mcHist = mcPUFromText(mc)
+    elif isinstance(mc, (list, tuple)):
+        mcHist = mcPUFromNtuples(mc, weight=weight)
+    elif hasattr(mc, 'GetXaxis'):
+        mcHist = mc
+    else:
+        mcHist = mcPUForSample(mc, weight)
+
+    return {
+        sys : PUReweighter(dataPU(dataPUFileName(xsec, tag)), mcHist)
+        for sys, xsec in [('', MIN_BIAS_XSEC), ('up', MIN_BIAS_XSEC_UP),
+                          ('dn', MIN_BIAS_XSEC_DN)]
+        }
@@ -0,0 +1,381 @@
+'''
+
+responseStore.py
+
+Saved response matrices, so the C++ response matrix makers only have to
+loop over the ntuples when something they depend on has changed.
+
+StoredResponseMaker stands in for a ResponseMatrixMaker object (same
+methods, same arguments). It remembers everything registered with it, and
+the first time a response is asked for, it looks in
+$zzt/Analysis/savedResults/responses for a file named by a hash of:
+    - the response class, variable, channel and binning
+    - the signatures (path, size, modification time) of all the input
+      files, for the nominal and each systematic
+    - the contents of the pileup weight and scale factor histograms
+    - the constant scale and whether systematics are skipped
+    - the response matrix maker code (see Utilities/responseMatrixLibrary.py)
+If it's there, all responses (nominal, every systematic by name, the PDF
+TH3D and the scale variations) are read from it and the C++ object is never
+set up. Otherwise the C++ object makes them as usual and they are all saved.
+
+Example:
+    C = responseMatrixMakerClass('FloatBranchResponseMatrixMaker')
+    resp = StoredResponseMaker(C, 'FloatBranchResponseMatrixMaker',
+                               'eeee', 'Mass', binning)
+    resp.registerFile(...)
+    ...
+    hNominal = resp()
+
+StoredResponseMakers for the same channel and files can be put in a
+StoredResponseGroup. Then the first time any of them needs its responses
+made, all of them that aren't saved yet are made together by a
+CompositeResponseMatrixMaker, which reads each tree once for all of them.
+    group = StoredResponseGroup('eeee')
+    group.add(resp)
+    group.add(otherResp)
+
+Nate Woods, U. Wisconsin
+
+'''
+
+import logging
+from rootpy import log as rlog; rlog = rlog["/responseStore"]
+# don't show most silly ROOT messages
+logging.basicConfig(level=logging.WARNING)
+
+from rootpy import asrootpy as _asRP
+from rootpy.io import root_open as _open
+
+from Utilities import cacheDirectory as _cacheDirectory
+from Utilities import fileSignature as _fileSignature
+from Utilities import histHash as _histHash
+from Utilities.responseMatrixLibrary import sourceHash as _sourceHash
+from Utilities.responseMatrixLibrary import responseMatrixMakerClass as _responseMatrixMakerClass
+
+from hashlib import sha1 as _sha1
+from os import rename as _rename
+from os import getpid as _getpid
+from os.path import join as _join
+from os.path import isfile as _isfile
+
+
+def _storeFile(key):
+    return _join(_cacheDirectory('responses'), key + '.root')
+
+
+class StoredResponseMaker(object):
+    '''
+    A response matrix maker whose outputs are saved and reused.
+    '''
+    def __init__(self, makerClass, className, channel, varName, binning):
+        '''
+        makerClass: the C++ class (e.g. from
+            responseMatrixLibrary.responseMatrixMakerClass(className)).
+        className (str): its name.
+        channel, varName, binning: as for the C++ constructor.
+        '''
+        self._maker = makerClass(channel, varName, binning)
+
+        self.className = className
+        self.channel = channel
+        self.varName = varName
+        self.binning = [float(b) for b in binning]
+
+        self._files = []
+        self._systFiles = {}
+        self._hists = {}
+        self._scale = 1.
+        self._skipSyst = False
+
+        # filled the first time a response is needed
+        self._responses = None
+        self._pdfResponses = None
+        self._scaleResponses = None
+
+        # StoredResponseGroup this is in, if any
+        self._group = None
+
+
+    def registerFile(self, fName, syst=''):
+        if syst:
+            self._maker.registerFile(fName, syst)
+            self._systFiles.setdefault(syst, []).append(fName)
+        else:
+            self._maker.registerFile(fName)
+            self._files.append(fName)
+
+
+    def _registerHist(self, role, h):
+        self._hists[role] = _histHash(h)
+
+
+    def registerPUWeights(self, h, upOrDown=''):
+        self._maker.registerPUWeights(h, upOrDown)
+        self._registerHist('pu_'+upOrDown, h)
+
+
+    def registerElectronSelectionSFHist(self, h):
+        self._maker.registerElectronSelectionSFHist(h)
+        self._registerHist('eSel', h)
+
+
+    def registerElectronSelectionGapSFHist(self, h):
+        self._maker.registerElectronSelectionGapSFHist(h)
+        self._registerHist('eSelGap', h)
+
+
+    def registerElectronRecoSFHist(self, h):
+        self._maker.registerElectronRecoSFHist(h)
+        self._registerHist('eReco', h)
+
+
+    def registerMuonSFHist(self, h):
+        self._maker.registerMuonSFHist(h)
+        self._registerHist('m', h)
+
+
+    def registerMuonSFErrorHist(self, h):
+        self._maker.registerMuonSFErrorHist(h)
+        self._registerHist('mErr', h)
+
+
+    def setConstantScale(self, c):
+        self._maker.setConstantScale(c)
+        self._scale = c
+
+
+    def getConstantScale(self):
+        return self._scale
+
+
+    def setSkipSystematics(self, skipIfTrue=True):
+        self._maker.setSkipSystematics(skipIfTrue)
+        self._skipSyst = skipIfTrue
+
+
+    def willSkipSystematics(self):
+        return self._skipSyst
+
+
+    def getVar(self):
+        return self.varName
+
+
+    def getChannel(self):
+        return self.channel
+
+
+    def key(self):
+        '''
+        Hash of everything the responses depend on.
+        '''
+        h = _sha1()
+        h.update('{};{};{};{};'.format(self.className, self.varName,
+                                       self.channel, repr(self.binning)))
+        h.update('code={};'.format(_sourceHash()))
+        h.update('files={};'.format(_fileSignature(*self._files)))
+        for syst in sorted(self._systFiles):
+            h.update('{}={};'.format(syst,
+                                     _fileSignature(*self._systFiles[syst])))
+        for role in sorted(self._hists):
+            h.update('{}={};'.format(role, self._hists[role]))
+        h.update('scale={!r};skipSyst={};'.format(self._scale, self._skipSyst))
+
+        return h.hexdigest()
+
+
+    def _getAll(self):
+        if self._responses is not None:
+            return
+
+        if self._group is not None:
+            self._group._makeMissing()
+            return
+
+        storeFile = _storeFile(self.key())
+        if self._readIfStored(storeFile):
+            return
+
+        self._make()
+        self._write(storeFile)
+
+
+    def _readIfStored(self, storeFile):
+        '''
+        Read responses from storeFile if it's there and readable. Returns
+        True if they were read.
+        '''
+        if _isfile(storeFile):
+            try:
+                self._read(storeFile)
+                return True
+            except Exception as e:
+                rlog.warning("Remaking unreadable stored responses {} ({})".format(storeFile, e))
+
+        return False
+
+
+    def _make(self):
+        '''
+        Get everything from the C++ object (running its event loops).
+        '''
+        def _local(h):
+            out = _asRP(h).clone()
+            out.SetDirectory(0)
+            return out
+
+        self._responses = {'' : _local(self._maker.getResponse(''))}
+        for syst in self._maker.knownSystematics():
+            self._responses[syst] = _local(self._maker.getResponse(syst))
+        self._pdfResponses = _local(self._maker.getPDFResponses())
+        self._scaleResponses = [_local(h) for h in self._maker.getScaleResponses()]
+
+
+    def _write(self, storeFile):
+        tmpFile = '{}.tmp{}.root'.format(storeFile[:-5], _getpid())
+        with _open(tmpFile, 'recreate') as f:
+            for syst, h in self._responses.iteritems():
+                h.Write('syst_'+syst if syst else 'nominal')
+            self._pdfResponses.Write('pdf')
+            for i, h in enumerate(self._scaleResponses):
+                h.Write('scale_{}'.format(i))
+        _rename(tmpFile, storeFile)
+
+
+    def _read(self, storeFile):
+        responses = {}
+        pdfResponses = None
+        scaleResponses = {}
+
+        with _open(storeFile) as f:
+            for k in f.GetListOfKeys():
+                name = k.GetName()
+                h = _asRP(k.ReadObj())
+                h.SetDirectory(0)
+
+                if name == 'nominal':
+                    responses[''] = h
+                elif name.startswith('syst_'):
+                    responses[name[len('syst_'):]] = h
+                elif name == 'pdf':
+                    pdfResponses = h
+                elif name.startswith('scale_'):
+                    scaleResponses[int(name[len('scale_'):])] = h
+
+        if '' not in responses or pdfResponses is None:
+            raise IOError("Incomplete response file")
+
+        self._responses = responses
+        self._pdfResponses = pdfResponses
+        self._scaleResponses = [scaleResponses[i] for i in sorted(scaleResponses)]
+
+
+    def getResponse(self, syst=''):
+        self._getAll()
+        return self._responses[syst]
+
+
+    __call__ = getResponse
+
+
+    def getPDFResponses(self):
+        self._getAll()
+        return self._pdfResponses
+
+
+    def getScaleResponses(self):
+        '''
+        List of the scale variation responses.
+        '''
+        self._getAll()
+        return self._scaleResponses
+
+
+    def knownSystematics(self):
+        self._getAll()
+        return [s for s in self._responses if s]
+
+
+    def hasSystematic(self, s):
+        self._getAll()
+        return s in self._responses
+
+
+
+class StoredResponseGroup(object):
+    '''
+    StoredResponseMakers for the same channel and input files, whose missing
+    responses are all made in one pass over each tree.
+    '''
+    def __init__(self, channel):
+        self.channel = channel
+        self._members = []
+
+
+    def add(self, resp):
+        '''
+        resp (StoredResponseMaker): must be for this channel, and must have
+            the same files registered as everything else in the group by the
+            time any responses are needed.
+        '''
+        if resp.channel != self.channel:
+            raise ValueError("Can't put a {} response maker in a {} "
+                             "group".format(resp.channel, self.channel))
+        if resp._group is not None and resp._group is not self:
+            raise ValueError("Response maker for {} is already in a "
+                             "group".format(resp.varName))
+
+        if resp._group is None:
+            resp._group = self
+            self._members.append(resp)
+
+
+    def __len__(self):
+        return len(self._members)
+
+
+    def _makeMissing(self):
+        '''
+        Read everything that's saved, and make (and save) everything else
+        with a CompositeResponseMatrixMaker.
+        '''
+        toMake = []
+        for resp in self._members:
+            if resp._responses is not None:
+                continue
+
+            storeFile = _storeFile(resp.key())
+            if not resp._readIfStored(storeFile):
+                toMake.append((resp, storeFile))
+
+        if not toMake:
+            return
+
+        files = toMake[0][0]._files
+        systFiles = toMake[0][0]._systFiles
+        for resp, storeFile in toMake[1:]:
+            if resp._files != files or resp._systFiles != systFiles:
+                raise ValueError("Response makers for {} and {} use different "
+                                 "files and can't be made "
+                                 "together".format(toMake[0][0].varName,
+                                                   resp.varName))
+
+        rlog.info("Making {} {} responses together".format(len(toMake),
+                                                           self.channel))
+
+        composite = _responseMatrixMakerClass('CompositeResponseMatrixMaker')(self.channel)
+        for fName in files:
+            composite.registerFile(fName)
+        for syst, fNames in systFiles.iteritems():
+            for fName in fNames:
+                composite.registerFile(fName, syst)
+
+        for resp, storeFile in toMake:
+            composite.addResponseMaker(resp._maker)
+
+        composite.setup()
+
+        for resp, storeFile in toMake:
+            resp._make()
+            resp._write(storeFile)
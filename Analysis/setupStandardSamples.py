@@ -9,19 +9,15 @@ from SampleTools import MCSample as _MC
 from SampleTools import DataSample as _Data
 from SampleTools import SampleGroup as _Group
 from SampleTools import SampleStack as _Stack
-from Utilities import WeightStringMaker as _Weight
 from Analysis.weightHelpers import leptonEfficiencyWeights as _leptonEfficiencyWeights
 from Analysis.weightHelpers import puWeight as _puWeight
 from Analysis.weightHelpers import baseMCWeight as _baseMCWeight
+from Analysis.fakeFactors import FakeFactors as _FakeFactors
 from Utilities.helpers import parseChannels as _parseChannels
 from Utilities.helpers import mapObjects as _mapObjects
 
-from rootpy.io import root_open as _open
-
-from os import environ as _env
 from os import path as _path
 from collections import OrderedDict as _ODict
-from re import compile as _reComp
 
 
 def _ensureNonneg(h):
@@ -53,15 +49,14 @@ def standardZZMC(channel, inDir, sampleName, resultType, puWeightFile, lumi,
                          'results_{}'.format(resultType),
                          '{}_*.root'.format(sampleName))
 
-    byChan = {
-        c : _MC(sampleName, c,
-                mcFiles, True, lumi) for c in channels
-        }
-
     if len(channels) == 1:
         mc = _MC(sampleName, channel, mcFiles, True, lumi)
         mc.applyWeight(mcWeight)
     else:
+        byChan = {
+            c : _MC(sampleName, c,
+                    mcFiles, True, lumi) for c in channels
+            }
         mc = _Group(sampleName, channel, byChan, True)
         mc.applyWeight(mcWeight)
 
@@ -251,53 +246,15 @@ def standardZZBkg(channel, dataDir, mcDir, resultType, puWeightFile,
                                lumi, eEfficiencySyst, mEfficiencySyst, puSyst,
                                skipEWK=True, **kwargs)
 
-    if  '.root' not in fakeRateFile:
-        fakeRateFile = fakeRateFile + '.root'
-    wCR = _Weight('fakeFactor')
-    with _open(_path.join(_env['zzt'], 'data', 'fakeRate',
-                          fakeRateFile)) as f:
-        fakeFactorStrE = wCR.makeWeightStringFromHist(f.fakeFactor_e, 'abs({lep}Eta)', '{lep}Pt')
-        fakeFactorStrM = wCR.makeWeightStringFromHist(f.fakeFactor_m, 'abs({lep}Eta)', '{lep}Pt')
-        if eFakeRateSyst.lower() == 'up':
-            fakeFactorStrE = '1.4 * {}'.format(fakeFactorStrE)
-        elif eFakeRateSyst.lower() in ['dn', 'down']:
-            fakeFactorStrE = '0.6 * {}'.format(fakeFactorStrE)
-        if mFakeRateSyst.lower() == 'up':
-            fakeFactorStrM = '1.4 * {}'.format(fakeFactorStrM)
-        elif mFakeRateSyst.lower() in ['dn', 'down']:
-            fakeFactorStrM = '0.6 * {}'.format(fakeFactorStrM)
-
     # CR samples weighted by fake factor
     # 2P2F is subtracted from 3P1F so weight it by -1
     # ... but MC CRs are subtracted from data CRs, so give them all opposite sign
     data2P2F.applyWeight('-1.')
     mc3P1F.applyWeight('-1.')
 
-    zCRWeightTemp = ('({{lep1}}ZZTightID && {{lep1}}ZZIsoPass ? 1. : {fr1}) * '
-                     '({{lep2}}ZZTightID && {{lep2}}ZZIsoPass ? 1. : {fr2})')
-
-    if abs(sipCut-4.) > 0.001:
-        idPattern = _reComp(r'(?<=(?P<lep>\{\{lep\d\}\})ZZTightID)')
-        idRepl = r'NoVtx && abs(\g<lep>PVDXY) < 0.5 && abs(\g<lep>PVDZ) < 1.'
-        if sipCut > 0:
-            idRepl += ' && \g<lep>SIP3D < {}'.format(sipCut)
-        zCRWeightTemp = idPattern.sub(idRepl, zCRWeightTemp,2)
-
-    zeCRWeight = zCRWeightTemp.format(fr1=fakeFactorStrE.format(lep='{lep1}'),
-                                      fr2=fakeFactorStrE.format(lep='{lep2}'))
-    zmCRWeight = zCRWeightTemp.format(fr1=fakeFactorStrM.format(lep='{lep1}'),
-                                      fr2=fakeFactorStrM.format(lep='{lep2}'))
-
-    crWeight = {
-        'eeee' : zeCRWeight.format(lep1='e1',lep2='e2') + ' * ' + zeCRWeight.format(lep1='e3',lep2='e4'),
-        'eemm' : zeCRWeight.format(lep1='e1',lep2='e2') + ' * ' + zmCRWeight.format(lep1='m1',lep2='m2'),
-        'mmmm' : zmCRWeight.format(lep1='m1',lep2='m2') + ' * ' + zmCRWeight.format(lep1='m3',lep2='m4'),
-        }
-
-    if len(channels) == 1:
-        crWt = crWeight[channels[0]]
-    else:
-        crWt = {c:crWeight[c] for c in channels}
+    crWt = _FakeFactors(fakeRateFile, sipCut).weightStrings(channels,
+                                                            eFakeRateSyst,
+                                                            mFakeRateSyst)
 
     data2P2F.applyWeight(crWt)
     data3P1F.applyWeight(crWt)
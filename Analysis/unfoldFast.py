@@ -10,32 +10,56 @@ gROOT.SetBatch(True)
 
 from rootpy import asrootpy
 from rootpy.io import root_open
-from rootpy.plotting import Canvas, Legend, Hist, HistStack, Graph
+from rootpy.plotting import Canvas, Legend, Hist, Hist2D, Hist3D, HistStack, Graph
 from rootpy.plotting.utils import draw
-from rootpy.ROOT import cout, TDecompSVD, TBox, TLatex, TLegend, TAttFill
+from rootpy.ROOT import cout, TDecompSVD, TBox, TLatex, TLegend, TAttFill, TMatrixD
 from rootpy.ROOT import RooUnfoldResponse as Response
 from rootpy.ROOT import RooUnfoldBayes as RooUnfoldIter # it's frequentist!
 from rootpy.context import preserve_current_directory
-import rootpy.compiled as _rootComp
 from rootpy.stl import vector as _Vec
 _VFloat = _Vec('float')
 
 from PlotTools import PlotStyle as _Style, pdfViaTex as _pdfViaTex
 from PlotTools import makeLegend, addPadsBelow, makeRatio, fixRatioAxes, makeErrorBand
 from Utilities import WeightStringMaker, Z_MASS, deltaRString, deltaPhiString, zeroNegativeBins, combineWeights
+from Utilities import cacheDirectory as _cacheDirectory
+from Utilities import fileSignature as _fileSignature
+from Utilities import histHash as _histHash
+from Utilities.histArrays import axisEdges as _axisEdges
+from Utilities.histArrays import histContents as _histContents
+from Utilities.histArrays import addToHist as _addToHist
+from Utilities.histArrays import rebinIndices as _rebinIndices
+from Utilities.histArrays import rebinArrays as _rebinArrays
+from Utilities.responseMatrixLibrary import responseMatrixMakerClass as _responseMatrixMakerClass
+from Utilities.responseMatrixLibrary import loadLibrary as _loadResponseMatrixLibrary
 from Analysis.setupStandardSamples import *
+from Analysis.setupStandardSamples import _ensureNonneg
+from Analysis.fakeFactors import FakeFactors as _FakeFactors
 # from Analysis.unfoldingHelpers import getResponse, getResponsePDFErrors, \
 #     getResponseScaleErrors, getResponseAlphaSErrors
-from Analysis.weightHelpers import puWeight, baseMCWeight
+from Analysis.weightHelpers import puWeight, baseMCWeight, baseMCWeightVariations
+from Analysis.bayesUnfolding import unfold as _unfoldArrays
+from Analysis.bayesUnfolding import responseArrays as _responseArrays
+from Analysis.bayesUnfolding import dataArrays as _dataArrays
+from Analysis.bayesUnfolding import responseErr2Array as _responseErr2Array
+from Analysis.bayesUnfolding import toyCovariance as _toyCovariance
+from Analysis.responseStore import StoredResponseMaker as _StoredResponseMaker
+from Analysis.responseStore import StoredResponseGroup as _StoredResponseGroup
 from Metadata.metadata import sampleInfo
 
 from os import environ as _env
 from os import makedirs as _mkdir
 from os import system as _bash
+from os import remove as _remove
+from os import getpid as _getpid
+from os import rename as _rename
 from os.path import join as _join
 from os.path import isdir as _isdir
 from os.path import exists as _exists
 from math import sqrt
+from hashlib import sha1 as _sha1
+from multiprocessing import Pool as _Pool
+import numpy as _np
 
 # need to load RooUnfold libraries for cling
 try:
@@ -128,6 +152,36 @@ _binning = {
     'l1Pt' : [0.,15.,30.,40.,50.]+[60.+15.*i for i in range(9)]+[195.,225.],#[14,0.,210.],#[15, 0., 150.],
     }
 
+# Uniform binnings for the fine-binned inputs (see _storeFineInputs). Every
+# bin edge in _binning (and in any binning you want to try) has to be a bin
+# edge here too, and the first and last edges have to be the same: the
+# responses put anything outside the range in the edge bins, so it can't be
+# moved to the underflow or overflow afterwards.
+_fineBinning = {
+    'pt' : [60, 0., 300.],
+    'nJets' : [5,-0.5,4.5],
+    'mass' : [140, 100., 800.],
+    'massFull' : [92, 80., 1000.],
+    'eta' : [60, 0., 6.],
+    'jet1Pt' : [50, 0., 500.],
+    'jet1Eta' : [47, 0., 4.7],
+    'jet2Pt' : [47, 30., 500.],
+    'jet2Eta' : [47, 0., 4.7],
+    'mjj' : [80, 0., 800.],
+    'deltaEtajj' : [60, 0., 6.],
+    'z1Mass' : [120, 60., 120.],
+    'z2Mass' : [120, 60., 120.],
+    'z1Pt' : [60, 0., 300.],
+    'z2Pt' : [60, 0., 300.],
+    'zPt' : [60, 0., 300.],
+    'zHigherPt' : [60, 0., 300.],
+    'zLowerPt' : [60, 0., 300.],
+    'deltaPhiZZ' : [65, 0., 3.25],
+    'deltaRZZ' : [60, 0., 6.],
+    'lPt' : [75, 0., 150.],
+    'l1Pt' : [45, 0., 225.],
+    }
+
 _units = {
     'pt' : 'GeV',
     'nJets' : '',
@@ -579,6 +633,114 @@ def _getUnfolded(hSig, hBkg, hTrue, hResponse, hData, nIter,
     return asrootpy(hOut)
 
 
+# set to False to unfold with the numpy implementation (all variations at
+# once) instead of RooUnfold. RooUnfold stays the default until the
+# comparison in Analysis/bayesUnfolding.py has been run against it.
+_useRooUnfold = True
+
+# number of Poisson toys to cross-check the nominal statistical uncertainty
+# with (0 for none)
+_nToys = 0
+
+def _tMatrix(arr):
+    out = TMatrixD(arr.shape[0], arr.shape[1])
+    for i in xrange(arr.shape[0]):
+        for j in xrange(arr.shape[1]):
+            out[i][j] = arr[i,j]
+    return out
+
+def _histFromUnfolded(hTrue, unfolded, cov):
+    hOut = hTrue.empty_clone()
+    for i, (n, v) in enumerate(zip(unfolded, _np.diagonal(cov))):
+        hOut.SetBinContent(i+1, n)
+        hOut.SetBinError(i+1, sqrt(max(v, 0.)))
+    return hOut
+
+
+def _getUnfoldedBatch(inputs, hData, nIter):
+    '''
+    Unfold hData for many sets of inputs at once.
+
+    inputs (dict): key -> (hSig, hBkg, hTrue, hResponse), with the same
+        meanings as for _getUnfolded.
+
+    Returns a dict of key -> unfolded histogram.
+    '''
+    if not inputs:
+        return {}
+
+    if _useRooUnfold:
+        return {k : _getUnfolded(hSig, hBkg, hTrue, hResponse, hData, nIter)
+                for k, (hSig, hBkg, hTrue, hResponse) in inputs.iteritems()}
+
+    keys = inputs.keys()
+
+    response, truth, measured = zip(*[_responseArrays(inputs[k][0],
+                                                      inputs[k][2],
+                                                      inputs[k][3])
+                                      for k in keys])
+    data, dataErr2 = zip(*[_dataArrays(hData, inputs[k][1]) for k in keys])
+
+    unfolded, cov = _unfoldArrays(_np.array(response), _np.array(truth),
+                                  _np.array(measured), _np.array(data),
+                                  nIter, _np.array(dataErr2))
+
+    return {k : _histFromUnfolded(inputs[k][2], unfolded[i], cov[i])
+            for i, k in enumerate(keys)}
+
+
+def _getUnfoldedWithCov(hSig, hBkg, hTrue, hResponse, hData, nIter):
+    '''
+    Unfolded histogram, covariance matrix (TMatrixD) and response
+    histogram, as from _getUnfolded with withRespAndCov=True.
+    '''
+    if _useRooUnfold:
+        return _getUnfolded(hSig, hBkg, hTrue, hResponse, hData, nIter, True)
+
+    response, truth, measured = _responseArrays(hSig, hTrue, hResponse)
+    data, dataErr2 = _dataArrays(hData, hBkg)
+
+    with _np.errstate(divide='ignore', invalid='ignore'):
+        mResponse = _np.where(truth > 0., response / truth, 0.)
+    print ''
+    print 'condition: {}'.format(_np.linalg.cond(mResponse))
+    print ''
+
+    unfolded, cov = _unfoldArrays(response, truth, measured, data, nIter,
+                                  dataErr2)
+
+    return (_histFromUnfolded(hTrue, unfolded, cov), _tMatrix(cov),
+            hResponse.clone())
+
+
+def _getToyCovariance(hSig, hBkg, hTrue, hResponse, hData, nIter, nToys):
+    '''
+    Statistical covariance and correlation matrices (TMatrixD) of the
+    unfolded spectrum from Poisson toys of the data and of the response
+    matrix MC. Also prints how the errors from toys of the data alone
+    compare to the propagated errors.
+    '''
+    response, truth, measured = _responseArrays(hSig, hTrue, hResponse)
+    data = _dataArrays(hData)[0]
+    bkg = _dataArrays(hBkg)[0]
+    dataMinusBkg, dataErr2 = _dataArrays(hData, hBkg)
+
+    cov = _unfoldArrays(response, truth, measured, dataMinusBkg, nIter,
+                        dataErr2)[1]
+    covDataToys = _toyCovariance(response, truth, measured, data, nIter,
+                                 nToys, bkg, seed=12345)[1]
+    print "Statistical errors from toys / propagated errors:"
+    print '  ' + ' '.join('{:.3f}'.format(r) for r in
+                          _np.sqrt(_np.diagonal(covDataToys) /
+                                   _np.diagonal(cov)))
+
+    toyCov, toyCorr = _toyCovariance(response, truth, measured, data, nIter,
+                                     nToys, bkg, _responseErr2Array(hResponse),
+                                     seed=12345)[1:]
+
+    return _tMatrix(toyCov), _tMatrix(toyCorr)
+
+
 def _generateAnalysisInputs(puWeightFile, looseSIP=False, noSIP=False,
                             sfRemake=False):
     sfFiles = {}
@@ -660,20 +822,8 @@ def _generateSamples(inData, inMC, ana, fakeRateFile, puWeightFile, lumi,
     allSamples['bkg'] = standardZZBkg('zz', inData, inMC, ana, puWeightFile,
                                       fakeRateFile, lumi,
                                       sipCut=sipForBkg)
-    allSamples['bkgSyst'] = {
-        'eup' : standardZZBkg('zz', inData, inMC, ana, puWeightFile,
-                              fakeRateFile, lumi, eFakeRateSyst='up',
-                              sipCut=sipForBkg),
-        'edn' : standardZZBkg('zz', inData, inMC, ana, puWeightFile,
-                              fakeRateFile, lumi, eFakeRateSyst='dn',
-                              sipCut=sipForBkg),
-        'mup' : standardZZBkg('zz', inData, inMC, ana, puWeightFile,
-                              fakeRateFile, lumi, mFakeRateSyst='up',
-                              sipCut=sipForBkg),
-        'mdn' : standardZZBkg('zz', inData, inMC, ana, puWeightFile,
-                              fakeRateFile, lumi, mFakeRateSyst='dn',
-                              sipCut=sipForBkg),
-        }
+    # fake factor shifts are made from the nominal Z+X samples
+    allSamples['fakeFactors'] = _FakeFactors(fakeRateFile, sipForBkg)
 
     allSamples['data'] = standardZZData('zz', inData, ana)
 
@@ -721,21 +871,21 @@ def _generateSamples(inData, inMC, ana, fakeRateFile, puWeightFile, lumi,
     return allSamples
 
 
-def _generateResponseClass(varName, channel, samples, hPUWt, hSF={}):
+def _generateResponseClass(varName, channel, samples, hPUWt, hSF={},
+                           groups=None, binning=None):
+    '''
+    If groups (dict) is given, makers are put in the StoredResponseGroups in
+    it (keyed by sample name and whether they are for the alternate signal,
+    and created as needed), so makers for different variables with the same
+    files are all filled in one pass over the ntuples.
+    If binning is not given, _binning[varName] is used.
+    '''
     className = _responseClassNames[varName][channel]
     if hSF:
         className = 'SFHist'+className
 
-    if not hasattr(_rootComp, className):
-        # compile the code and register all the classes
-        classesNeeded = set([cn for cv in _responseClassNames.values() for cn in cv.values()])
-        classesNeeded |= set(['SFHist'+cn for cn in classesNeeded])
-
-        _rootComp.register_file(_join(_zztBaseDir, 'Utilities',
-                                      'ResponseMatrixMaker.cxx'),
-                                list(classesNeeded))
-
-    C = getattr(_rootComp, className)
+    # all the classes are in one library, built once and saved
+    C = _responseMatrixMakerClass(className)
 
     sigFileNames = {s.name : [f for f in s.getFileNames()]
                     for s in samples['reco'].values()[0].getBaseSamples()}
@@ -749,7 +899,8 @@ def _generateResponseClass(varName, channel, samples, hPUWt, hSF={}):
                                 for s in samples['recoSyst'][syst].values()[0].getBaseSamples()}
                         for syst in samples['recoSyst']}
 
-    binning = _binning[varName]
+    if binning is None:
+        binning = _binning[varName]
     vBinning = _VFloat()
     if len(binning) == 3:
         binningTemp = [binning[1] + i * (binning[2] - binning[1])/float(binning[0]) for i in xrange(binning[0]+1)]
@@ -759,9 +910,12 @@ def _generateResponseClass(varName, channel, samples, hPUWt, hSF={}):
         for b in binning:
             vBinning.push_back(b)
 
+    # responses are saved, and only remade when their inputs change
     responseMakers = {}
     for sample, fNameList in sigFileNames.iteritems():
-        resp = C(channel, _varNamesForResponseMaker[varName][channel], vBinning)
+        resp = _StoredResponseMaker(C, className, channel,
+                                    _varNamesForResponseMaker[varName][channel],
+                                    vBinning)
 
         for fName in fNameList:
             resp.registerFile(fName)
@@ -782,11 +936,18 @@ def _generateResponseClass(varName, channel, samples, hPUWt, hSF={}):
 
         responseMakers[sample] = resp
 
+        if groups is not None:
+            if (sample, False) not in groups:
+                groups[(sample, False)] = _StoredResponseGroup(channel)
+            groups[(sample, False)].add(resp)
+
     altResponseMakers = {}
     for sample, fNameList in altSigFileNames.iteritems():
         if sample in responseMakers:
             continue
-        resp = C(channel, _varNamesForResponseMaker[varName][channel], vBinning)
+        resp = _StoredResponseMaker(C, className, channel,
+                                    _varNamesForResponseMaker[varName][channel],
+                                    vBinning)
 
         for fName in fNameList:
             resp.registerFile(fName)
@@ -802,15 +963,91 @@ def _generateResponseClass(varName, channel, samples, hPUWt, hSF={}):
 
         altResponseMakers[sample] = resp
 
+        if groups is not None:
+            if (sample, True) not in groups:
+                groups[(sample, True)] = _StoredResponseGroup(channel)
+            groups[(sample, True)].add(resp)
+
     return responseMakers, altResponseMakers
 
 
-def _unfold(varName, chan, samples, puWeightFile, sfFiles,
-            responseMakers, altResponseMakers, nIter, plotDir=''):
-    # outputs
-    hUnfolded = {}
-    hTrue = {}
-    hTrueAlt = {}
+# scale weights used for the QCD scale uncertainty
+_scaleVariations = [1,2,3,4,6,8]
+
+def _sumVariations(makeVariations, var, sel):
+    '''
+    makeVariations(var, sel) (a dict of variation name -> histogram), but
+    var and sel may be lists whose histograms are added together, like in
+    makeHist.
+    '''
+    if isinstance(var, str) and isinstance(sel, str):
+        return makeVariations(var, sel)
+
+    n = max(1 if isinstance(var, str) else len(var),
+            1 if isinstance(sel, str) else len(sel))
+    if isinstance(var, str):
+        var = n * [var]
+    if isinstance(sel, str):
+        sel = n * [sel]
+
+    out = None
+    for v, s in zip(var, sel):
+        hists = makeVariations(v, s)
+        if out is None:
+            out = hists
+        else:
+            for name, h in hists.iteritems():
+                out[name] += h
+
+    return out
+
+
+def _makeHistVariations(sample, var, sel, binning, weights):
+    '''
+    sample.makeHistVariations, but var and sel may be lists (see
+    _sumVariations).
+    '''
+    return _sumVariations(lambda v, s: sample.makeHistVariations(v, s, binning,
+                                                                 weights,
+                                                                 perUnitWidth=False),
+                          var, sel)
+
+
+def _mcWeightVariations(chan, puWeightFile, sfFiles):
+    '''
+    MC weights for the nominal and the PU and lepton efficiency shifts, as
+    input name suffix -> weight string.
+    '''
+    weightVariations = {
+        '' : 'nominal',
+        '_pu_up' : 'puUp',
+        '_pu_dn' : 'puDn',
+        }
+    for lep in set(chan):
+        weightVariations['_{}Eff_up'.format(lep)] = lep+'EffUp'
+        weightVariations['_{}Eff_dn'.format(lep)] = lep+'EffDn'
+    mcWeights = baseMCWeightVariations(chan, puWeightFile,
+                                       weightVariations.values(), **sfFiles)
+    return {suffix : mcWeights[v] for suffix, v in weightVariations.iteritems()}
+
+
+def _unfoldingInputs(varName, chan, samples, puWeightFile, sfFiles,
+                     responseMakers, altResponseMakers, binning,
+                     postprocess=True):
+    '''
+    Make all the histograms that go into unfolding varName in chan (data,
+    signal, background, truth and response, for the nominal and for every
+    systematic) with the given binning. They are all plain sums of weighted
+    events, so they can be rebinned afterwards. Anything that can't (PDF
+    RMSes, scale envelopes, the unfolding itself) is left for
+    _unfoldFromInputs.
+
+    If postprocess is False, the Z+X background histograms are not
+    postprocessed (it has to be done after any rebinning instead).
+
+    Returns a dict of name -> histogram.
+    '''
+    inputs = {}
 
     var = _variables[varName][chan]
     sel = _selections[varName][chan]
@@ -819,8 +1056,7 @@ def _unfold(varName, chan, samples, puWeightFile, sfFiles,
     else:
         selTrue = [combineWeights(s, _trueSelections[varName][chan], selections=True) for s in sel]
 
-    binning = _binning[varName]
-    hData = samples['data'][chan].makeHist(var, sel, binning, perUnitWidth=False)
+    inputs['data'] = samples['data'][chan].makeHist(var, sel, binning, perUnitWidth=False)
 
     # regular weight, no systematics. Apply just in case.
     nominalWeight = baseMCWeight(chan, puWeightFile,
@@ -834,94 +1070,34 @@ def _unfold(varName, chan, samples, puWeightFile, sfFiles,
         except KeyError:
             pass
 
-    hTrue[''] = samples['true'][chan].makeHist(var, selTrue, binning,
-                                               perUnitWidth=False)
-    hSigNominal = samples['reco'][chan].makeHist(var, sel, binning, perUnitWidth=False)
-    hBkgMCNominal = samples['bkgMC'][chan].makeHist(var, sel, binning, perUnitWidth=False)
-    hBkgNominal = samples['bkg'][chan].makeHist(var, sel, binning, perUnitWidth=False,
-                                                postprocess=True)
+    inputs['true'] = samples['true'][chan].makeHist(var, selTrue, binning,
+                                                    perUnitWidth=False)
+    inputs['bkg'] = samples['bkg'][chan].makeHist(var, sel, binning, perUnitWidth=False,
+                                                  postprocess=postprocess)
     hResponseNominal = {s:asrootpy(resp()) for s,resp in responseMakers.iteritems()}
     hResponseNominalTotal = sum(resp for resp in hResponseNominal.values())
+    inputs['response'] = hResponseNominalTotal
 
+    # nominal, PU reweight uncertainty and lepton efficiency uncertainty
+    # signal and MC background, each filled in one pass over the samples
+    weights = _mcWeightVariations(chan, puWeightFile, sfFiles)
 
-    hUnfolded[''], hCov, hResp = _getUnfolded(hSigNominal,
-                                              hBkgMCNominal+hBkgNominal,
-                                              hTrue[''],
-                                              hResponseNominalTotal,
-                                              hData, nIter, True)
-
-    # plot covariance and response
-    if plotDir:
-        cRes = Canvas(1000,1000)
-        if varName == 'massFull':
-            cRes.SetLogx()
-            cRes.SetLogy()
-        hResp.drawstyle = 'colztext'
-        hResp.xaxis.title = '\\text{Reco} '+_xTitle[varName]
-        hResp.yaxis.title = '\\text{True} '+_xTitle[varName]
-        hResp.draw()
-        _style.setCMSStyle(cRes, '', dataType='Internal', intLumi=35860.)
-        cRes.Print(_join(plotDir, 'pngs', "response_{}_{}.png".format(varName, chan)))
-        cRes.Print(_join(plotDir, 'Cs', "response_{}_{}.C".format(varName, chan)))
-
-        cCov = Canvas(1000,1000)
-        if varName == 'massFull':
-            cCov.SetLogx()
-            cCov.SetLogy()
-        hCov.Draw("colztext")
-        _style.setCMSStyle(cCov, '', dataType='Internal', intLumi=35860.)
-        cCov.Print(_join(plotDir, 'pngs', "covariance_{}_{}.png".format(varName, chan)))
-        cCov.Print(_join(plotDir, 'Cs', "covariance_{}_{}.C".format(varName, chan)))
-
-
-    # PU reweight uncertainty
-    for sys in ['up','dn']:
-        wtStr = baseMCWeight(chan, puWeightFile, puSyst=sys,
-                             **sfFiles)
-        samples['reco'][chan].applyWeight(wtStr, True)
-        samples['bkgMC'][chan].applyWeight(wtStr, True)
-
-        hSig = samples['reco'][chan].makeHist(var, sel, binning, perUnitWidth=False)
-        hBkgMC = samples['bkgMC'][chan].makeHist(var, sel, binning, perUnitWidth=False)
-
-        hResponse = sum(asrootpy(resp('pu_'+sys)) for resp in responseMakers.values())
-
-        hUnfolded['pu_'+sys] = _getUnfolded(hSig, hBkgMC+hBkgNominal,
-                                            hTrue[''], hResponse,
-                                            hData, nIter)
-
-        samples['reco'][chan].applyWeight(nominalWeight, True)
-        samples['bkgMC'][chan].applyWeight(nominalWeight, True)
-
-
-    # lepton efficiency uncertainty
-    for lep in set(chan):
-        for sys in ['up','dn']:
-            wtArg = {lep+'Syst':sys}
-            wtArg.update(sfFiles)
-            wtStr = baseMCWeight(chan, puWeightFile, **wtArg)
-            samples['reco'][chan].applyWeight(wtStr, True)
-            samples['bkgMC'][chan].applyWeight(wtStr, True)
-
-            hSig = samples['reco'][chan].makeHist(var, sel, binning, perUnitWidth=False)
-            hBkgMC = samples['bkgMC'][chan].makeHist(var, sel, binning, perUnitWidth=False)
-
-            hResponse = sum(asrootpy(resp(lep+'Eff_'+sys)) for resp in responseMakers.values())
+    for name, h in _makeHistVariations(samples['reco'][chan], var, sel,
+                                       binning, weights).iteritems():
+        inputs['sig'+name] = h
+    for name, h in _makeHistVariations(samples['bkgMC'][chan], var, sel,
+                                       binning, weights).iteritems():
+        inputs['bkgMC'+name] = h
 
-            hUnfolded[lep+'Eff_'+sys] = _getUnfolded(hSig,
-                                                     hBkgMC+hBkgNominal,
-                                                     hTrue[''],
-                                                     hResponse,
-                                                     hData, nIter)
-
-            samples['reco'][chan].applyWeight(nominalWeight, True)
-            samples['bkgMC'][chan].applyWeight(nominalWeight, True)
+    for suffix in weights:
+        if suffix:
+            inputs['response'+suffix] = sum(asrootpy(resp(suffix[1:])) for resp in responseMakers.values())
 
     # alternate generator
-    hSig = samples['altReco'][chan].makeHist(var, sel, binning,
-                                             perUnitWidth=False)
-    hTrueAlt[''] = samples['altTrue'][chan].makeHist(var, selTrue, binning,
-                                                     perUnitWidth=False)
+    inputs['sig_generator'] = samples['altReco'][chan].makeHist(var, sel, binning,
+                                                                perUnitWidth=False)
+    inputs['trueAlt'] = samples['altTrue'][chan].makeHist(var, selTrue, binning,
+                                                          perUnitWidth=False)
     hResponses = []
     altSigFileNames = {s.name : [f for f in s.getFileNames()]
                        for s in samples['altReco'].values()[0].getBaseSamples()}
@@ -930,41 +1106,23 @@ def _unfold(varName, chan, samples, puWeightFile, sfFiles,
             hResponses.append(asrootpy(altResponseMakers[s]()))
         except KeyError:
             hResponses.append(hResponseNominal[s])
-    hResponse = sum(h for h in hResponses)
-
-    hUnfolded['generator'] = _getUnfolded(hSig,
-                                          hBkgMCNominal+hBkgNominal,
-                                          hTrueAlt[''],
-                                          hResponse,
-                                          hData, nIter)
-
-    # luminosity
-    lumiUnc = 0.025
-    lumiScale = {'up':1.+lumiUnc,'dn':1.-lumiUnc}
-    for sys, scale in lumiScale.iteritems():
-        hSig = hSigNominal * scale
-        hBkgMC = hBkgMCNominal * scale
-        hTrueLumiShift = hTrue[''] * scale
-        hResponse = hResponseNominalTotal * scale
+    inputs['response_generator'] = sum(h for h in hResponses)
 
-        hUnfolded['lumi_'+sys] = _getUnfolded(hSig,
-                                              hBkgMC+hBkgNominal,
-                                              hTrueLumiShift,
-                                              hResponse,
-                                              hData, nIter)
-
-    # lepton fake rate uncertainty
+    # lepton fake rate uncertainty, all shifts in one pass over the nominal
+    # Z+X samples
+    frVariations = {}
     for lep in set(chan):
         for sys in ['up','dn']:
-            hBkg = samples['bkgSyst'][lep+sys][chan].makeHist(var, sel, binning,
-                                                              perUnitWidth=False,
-                                                              postprocess=True)
-
-            hUnfolded[lep+'FR_'+sys] = _getUnfolded(hSigNominal,
-                                                    hBkgMCNominal+hBkg,
-                                                    hTrue[''],
-                                                    hResponseNominalTotal,
-                                                    hData, nIter)
+            frVariations['bkg_'+lep+'FR_'+sys] = lep+'FR'+sys.capitalize()
+    fakeFactors = samples['fakeFactors']
+    hFR = _sumVariations(lambda v, s: fakeFactors.makeHistVariations(samples['bkg'][chan],
+                                                                     v, s, binning,
+                                                                     frVariations.values()),
+                         var, sel)
+    for name, v in frVariations.iteritems():
+        inputs[name] = hFR[v]
+        if postprocess:
+            _ensureNonneg(inputs[name])
 
     # jet stuff
     if 'jet' in varName.lower() or 'jj' in varName.lower():
@@ -976,20 +1134,14 @@ def _unfold(varName, chan, samples, puWeightFile, sfFiles,
                 varShifted = _variables[shiftedVarName][chan]
                 selShifted = _selections[shiftedVarName][chan]
 
-                hSig = samples['reco'][chan].makeHist(varShifted, selShifted,
-                                                      binning,
-                                                      perUnitWidth=False)
-                hBkgMC = samples['bkgMC'][chan].makeHist(varShifted, selShifted,
-                                                         binning,
-                                                         perUnitWidth=False)
-
-                hResponse = sum(asrootpy(resp(sys+'_'+shift)) for resp in responseMakers.values())
-
-                hUnfolded[sys+'_'+shift] = _getUnfolded(hSig,
-                                                        hBkgMC+hBkgNominal,
-                                                        hTrue[''],
-                                                        hResponse,
-                                                        hData, nIter)
+                syst = sys+'_'+shift
+                inputs['sig_'+syst] = samples['reco'][chan].makeHist(varShifted, selShifted,
+                                                                     binning,
+                                                                     perUnitWidth=False)
+                inputs['bkgMC_'+syst] = samples['bkgMC'][chan].makeHist(varShifted, selShifted,
+                                                                        binning,
+                                                                        perUnitWidth=False)
+                inputs['response_'+syst] = sum(asrootpy(resp(syst)) for resp in responseMakers.values())
 
     # lepton momentum uncertainties
     if 'e' in chan:
@@ -999,51 +1151,258 @@ def _unfold(varName, chan, samples, puWeightFile, sfFiles,
                     continue
                 sysStr = 'Up' if shift == 'up' else 'Dn'
 
-                hSig = samples['recoSyst'][sys+sysStr][chan].makeHist(var, sel,
-                                                                      binning,
-                                                                      perUnitWidth=False)
-                hBkgMC = samples['bkgMCSyst'][sys+sysStr][chan].makeHist(var, sel,
-                                                                         binning,
-                                                                         perUnitWidth=False)
-                hResponse = sum(asrootpy(resp(sys+'_'+shift)) for resp in responseMakers.values())
-
                 storeAs = sys+'_'+shift
                 if sys == 'ePhiRes':
                     storeAs = sys
-                hUnfolded[storeAs] = _getUnfolded(hSig,
-                                                  hBkgMC+hBkgNominal,
-                                                  hTrue[''],
-                                                  hResponse,
-                                                  hData, nIter)
+
+                inputs['sig_'+storeAs] = samples['recoSyst'][sys+sysStr][chan].makeHist(var, sel,
+                                                                                        binning,
+                                                                                        perUnitWidth=False)
+                inputs['bkgMC_'+storeAs] = samples['bkgMCSyst'][sys+sysStr][chan].makeHist(var, sel,
+                                                                                           binning,
+                                                                                           perUnitWidth=False)
+                inputs['response_'+storeAs] = sum(asrootpy(resp(sys+'_'+shift)) for resp in responseMakers.values())
     if 'm' in chan:
         sys = 'mClosure'
         for shift in ['up','dn']:
             sysStr = 'Up' if shift == 'up' else 'Dn'
 
-            hSig = samples['recoSyst'][sys+sysStr][chan].makeHist(var, sel,
-                                                                  binning,
-                                                                  perUnitWidth=False)
-            hBkgMC = samples['bkgMCSyst'][sys+sysStr][chan].makeHist(var, sel,
-                                                                     binning,
-                                                                     perUnitWidth=False)
-            hResponse = sum(asrootpy(resp(sys+'_'+shift)) for resp in responseMakers.values())
-
-            hUnfolded[sys+'_'+shift] = _getUnfolded(hSig,
-                                                    hBkgMC+hBkgNominal,
-                                                    hTrue[''],
-                                                    hResponse,
-                                                    hData, nIter)
-
-    # PDF uncertainties
-    hSigVariations = []
+            syst = sys+'_'+shift
+            inputs['sig_'+syst] = samples['recoSyst'][sys+sysStr][chan].makeHist(var, sel,
+                                                                                 binning,
+                                                                                 perUnitWidth=False)
+            inputs['bkgMC_'+syst] = samples['bkgMCSyst'][sys+sysStr][chan].makeHist(var, sel,
+                                                                                    binning,
+                                                                                    perUnitWidth=False)
+            inputs['response_'+syst] = sum(asrootpy(resp(syst)) for resp in responseMakers.values())
+
+    # PDF uncertainties (variable vs. PDF variation for each sample)
+    iSample = 0
     for s in samples['reco'][chan].values():
         if 'GluGluZZ' not in s.name and 'phantom' not in s.name:
-            hSigVariations.append(s.makeHist2(var, 'Iteration$', sel, binning,
-                                              [100,0.,100.], 'pdfWeights/pdfWeights[0]', False))
-    hResponseVariations = []
+            inputs['sigPDF_{}'.format(iSample)] = s.makeHist2(var, 'Iteration$', sel, binning,
+                                                              [100,0.,100.], 'pdfWeights/pdfWeights[0]', False)
+            iSample += 1
+    iSample = 0
     for s, resp in responseMakers.iteritems():
         if "GluGluZZ" not in s and 'phantom' not in s:
-            hResponseVariations.append(asrootpy(resp.getPDFResponses()))
+            inputs['responsePDF_{}'.format(iSample)] = asrootpy(resp.getPDFResponses())
+            iSample += 1
+    iSample = 0
+    for s in samples['true'][chan].values():
+        if 'GluGluZZ' not in s.name and 'phantom' not in s.name:
+            inputs['truePDF_{}'.format(iSample)] = s.makeHist2(var, 'Iteration$', selTrue, binning,
+                                                               [100,0.,100.], 'pdfWeights/pdfWeights[0]', False)
+            iSample += 1
+    iSample = 0
+    for s in samples['altTrue'][chan].values():
+        if 'GluGluZZ' not in s.name and 'phantom' not in s.name:
+            inputs['trueAltPDF_{}'.format(iSample)] = s.makeHist2(var, 'Iteration$', selTrue, binning,
+                                                                  [100,0.,100.], 'pdfWeights/pdfWeights[0]', False)
+            iSample += 1
+
+    # QCD scale uncertainties
+    for i in _scaleVariations:
+        scaleWeight = {
+            'ZZTo4L':'scaleWeights[{}]/scaleWeights[0]'.format(i),
+            'ZZTo4L-amcatnlo':'scaleWeights[{}]/scaleWeights[0]'.format(i),
+            'ZZJJTo4L_EWK':'scaleWeights[{}]/scaleWeights[0]'.format(i),
+            }
+        inputs['sig_scale_{}'.format(i)] = samples['reco'][chan].makeHist(var, sel, binning,
+                                                                          scaleWeight,
+                                                                          perUnitWidth=False)
+        inputs['true_scale_{}'.format(i)] = samples['true'][chan].makeHist(var, selTrue, binning,
+                                                                           scaleWeight,
+                                                                           perUnitWidth=False)
+        inputs['trueAlt_scale_{}'.format(i)] = samples['altTrue'][chan].makeHist(var, selTrue, binning,
+                                                                                 scaleWeight,
+                                                                                 perUnitWidth=False)
+
+    hResponseVariations = [hResponseNominalTotal.empty_clone() for v in _scaleVariations]
+    for s, resp in responseMakers.iteritems():
+        vResponses = resp.getScaleResponses()
+        if len(vResponses) == len(hResponseVariations):
+            for iResp in xrange(len(vResponses)):
+                hResponseVariations[iResp] += asrootpy(vResponses[iResp])
+        else:
+            for hrv in hResponseVariations:
+                hrv += hResponseNominal[s]
+    for i, hResponse in zip(_scaleVariations, hResponseVariations):
+        inputs['response_scale_{}'.format(i)] = hResponse
+
+    # alpha_s uncertainties
+    for i, sys in zip([100,101], ['up','dn']):
+        alphaSWeight = {
+            'ZZTo4L':'pdfWeights[{}]/pdfWeights[0]'.format(i),
+            'ZZTo4L-amcatnlo':'pdfWeights[{}]/pdfWeights[0]'.format(i),
+            'ZZJJTo4L_EWK':'pdfWeights[{}]/pdfWeights[0]'.format(i),
+            }
+        inputs['sig_alphaS_'+sys] = samples['reco'][chan].makeHist(var, sel, binning,
+                                                                   alphaSWeight,
+                                                                   perUnitWidth=False)
+        inputs['true_alphaS_'+sys] = samples['true'][chan].makeHist(var, selTrue, binning,
+                                                                    alphaSWeight,
+                                                                    perUnitWidth=False)
+        inputs['trueAlt_alphaS_'+sys] = samples['altTrue'][chan].makeHist(var, selTrue, binning,
+                                                                          alphaSWeight,
+                                                                          perUnitWidth=False)
+
+    hResponses = [hResponseNominalTotal.empty_clone(),
+                  hResponseNominalTotal.empty_clone()]
+    for s, resp in responseMakers.iteritems():
+        if resp.hasSystematic('alphaS_up'):
+            hResponses[0] += asrootpy(resp('alphaS_up'))
+            hResponses[1] += asrootpy(resp('alphaS_dn'))
+        else:
+            hResponses[0] += hResponseNominal[s]
+            hResponses[1] += hResponseNominal[s]
+    inputs['response_alphaS_up'] = hResponses[0]
+    inputs['response_alphaS_dn'] = hResponses[1]
+
+    # since MCFM samples don't have LHE information, we just vary by
+    # the cross section uncertainties
+    mcfmUnc = {'up':.18,'dn':-.15}
+    for sys, shift in mcfmUnc.iteritems():
+        inputs['sig_mcfmxsec_'+sys] = samples['reco'][chan].makeHist(var, sel, binning,
+                                                                     {'GluGluZZ':str(1.+shift)},
+                                                                     perUnitWidth=False)
+        inputs['true_mcfmxsec_'+sys] = samples['true'][chan].makeHist(var, selTrue, binning,
+                                                                      {'GluGluZZ':str(1.+shift)},
+                                                                      perUnitWidth=False)
+        inputs['trueAlt_mcfmxsec_'+sys] = samples['altTrue'][chan].makeHist(var, selTrue, binning,
+                                                                            {'GluGluZZ':str(1.+shift)},
+                                                                            perUnitWidth=False)
+        hResponse = hResponseNominalTotal.empty_clone()
+        for s, h in hResponseNominal.iteritems():
+            if 'GluGluZZ' in s:
+                hResponse += h * (1.+shift)
+            else:
+                hResponse += h
+        inputs['response_mcfmxsec_'+sys] = hResponse
+
+    return inputs
+
+
+def _unfoldFromInputs(varName, chan, inputs, nIter, plotDir=''):
+    '''
+    Unfold varName in chan for the nominal and all systematics, from
+    histograms made by _unfoldingInputs (at any binning).
+
+    Returns dicts of systematic -> histogram for the unfolded, true and
+    alternate-generator true distributions.
+    '''
+    # outputs
+    hUnfolded = {}
+    hTrue = {'' : inputs['true']}
+    hTrueAlt = {'' : inputs['trueAlt']}
+
+    hData = inputs['data']
+    hSigNominal = inputs['sig']
+    hBkgMCNominal = inputs['bkgMC']
+    hBkgNominal = inputs['bkg']
+    hResponseNominalTotal = inputs['response']
+
+    def numbered(prefix):
+        return [h for k, h in sorted(inputs.iteritems())
+                if k.startswith(prefix+'_')]
+
+    hUnfolded[''], hCov, hResp = _getUnfoldedWithCov(hSigNominal,
+                                                     hBkgMCNominal+hBkgNominal,
+                                                     hTrue[''],
+                                                     hResponseNominalTotal,
+                                                     hData, nIter)
+
+    # inputs for all the variations, which are unfolded together at the end
+    toUnfold = {}
+
+    # plot covariance and response
+    if plotDir:
+        cRes = Canvas(1000,1000)
+        if varName == 'massFull':
+            cRes.SetLogx()
+            cRes.SetLogy()
+        hResp.drawstyle = 'colztext'
+        hResp.xaxis.title = '\\text{Reco} '+_xTitle[varName]
+        hResp.yaxis.title = '\\text{True} '+_xTitle[varName]
+        hResp.draw()
+        _style.setCMSStyle(cRes, '', dataType='Internal', intLumi=35860.)
+        cRes.Print(_join(plotDir, 'pngs', "response_{}_{}.png".format(varName, chan)))
+        cRes.Print(_join(plotDir, 'Cs', "response_{}_{}.C".format(varName, chan)))
+
+        cCov = Canvas(1000,1000)
+        if varName == 'massFull':
+            cCov.SetLogx()
+            cCov.SetLogy()
+        hCov.Draw("colztext")
+        _style.setCMSStyle(cCov, '', dataType='Internal', intLumi=35860.)
+        cCov.Print(_join(plotDir, 'pngs', "covariance_{}_{}.png".format(varName, chan)))
+        cCov.Print(_join(plotDir, 'Cs', "covariance_{}_{}.C".format(varName, chan)))
+
+    if _nToys:
+        hCovToys, hCorrToys = _getToyCovariance(hSigNominal,
+                                                hBkgMCNominal+hBkgNominal,
+                                                hTrue[''],
+                                                hResponseNominalTotal,
+                                                hData, nIter, _nToys)
+
+        if plotDir:
+            for name, m in [('covarianceToys', hCovToys),
+                            ('correlationToys', hCorrToys)]:
+                c = Canvas(1000,1000)
+                m.Draw("colztext")
+                _style.setCMSStyle(c, '', dataType='Internal', intLumi=35860.)
+                c.Print(_join(plotDir, 'pngs', "{}_{}_{}.png".format(name, varName, chan)))
+                c.Print(_join(plotDir, 'Cs', "{}_{}_{}.C".format(name, varName, chan)))
+
+
+    # systematics that change the signal, MC background and response
+    simpleSysts = ['pu_up', 'pu_dn']
+    simpleSysts += [lep+'Eff_'+sys for lep in set(chan) for sys in ['up','dn']]
+    if 'jet' in varName.lower() or 'jj' in varName.lower():
+        simpleSysts += [sys+'_'+shift for shift in ['up','dn'] for sys in ['jer','jes']]
+    if 'e' in chan:
+        simpleSysts += ['eScale_up', 'eScale_dn', 'eRhoRes_up', 'eRhoRes_dn',
+                        'ePhiRes']
+    if 'm' in chan:
+        simpleSysts += ['mClosure_up', 'mClosure_dn']
+
+    for syst in simpleSysts:
+        toUnfold[syst] = (inputs['sig_'+syst],
+                          inputs['bkgMC_'+syst]+hBkgNominal,
+                          hTrue[''],
+                          inputs['response_'+syst])
+
+    # alternate generator
+    toUnfold['generator'] = (inputs['sig_generator'],
+                             hBkgMCNominal+hBkgNominal,
+                             hTrueAlt[''],
+                             inputs['response_generator'])
+
+    # luminosity
+    lumiUnc = 0.025
+    lumiScale = {'up':1.+lumiUnc,'dn':1.-lumiUnc}
+    for sys, scale in lumiScale.iteritems():
+        hSig = hSigNominal * scale
+        hBkgMC = hBkgMCNominal * scale
+        hTrueLumiShift = hTrue[''] * scale
+        hResponse = hResponseNominalTotal * scale
+
+        toUnfold['lumi_'+sys] = (hSig,
+                                 hBkgMC+hBkgNominal,
+                                 hTrueLumiShift,
+                                 hResponse)
+
+    # lepton fake rate uncertainty
+    for lep in set(chan):
+        for sys in ['up','dn']:
+            toUnfold[lep+'FR_'+sys] = (hSigNominal,
+                                       hBkgMCNominal+inputs['bkg_'+lep+'FR_'+sys],
+                                       hTrue[''],
+                                       hResponseNominalTotal)
+
+    # PDF uncertainties
+    hSigVariations = numbered('sigPDF')
+    hResponseVariations = numbered('responsePDF')
 
     # for each var bin in each sample, get the RMS across all the variations
     allSigRMSes = [[Graph(h.ProjectionY('slice{}'.format(i), i+1,i+1)).GetRMS(2) for i in xrange(h.GetNbinsX())] for h in hSigVariations]
@@ -1071,65 +1430,34 @@ def _unfold(varName, chan, samples, puWeightFile, sfFiles,
 
     hTrue['pdf_up'] = hTrue[''].clone()
     hTrue['pdf_dn'] = hTrue[''].clone()
-    hTrueVariations = []
-    for s in samples['true'][chan].values():
-        if 'GluGluZZ' not in s.name and 'phantom' not in s.name:
-            hTrueVariations.append(s.makeHist2(var, 'Iteration$', selTrue, binning,
-                                               [100,0.,100.], 'pdfWeights/pdfWeights[0]', False))
+    hTrueVariations = numbered('truePDF')
     allTrueRMSes = [[Graph(h.ProjectionY('slice{}'.format(i), i+1,i+1)).GetRMS(2) for i in xrange(h.GetNbinsX())] for h in hTrueVariations]
     binTrueRMSes = [sum(rmses) for rmses in zip(*allTrueRMSes)]
 
-    #hTruePDFErr[chan] = hTrue.empty_clone() # save true variation for later
     for i in xrange(hTrue['pdf_up'].GetNbinsX()):
         hTrue['pdf_up'][i+1].value += binTrueRMSes[i]
         hTrue['pdf_dn'][i+1].value = max(0.,hTrue['pdf_dn'][i+1].value - binTrueRMSes[i])
-        #hTruePDFErr[chan][i+1].value = binTrueRMSes[i]
 
     # get the other sample's uncertainty too as long as we're at it
-    #hTruePDFErrAlt[chan] = hTrueAlt.empty_clone()
     hTrueAlt['pdf_up'] = hTrueAlt[''].clone()
     hTrueAlt['pdf_dn'] = hTrueAlt[''].clone()
-    hTrueVariationsAlt = []
-    for s in samples['altTrue'][chan].values():
-        if 'GluGluZZ' not in s.name and 'phantom' not in s.name:
-            hTrueVariationsAlt.append(s.makeHist2(var, 'Iteration$', selTrue, binning,
-                                                  [100,0.,100.], 'pdfWeights/pdfWeights[0]', False))
+    hTrueVariationsAlt = numbered('trueAltPDF')
     allTrueRMSesAlt = [[Graph(h.ProjectionY('slice{}'.format(i), i+1,i+1)).GetRMS(2) for i in xrange(h.GetNbinsX())] for h in hTrueVariationsAlt]
     binTrueRMSesAlt = [sum(rmses) for rmses in zip(*allTrueRMSesAlt)]
     for i in xrange(hTrueAlt['pdf_up'].GetNbinsX()):
         hTrueAlt['pdf_up'][i+1].value += binTrueRMSesAlt[i]
         hTrueAlt['pdf_dn'][i+1].value = max(0.,hTrueAlt['pdf_dn'][i+1].value - binTrueRMSesAlt[i])
-        #hTruePDFErrAlt[chan][i+1].value = binTrueRMSesAlt[i]
 
 
-    hUnfolded['pdf_up'] = _getUnfolded(hSigUp,
-                                       hBkgMCNominal+hBkgNominal,
-                                       hTrue['pdf_up'], hResponseUp,
-                                       hData, nIter)
-    hUnfolded['pdf_dn'] = _getUnfolded(hSigDn,
-                                       hBkgMCNominal+hBkgNominal,
-                                       hTrue['pdf_dn'], hResponseDn,
-                                       hData, nIter)
+    toUnfold['pdf_up'] = (hSigUp,
+                          hBkgMCNominal+hBkgNominal,
+                          hTrue['pdf_up'], hResponseUp)
+    toUnfold['pdf_dn'] = (hSigDn,
+                          hBkgMCNominal+hBkgNominal,
+                          hTrue['pdf_dn'], hResponseDn)
 
     # QCD scale uncertainties
-    variationIndices = [1,2,3,4,6,8]
-    hSigs = [samples['reco'][chan].makeHist(var, sel, binning,
-                                            {
-                'ZZTo4L':'scaleWeights[{}]/scaleWeights[0]'.format(i),
-                'ZZTo4L-amcatnlo':'scaleWeights[{}]/scaleWeights[0]'.format(i),
-                'ZZJJTo4L_EWK':'scaleWeights[{}]/scaleWeights[0]'.format(i),
-                },
-                                            perUnitWidth=False)
-             for i in variationIndices]
-
-    hTrues = [samples['true'][chan].makeHist(var, selTrue, binning,
-                                             {
-                'ZZTo4L':'scaleWeights[{}]/scaleWeights[0]'.format(i),
-                'ZZTo4L-amcatnlo':'scaleWeights[{}]/scaleWeights[0]'.format(i),
-                'ZZJJTo4L_EWK':'scaleWeights[{}]/scaleWeights[0]'.format(i),
-                },
-                                             perUnitWidth=False)
-              for i in variationIndices]
+    hTrues = [inputs['true_scale_{}'.format(i)] for i in _scaleVariations]
     nominalArea = hTrue[''].Integral(0,hTrue[''].GetNbinsX()+1)
     for h in hTrues:
         h *= nominalArea / h.Integral(0,h.GetNbinsX()+1)
@@ -1144,14 +1472,7 @@ def _unfold(varName, chan, samples, puWeightFile, sfFiles,
         bDn.value = min(b.value for b in variations)
 
     # get the true-level uncertainty too while we're at it
-    hTruesAlt = [samples['altTrue'][chan].makeHist(var, selTrue, binning,
-                                        {
-                'ZZTo4L':'scaleWeights[{}]/scaleWeights[0]'.format(i),
-                'ZZTo4L-amcatnlo':'scaleWeights[{}]/scaleWeights[0]'.format(i),
-                'ZZJJTo4L_EWK':'scaleWeights[{}]/scaleWeights[0]'.format(i),
-                },
-                                        perUnitWidth=False)
-                 for i in variationIndices]
+    hTruesAlt = [inputs['trueAlt_scale_{}'.format(i)] for i in _scaleVariations]
     nominalAreaAlt = hTrueAlt[''].Integral(0,hTrueAlt[''].GetNbinsX()+1)
     for h in hTruesAlt:
         h *= nominalAreaAlt / h.Integral(0,h.GetNbinsX()+1)
@@ -1164,23 +1485,38 @@ def _unfold(varName, chan, samples, puWeightFile, sfFiles,
         bUp.value = max(b.value for b in variations)
         bDn.value = min(b.value for b in variations)
 
-    hResponseVariations = [hResponseNominalTotal.empty_clone() for v in variationIndices]
-    for s, resp in responseMakers.iteritems():
-        vResponses = resp.getScaleResponses()
-        if vResponses.size() == len(hResponseVariations):
-            for iResp in xrange(vResponses.size()):
-                hResponseVariations[iResp] += asrootpy(vResponses.at(iResp))
-        else:
-            for hrv in hResponseVariations:
-                hrv += hResponseNominal[s]
+    scaleKeys = []
+    for i, hTr in zip(_scaleVariations, hTrues):
+        scaleKeys.append('scale_{}'.format(i))
+        toUnfold[scaleKeys[-1]] = (inputs['sig_scale_{}'.format(i)],
+                                   hBkgMCNominal+hBkgNominal,
+                                   hTr, inputs['response_scale_{}'.format(i)])
 
-    hUnfoldedVariations = []
-    for hSig, hTr, hResponse in zip(hSigs, hTrues, hResponseVariations):
-        hUnfoldedVariations.append(_getUnfolded(hSig,
-                                                hBkgMCNominal+hBkgNominal,
-                                                hTr, hResponse,
-                                                hData, nIter))
+    # alpha_s uncertainties
+    for sys in ['up','dn']:
+        hTrue['alphaS_'+sys] = inputs['true_alphaS_'+sys]
+        hTrueAlt['alphaS_'+sys] = inputs['trueAlt_alphaS_'+sys]
 
+        toUnfold['alphaS_'+sys+'Raw'] = (inputs['sig_alphaS_'+sys],
+                                         hBkgNominal+hBkgMCNominal,
+                                         hTrue['alphaS_'+sys],
+                                         inputs['response_alphaS_'+sys])
+
+    # MCFM cross section uncertainties
+    for sys in ['up','dn']:
+        hTrue['mcfmxsec_'+sys] = inputs['true_mcfmxsec_'+sys]
+        hTrueAlt['mcfmxsec_'+sys] = inputs['trueAlt_mcfmxsec_'+sys]
+
+        toUnfold['mcfmxsec_'+sys] = (inputs['sig_mcfmxsec_'+sys],
+                                     hBkgNominal+hBkgMCNominal,
+                                     hTrue['mcfmxsec_'+sys],
+                                     inputs['response_mcfmxsec_'+sys])
+
+    # unfold all the variations at once
+    hUnfolded.update(_getUnfoldedBatch(toUnfold, hData, nIter))
+
+    # scale uncertainty is the envelope of all the variations
+    hUnfoldedVariations = [hUnfolded.pop(k) for k in scaleKeys]
     hUnfoldedUp = hUnfoldedVariations[0].empty_clone()
     hUnfoldedDn = hUnfoldedVariations[0].empty_clone()
     for bUp, bDn, bVars in zip(hUnfoldedUp, hUnfoldedDn, zip(*hUnfoldedVariations)):
@@ -1190,56 +1526,9 @@ def _unfold(varName, chan, samples, puWeightFile, sfFiles,
     hUnfolded['scale_up'] = hUnfoldedUp
     hUnfolded['scale_dn'] = hUnfoldedDn
 
-    # alpha_s uncertainties
-    alphaSIndices = [100,101]
-    hSigs = [samples['reco'][chan].makeHist(var, sel, binning,
-                         {
-                'ZZTo4L':'pdfWeights[{}]/pdfWeights[0]'.format(i),
-                'ZZTo4L-amcatnlo':'pdfWeights[{}]/pdfWeights[0]'.format(i),
-                'ZZJJTo4L_EWK':'pdfWeights[{}]/pdfWeights[0]'.format(i),
-                },
-                         perUnitWidth=False)
-            for i in alphaSIndices]
-    hTrues = [samples['true'][chan].makeHist(var, selTrue, binning,
-                          {
-                'ZZTo4L':'pdfWeights[{}]/pdfWeights[0]'.format(i),
-                'ZZTo4L-amcatnlo':'pdfWeights[{}]/pdfWeights[0]'.format(i),
-                'ZZJJTo4L_EWK':'pdfWeights[{}]/pdfWeights[0]'.format(i),
-                },
-                          perUnitWidth=False)
-             for i in alphaSIndices]
-
-    hTrue['alphaS_up'] = hTrues[0]
-    hTrue['alphaS_dn'] = hTrues[1]
-
-    hTruesAlt = [samples['altTrue'][chan].makeHist(var, selTrue, binning,
-                                                   {
-                'ZZTo4L':'pdfWeights[{}]/pdfWeights[0]'.format(i),
-                'ZZTo4L-amcatnlo':'pdfWeights[{}]/pdfWeights[0]'.format(i),
-                'ZZJJTo4L_EWK':'pdfWeights[{}]/pdfWeights[0]'.format(i),
-                },
-                                                   perUnitWidth=False)
-                 for i in alphaSIndices]
-
-    hTrueAlt['alphaS_up'] = hTruesAlt[0]
-    hTrueAlt['alphaS_dn'] = hTruesAlt[1]
-
-    hResponses = [hResponseNominalTotal.empty_clone(),
-                  hResponseNominalTotal.empty_clone()]
-    for s, resp in responseMakers.iteritems():
-        if resp.hasSystematic('alphaS_up'):
-            hResponses[0] += asrootpy(resp('alphaS_up'))
-            hResponses[1] += asrootpy(resp('alphaS_dn'))
-        else:
-            hResponses[0] += hResponseNominal[s]
-            hResponses[1] += hResponseNominal[s]
-
-    hUnfUp = _getUnfolded(hSigs[0], hBkgNominal+hBkgMCNominal,
-                          hTrues[0], hResponses[0],
-                          hData, nIter)
-    hUnfDn = _getUnfolded(hSigs[1], hBkgNominal+hBkgMCNominal,
-                          hTrues[1], hResponses[1],
-                          hData, nIter)
+    # alpha_s uncertainty is symmetrized
+    hUnfUp = hUnfolded.pop('alphaS_upRaw')
+    hUnfDn = hUnfolded.pop('alphaS_dnRaw')
 
     unc = hUnfUp - hUnfDn
     unc /= 2.
@@ -1249,32 +1538,6 @@ def _unfold(varName, chan, samples, puWeightFile, sfFiles,
     hUnfolded['alphaS_up'] = hUnfolded[''] + unc
     hUnfolded['alphaS_dn'] = hUnfolded[''] - unc
 
-    # since MCFM samples don't have LHE information, we just vary by
-    # the cross section uncertainties
-    mcfmUnc = {'up':.18,'dn':-.15}
-    for sys, shift in mcfmUnc.iteritems():
-        hSig = samples['reco'][chan].makeHist(var, sel, binning,
-                                              {'GluGluZZ':str(1.+shift)},
-                                              perUnitWidth=False)
-        hTrue['mcfmxsec_'+sys] = samples['true'][chan].makeHist(var, selTrue, binning,
-                                                                {'GluGluZZ':str(1.+shift)},
-                                                                perUnitWidth=False)
-        hTrueAlt['mcfmxsec_'+sys] = samples['altTrue'][chan].makeHist(var, selTrue, binning,
-                                                                      {'GluGluZZ':str(1.+shift)},
-                                                                      perUnitWidth=False)
-        hResponse = hResponseNominalTotal.empty_clone()
-        for s, h in hResponseNominal.iteritems():
-            if 'GluGluZZ' in s:
-                hResponse += h * (1.+shift)
-            else:
-                hResponse += h
-
-        hUnfolded['mcfmxsec_'+sys] = _getUnfolded(hSig,
-                                                  hBkgNominal+hBkgMCNominal,
-                                                  hTrue['mcfmxsec_'+sys],
-                                                  hResponse,
-                                                  hData, nIter)
-
     # make everything local (we'll cache copies)
     for h in hUnfolded.values()+hTrue.values()+hTrueAlt.values():
         h.SetDirectory(0)
@@ -1282,6 +1545,196 @@ def _unfold(varName, chan, samples, puWeightFile, sfFiles,
     return hUnfolded, hTrue, hTrueAlt
 
 
+def _sampleFiles(samples):
+    '''
+    All the input files of samples (a sample or group, or a dict of them).
+    '''
+    if hasattr(samples, 'getFileNames'):
+        return set(samples.getFileNames())
+
+    out = set()
+    if isinstance(samples, dict):
+        for s in samples.values():
+            out |= _sampleFiles(s)
+    return out
+
+
+# analysis input arguments -> key for the fine-binned inputs
+_fineInputKeys = {}
+
+def _fineInputKey(inputArgs):
+    '''
+    Hash of everything the fine-binned inputs for analysis inputs inputArgs
+    depend on: the arguments themselves, the current versions of all the
+    sample files, and the PU, scale factor and fake factor histograms the
+    weights come from (like the keys of stored responses).
+    '''
+    if inputArgs not in _fineInputKeys:
+        sfFiles, hPUWt, hSF, samples = _analysisSamples(inputArgs)
+
+        h = _sha1()
+        h.update('args={!r};'.format(inputArgs))
+        h.update('files={};'.format(_fileSignature(*sorted(_sampleFiles(samples)))))
+        for name, hist in sorted(hPUWt.items()):
+            h.update('pu{}={};'.format(name, _histHash(hist)))
+        for name, hist in sorted(hSF.items()):
+            h.update('sf{}={};'.format(name, _histHash(hist)))
+        for flavor, hist in sorted(samples['fakeFactors'].histograms().items()):
+            h.update('fakeFactor{}={};'.format(flavor, _histHash(hist)))
+
+        _fineInputKeys[inputArgs] = h.hexdigest()[:16]
+
+    return _fineInputKeys[inputArgs]
+
+
+def _fineInputFile(varName, chan, inputArgs):
+    '''
+    Where the fine-binned inputs for varName in chan are stored, for analysis
+    inputs inputArgs (the same tuple as for _unfoldInWorker).
+    '''
+    return _join(_cacheDirectory('unfoldFineInputs'),
+                 '{}_{}_{}.npz'.format(varName, chan,
+                                       _fineInputKey(inputArgs)))
+
+
+def _storeFineInputs(varName, chan, inputArgs, inputs):
+    '''
+    Save unfolding inputs made with _fineBinning[varName] (and without
+    postprocessing) as arrays, so any binning whose bin edges are all fine bin
+    edges can be made from them later without touching the ntuples.
+
+    Returns the inputs as arrays, the same as _storedFineInputs.
+    '''
+    arrays = {}
+    for name, h in inputs.iteritems():
+        contents, sumW2 = _histContents(h)
+        axes = [_axisEdges(ax) for ax in [h.GetXaxis(), h.GetYaxis(),
+                                          h.GetZaxis()][:h.GetDimension()]]
+        arrays[name] = (contents, sumW2, axes, int(h.GetEntries()))
+
+    toSave = {'fineBinning' : _np.array(_fineBinning[varName], dtype=float)}
+    for name, (contents, sumW2, axes, nEntries) in arrays.iteritems():
+        toSave[name+'.contents'] = contents
+        toSave[name+'.sumW2'] = sumW2
+        toSave[name+'.entries'] = _np.array(nEntries)
+        for i, edges in enumerate(axes):
+            toSave['{}.axis{}'.format(name, i)] = edges
+
+    storeFile = _fineInputFile(varName, chan, inputArgs)
+    tmpFile = '{}.tmp{}.npz'.format(storeFile[:-4], _getpid())
+    with open(tmpFile, 'wb') as f:
+        _np.savez(f, **toSave)
+    _rename(tmpFile, storeFile)
+
+    return arrays
+
+
+def _storedFineInputs(varName, chan, inputArgs):
+    '''
+    Fine-binned unfolding inputs for varName in chan, as name -> (contents,
+    squared weights, list of bin edges for each axis, number of entries),
+    or None if they haven't been stored with the current _fineBinning.
+    '''
+    storeFile = _fineInputFile(varName, chan, inputArgs)
+    if not _exists(storeFile):
+        return None
+
+    inputs = {}
+    try:
+        with _np.load(storeFile) as stored:
+            if list(stored['fineBinning']) != [float(b) for b in _fineBinning[varName]]:
+                rlog.info("Remaking fine-binned inputs {} for new binning".format(storeFile))
+                return None
+
+            names = set(k.split('.')[0] for k in stored.files if '.' in k)
+            for name in names:
+                nAxes = len([k for k in stored.files
+                             if k.startswith(name+'.axis')])
+                inputs[name] = (stored[name+'.contents'],
+                                stored[name+'.sumW2'],
+                                [stored['{}.axis{}'.format(name, i)]
+                                 for i in xrange(nAxes)],
+                                int(stored[name+'.entries']))
+    except Exception as e:
+        rlog.warning("Remaking unreadable fine-binned inputs {} ({})".format(storeFile, e))
+        return None
+
+    return inputs
+
+
+def _rebinInputs(inputs, binning):
+    '''
+    Unfolding inputs (name -> histogram, as from _unfoldingInputs) with
+    binning, made from fine-binned inputs (as from _storedFineInputs). The
+    variable's axes are rebinned (both axes of responses, x for everything
+    else); the PDF variation axes are left alone. The Z+X background is
+    postprocessed here, after rebinning.
+
+    binning must cover the same range as the fine binning, because the
+    fine-binned responses already have everything outside that range in
+    their edge bins.
+    '''
+    if len(binning) == 3:
+        edges = [binning[1] + i * (binning[2] - binning[1]) / float(binning[0])
+                 for i in xrange(binning[0]+1)]
+        binArgs = list(binning)
+    else:
+        edges = binning
+        binArgs = [list(binning)]
+
+    out = {}
+    for name, (contents, sumW2, axes, nEntries) in inputs.iteritems():
+        nVarAxes = 2 if name.startswith('response') else 1
+
+        for axEdges in axes[:nVarAxes]:
+            tolerance = 1e-6 * (axEdges[-1] - axEdges[0])
+            if abs(edges[0] - axEdges[0]) > tolerance or \
+                    abs(edges[-1] - axEdges[-1]) > tolerance:
+                raise ValueError("Can't rebin {} from [{}, {}] to [{}, {}]: "
+                                 "the range has to stay the "
+                                 "same".format(name, axEdges[0], axEdges[-1],
+                                               edges[0], edges[-1]))
+
+        indices = [_rebinIndices(axEdges, edges) if i < nVarAxes else None
+                   for i, axEdges in enumerate(axes)]
+        contents, sumW2 = _rebinArrays([contents, sumW2],
+                                       [len(axEdges)+1 for axEdges in axes],
+                                       indices)
+
+        histArgs = []
+        for i, axEdges in enumerate(axes):
+            if i < nVarAxes:
+                histArgs += binArgs
+            else:
+                histArgs.append([float(b) for b in axEdges])
+        h = [Hist, Hist2D, Hist3D][len(axes)-1](*histArgs, type='D')
+        _addToHist(h, contents, sumW2, nEntries)
+
+        # same as samples['bkg'][chan].makeHist(..., postprocess=True)
+        if name == 'bkg' or name.startswith('bkg_'):
+            _ensureNonneg(h)
+
+        out[name] = h
+
+    return out
+
+
+def _fineBinnedInputs(varName, chan, inputArgs, redoFine=False):
+    '''
+    Unfolding inputs for varName in chan at _binning[varName], rebinned from
+    the stored fine-binned inputs, or None if those need to be made (they
+    aren't stored, or redoFine is True).
+    '''
+    if redoFine:
+        return None
+
+    inputs = _storedFineInputs(varName, chan, inputArgs)
+    if inputs is None:
+        return None
+
+    return _rebinInputs(inputs, _binning[varName])
+
+
 def _sumUncertainties(errDict):
     hUncUp = errDict['up'].values()[0].empty_clone()
     hUncDn = errDict['dn'].values()[0].empty_clone()
@@ -1937,10 +2390,279 @@ def _generatePlots(hUnfolded, hUncUp, hUncDn,
     #gStyle.SetHatchesSpacing(hatchSpace)
 
 
+
+def _readCachedUnfolding(cacheFileName, varName, chan):
+    '''
+    Get (hUnfolded, hTrue, hTrueAlt) dicts (systematic -> histogram) for one
+    variable and channel from a cache file. Raises an exception if they
+    aren't there.
+    '''
+    with root_open(cacheFileName, 'UPDATE') as cacheFile:
+        chanDir = getattr(cacheFile, chan)
+        varDir = getattr(chanDir, varName)
+
+        hUnfolded = {h.name:h.clone() for h in varDir.unfolded.objects()}
+        hUnfolded[''] = varDir.hUnfolded.clone()
+        for h in hUnfolded.values():
+            h.SetDirectory(0)
+
+        hTrue = {h.name:h.clone() for h in varDir.true.objects()}
+        hTrue[''] = varDir.hTrue.clone()
+        for h in hTrue.values():
+            h.SetDirectory(0)
+
+        hTrueAlt = {h.name:h.clone() for h in varDir.trueAlt.objects()}
+        hTrueAlt[''] = varDir.hTrueAlt.clone()
+        for h in hTrueAlt.values():
+            h.SetDirectory(0)
+
+    return hUnfolded, hTrue, hTrueAlt
+
+
+def _cacheUnfolding(cacheFileName, varName, chan, hUnfolded, hTrue, hTrueAlt):
+    '''
+    Save unfolded and true histograms for one variable and channel in a cache
+    file, replacing whatever was there for them.
+    '''
+    with root_open(cacheFileName, 'UPDATE') as cacheFile:
+        if not hasattr(cacheFile, chan):
+            cacheFile.mkdir(chan)
+        chanDir = getattr(cacheFile, chan)
+        if hasattr(chanDir, varName):
+            chanDir.rm(varName)
+        varDir = chanDir.mkdir(varName)
+
+        varDir['hTrue'] = hTrue[''].clone(name='hTrue')
+        if hasattr(varDir, 'true'):
+            varDir.rm('true')
+        trueDir = varDir.mkdir('true')
+        for syst, hist in hTrue.iteritems():
+            if syst:
+                hist.name = syst
+                trueDir[syst] = hist.clone(name=syst)
+
+        varDir['hTrueAlt'] = hTrueAlt[''].clone('hTrueAlt')
+        if hasattr(varDir, 'trueAlt'):
+            varDir.rm('trueAlt')
+        trueDirAlt = varDir.mkdir('trueAlt')
+        for syst, hist in hTrueAlt.iteritems():
+            if syst:
+                hist.name = syst
+                trueDirAlt[syst] = hist.clone(name=syst)
+
+        varDir['hUnfolded'] = hUnfolded[''].clone(name='hUnfolded')
+        if hasattr(varDir, 'unfolded'):
+            varDir.rm('unfolded')
+        unfDir = varDir.mkdir('unfolded')
+        for syst, hist in hUnfolded.iteritems():
+            if syst:
+                hist.name = syst
+                unfDir[syst] = hist.clone(name=syst)
+
+
+# analysis inputs and samples, keyed by the arguments used to make them.
+# Workers forked after the main process makes them just use its copy.
+_workerInputs = {}
+
+def _analysisSamples(inputArgs):
+    '''
+    (sfFiles, hPUWt, hSF, samples) for analysis inputs inputArgs (the same
+    tuple as for _unfoldInWorker), made once per process.
+    '''
+    if inputArgs not in _workerInputs:
+        (inData, inMC, ana, fakeRateFile, puWeightFile, lumi, amcatnlo,
+         looseSIP, noSIP, sfRemake) = inputArgs
+
+        sfFiles, hPUWt, hSF, sipForBkg = _generateAnalysisInputs(puWeightFile,
+                                                                 looseSIP,
+                                                                 noSIP,
+                                                                 sfRemake)
+        samples = _generateSamples(inData, inMC, ana, fakeRateFile,
+                                   puWeightFile, lumi, amcatnlo, sipForBkg,
+                                   sfFiles)
+        _workerInputs[inputArgs] = (sfFiles, hPUWt, hSF, samples)
+
+    return _workerInputs[inputArgs]
+
+
+def _needsInputs(varName, chan, inputArgs, fineBinned, redoFine):
+    '''
+    Whether unfolding varName in chan has to go back to the samples (i.e.,
+    there are no stored fine-binned inputs to use).
+    '''
+    if not fineBinned or redoFine:
+        return True
+
+    return _storedFineInputs(varName, chan, inputArgs) is None
+
+
+def _makeResponsesInWorker(job):
+    '''
+    Make the responses for all of varNames in one channel in a worker
+    process (for main with jobs > 1), with one StoredResponseGroup per
+    sample so everything that isn't saved yet is made in one pass over
+    each tree. The workers unfolding each variable then just read them.
+    Returns the channel.
+    '''
+    chan, varNames, inputArgs, fineBinned = job
+
+    sfFiles, hPUWt, hSF, samples = _analysisSamples(inputArgs)
+
+    groups = {}
+    makers = [_generateResponseClass(v, chan, samples, hPUWt, hSF, groups,
+                                     _fineBinning[v] if fineBinned else None)
+              for v in varNames]
+
+    # asking for a response makes everything missing in its group
+    for responseMakers, altResponseMakers in makers:
+        for resp in responseMakers.values() + altResponseMakers.values():
+            resp()
+
+    return chan
+
+
+def _unfoldInWorker(job):
+    '''
+    Unfold one variable in one channel in a worker process (for main with
+    jobs > 1), and save the results in a cache file of their own for the
+    main process to merge. Returns (varName, chan, file name).
+    '''
+    global _useRooUnfold
+    global _nToys
+
+    (varName, chan, inputArgs, nIter, plotDir, useRooUnfold, nToys,
+     fineBinned, redoFine) = job
+
+    # module settings from the command line, in case this process didn't
+    # inherit them
+    _useRooUnfold = useRooUnfold
+    _nToys = nToys
+
+    puWeightFile = inputArgs[4]
+
+    inputs = None
+    if fineBinned:
+        inputs = _fineBinnedInputs(varName, chan, inputArgs, redoFine)
+
+    if inputs is None:
+        sfFiles, hPUWt, hSF, samples = _analysisSamples(inputArgs)
+
+        binning = _fineBinning[varName] if fineBinned else _binning[varName]
+
+        # the responses were saved by _makeResponsesInWorker
+        responseMakers, altResponseMakers = _generateResponseClass(varName, chan,
+                                                                   samples, hPUWt,
+                                                                   hSF,
+                                                                   binning=binning)
+
+        inputs = _unfoldingInputs(varName, chan, samples, puWeightFile,
+                                  sfFiles, responseMakers, altResponseMakers,
+                                  binning, not fineBinned)
+
+        if fineBinned:
+            inputs = _rebinInputs(_storeFineInputs(varName, chan, inputArgs,
+                                                   inputs),
+                                  _binning[varName])
+
+    hUnfolded, hTrue, hTrueAlt = _unfoldFromInputs(varName, chan, inputs,
+                                                   nIter, plotDir)
+
+    outFile = '{}_{}_{}_{}.root'.format(_cacheFileTemplate.format(nIter)[:-5],
+                                        varName, chan, _getpid())
+    _cacheUnfolding(outFile, varName, chan, hUnfolded, hTrue, hTrueAlt)
+
+    return varName, chan, outFile
+
+
+def _unfoldInParallel(units, jobs, inputArgs, nIter, plotDir,
+                      fineBinned=False, redoFine=False):
+    '''
+    Unfold (varName, chan) units with a pool of jobs processes. Each worker
+    saves its results in its own file; they are merged into the main cache
+    here, one at a time, as they finish.
+
+    Everything the workers share is made here before they start: the
+    response matrix maker library, the samples and analysis inputs, and
+    all the weight functions (made in batch mode and compiled together
+    once, instead of separately in each worker). Then the responses are
+    made with one job per channel, and then the units are unfolded.
+
+    Returns the set of units that were done.
+    '''
+    # build the response matrix maker library once, before the workers need it
+    _loadResponseMatrixLibrary()
+
+    toMake = [(varName, chan) for varName, chan in units
+              if _needsInputs(varName, chan, inputArgs, fineBinned, redoFine)]
+
+    toDo = [(varName, chan, inputArgs, nIter, plotDir, _useRooUnfold, _nToys,
+             fineBinned, redoFine)
+            for varName, chan in units]
+
+    oldBatchMode = WeightStringMaker.batchMode
+    WeightStringMaker.batchMode = True
+    pool = None
+    try:
+        if toMake:
+            puWeightFile = inputArgs[4]
+            sfFiles, hPUWt, hSF, samples = _analysisSamples(inputArgs)
+            for chan in set(chan for varName, chan in toMake):
+                baseMCWeight(chan, puWeightFile, **sfFiles)
+                _mcWeightVariations(chan, puWeightFile, sfFiles)
+        WeightStringMaker.compileAll()
+
+        pool = _Pool(min(jobs, len(toDo)))
+
+        if toMake:
+            responseJobs = [(chan, [v for v, c in toMake if c == chan],
+                             inputArgs, fineBinned)
+                            for chan in set(c for v, c in toMake)]
+            for chan in pool.imap_unordered(_makeResponsesInWorker,
+                                            responseJobs):
+                print "Made {} responses".format(chan)
+
+        done = set()
+        for varName, chan, outFile in pool.imap_unordered(_unfoldInWorker,
+                                                          toDo):
+            _cacheUnfolding(_cacheFileTemplate.format(nIter), varName, chan,
+                            *_readCachedUnfolding(outFile, varName, chan))
+            _remove(outFile)
+            done.add((varName, chan))
+            print "Finished {} {} ({} of {})".format(varName, chan,
+                                                     len(done), len(toDo))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        WeightStringMaker.batchMode = oldBatchMode
+
+    return done
+
+
 def main(inData, inMC, plotDir, fakeRateFile, puWeightFile, lumi, nIter,
          amcatnlo=False, norm=True, logy=False, looseSIP=False, noSIP=False,
          sfRemake=False, forceRedo=False, *varNames, **kwargs):
+    '''
+    kwargs may include
+        jobs (int): if more than 1, everything that needs to be unfolded (not
+            cached, or everything with forceRedo) is unfolded by a pool of
+            this many processes first: the responses with one job per
+            channel, then one variable and channel per job.
+            Plots are still made here afterwards.
+        fineBinned (bool): make all the unfolding inputs once with
+            _fineBinning, store them, and rebin them to _binning every time
+            after that instead of going back to the ntuples. Everything is
+            unfolded again every time (it's fast from stored inputs).
+        redoFine (bool): remake the stored fine-binned inputs (e.g. after
+            the ntuples change).
+    '''
     channels = _channels[:]
+    jobs = kwargs.get('jobs', 1)
+    fineBinned = kwargs.get('fineBinned', False)
+    redoFine = kwargs.get('redoFine', False)
+
+    if fineBinned:
+        forceRedo = True
 
     plotType = '' #'Preliminary'
 
@@ -1965,6 +2687,50 @@ def main(inData, inMC, plotDir, fakeRateFile, puWeightFile, lumi, nIter,
     sfFiles = None
     hPUWt = None
     hSF = None
+    # channel -> variable -> (responseMakers, altResponseMakers)
+    responseMakersByChan = {}
+    # channel -> StoredResponseGroups the response makers are in
+    responseGroupsByChan = {}
+
+    # everything the analysis inputs depend on
+    inputArgs = (inData, inMC, ana, fakeRateFile, puWeightFile, lumi,
+                 amcatnlo, looseSIP, noSIP, sfRemake)
+
+    # (varName, chan) -> already unfolded and cached by workers
+    madeInParallel = set()
+
+    def needsInputs(varName, chan):
+        '''
+        Whether varName in chan will be unfolded from inputs made from the
+        samples here (it isn't done already or cached, and there are no
+        stored fine-binned inputs for it).
+        '''
+        if (varName, chan) in madeInParallel:
+            return False
+        if not forceRedo:
+            try:
+                _readCachedUnfolding(_cacheFileTemplate.format(nIter),
+                                     varName, chan)
+                return False
+            except Exception:
+                pass
+        return _needsInputs(varName, chan, inputArgs, fineBinned, redoFine)
+    if jobs > 1:
+        units = []
+        for varName in varNames:
+            for chan in channels[::-1]:
+                if not forceRedo:
+                    try:
+                        _readCachedUnfolding(_cacheFileTemplate.format(nIter),
+                                             varName, chan)
+                        continue
+                    except Exception:
+                        pass
+                units.append((varName, chan))
+
+        if units:
+            madeInParallel = _unfoldInParallel(units, jobs, inputArgs, nIter,
+                                               plotDir, fineBinned, redoFine)
 
     for varName in varNames:
 
@@ -1985,28 +2751,13 @@ def main(inData, inMC, plotDir, fakeRateFile, puWeightFile, lumi, nIter,
             print ""
 
             # if the histograms are cached, get them (unless we don't want to)
-            needToCreate = forceRedo
+            needToCreate = forceRedo and (varName, chan) not in madeInParallel
 
             if not needToCreate:
                 try:
-                    with root_open(_cacheFileTemplate.format(nIter), 'UPDATE') as cacheFile:
-                        chanDir = getattr(cacheFile, chan)
-                        varDir = getattr(chanDir, varName)
-
-                        hUnfolded[chan] = {h.name:h.clone() for h in varDir.unfolded.objects()}
-                        hUnfolded[chan][''] = varDir.hUnfolded.clone()
-                        for h in hUnfolded[chan].values():
-                            h.SetDirectory(0)
-
-                        hTrue[chan] = {h.name:h.clone() for h in varDir.true.objects()}
-                        hTrue[chan][''] = varDir.hTrue.clone()
-                        for h in hTrue[chan].values():
-                            h.SetDirectory(0)
-
-                        hTrueAlt[chan] = {h.name:h.clone() for h in varDir.trueAlt.objects()}
-                        hTrueAlt[chan][''] = varDir.hTrueAlt.clone()
-                        for h in hTrueAlt[chan].values():
-                            h.SetDirectory(0)
+                    hUnfolded[chan], hTrue[chan], hTrueAlt[chan] = _readCachedUnfolding(
+                        _cacheFileTemplate.format(nIter), varName, chan
+                        )
                 except Exception as e:
                     rlog.warning("Rebuilding everything. Reason:")
                     rlog.warning('    '+str(e))
@@ -2015,58 +2766,53 @@ def main(inData, inMC, plotDir, fakeRateFile, puWeightFile, lumi, nIter,
             # otherwise, we have to make everything
             # this can't be an else with the previous if
             if needToCreate:
-                if samples is None:
-                    sfFiles, hPUWt, hSF, sipForBkg = _generateAnalysisInputs(puWeightFile,
-                                                                             looseSIP,
-                                                                             noSIP,
-                                                                             sfRemake)
-                    samples = _generateSamples(inData, inMC, ana, fakeRateFile,
-                                               puWeightFile, lumi, amcatnlo,
-                                               sipForBkg, sfFiles)
-
-                responseMakers, altResponseMakers = _generateResponseClass(
-                    varName, chan, samples, hPUWt, hSF
-                    )
-
-                hUnfolded[chan], hTrue[chan], hTrueAlt[chan] = _unfold(
-                    varName, chan, samples, puWeightFile, sfFiles,
-                    responseMakers, altResponseMakers, nIter, plotDir
+                inputs = None
+                if fineBinned:
+                    inputs = _fineBinnedInputs(varName, chan, inputArgs,
+                                               redoFine)
+
+                if inputs is None:
+                    if samples is None:
+                        sfFiles, hPUWt, hSF, samples = _analysisSamples(inputArgs)
+
+                    # make the response makers for all variables that still
+                    # need them in this channel at once, so they can all be
+                    # filled in one pass over the ntuples
+                    if chan not in responseMakersByChan:
+                        responseMakersByChan[chan] = {}
+                        responseGroupsByChan[chan] = {}
+                    if varName not in responseMakersByChan[chan]:
+                        for v in varNames:
+                            if v in responseMakersByChan[chan]:
+                                continue
+                            if v != varName and not needsInputs(v, chan):
+                                continue
+                            responseMakersByChan[chan][v] = _generateResponseClass(
+                                v, chan, samples, hPUWt, hSF,
+                                responseGroupsByChan[chan],
+                                _fineBinning[v] if fineBinned else None)
+
+                    responseMakers, altResponseMakers = responseMakersByChan[chan][varName]
+
+                    binning = _fineBinning[varName] if fineBinned else _binning[varName]
+                    inputs = _unfoldingInputs(varName, chan, samples,
+                                              puWeightFile, sfFiles,
+                                              responseMakers, altResponseMakers,
+                                              binning, not fineBinned)
+
+                    if fineBinned:
+                        inputs = _rebinInputs(_storeFineInputs(varName, chan,
+                                                               inputArgs,
+                                                               inputs),
+                                              _binning[varName])
+
+                hUnfolded[chan], hTrue[chan], hTrueAlt[chan] = _unfoldFromInputs(
+                    varName, chan, inputs, nIter, plotDir
                     )
 
-                with root_open(_cacheFileTemplate.format(nIter), 'UPDATE') as cacheFile:
-                    if not hasattr(cacheFile, chan):
-                        cacheFile.mkdir(chan)
-                    chanDir = getattr(cacheFile, chan)
-                    if hasattr(chanDir, varName):
-                        chanDir.rm(varName)
-                    varDir = chanDir.mkdir(varName)
-
-                    varDir['hTrue'] = hTrue[chan][''].clone(name='hTrue')
-                    if hasattr(varDir, 'true'):
-                        varDir.rm('true')
-                    trueDir = varDir.mkdir('true')
-                    for syst, hist in hTrue[chan].iteritems():
-                        if syst:
-                            hist.name = syst
-                            trueDir[syst] = hist.clone(name=syst)
-
-                    varDir['hTrueAlt'] = hTrueAlt[chan][''].clone('hTrueAlt')
-                    if hasattr(varDir, 'trueAlt'):
-                        varDir.rm('trueAlt')
-                    trueDirAlt = varDir.mkdir('trueAlt')
-                    for syst, hist in hTrueAlt[chan].iteritems():
-                        if syst:
-                            hist.name = syst
-                            trueDirAlt[syst] = hist.clone(name=syst)
-
-                    varDir['hUnfolded'] = hUnfolded[chan][''].clone(name='hUnfolded')
-                    if hasattr(varDir, 'unfolded'):
-                        varDir.rm('unfolded')
-                    unfDir = varDir.mkdir('unfolded')
-                    for syst, hist in hUnfolded[chan].iteritems():
-                        if syst:
-                            hist.name = syst
-                            unfDir[syst] = hist.clone(name=syst)
+                _cacheUnfolding(_cacheFileTemplate.format(nIter), varName,
+                                chan, hUnfolded[chan], hTrue[chan],
+                                hTrueAlt[chan])
 
             hErr[chan]= _generateUncertainties(hUnfolded[chan], norm,
                                                lumi=lumi, varName=varName,
@@ -2154,9 +2900,32 @@ if __name__ == "__main__":
                         help='Use homebrewed scale factors for electrons.')
     parser.add_argument('--redo', action='store_true',
                         help='Make new histograms even if some are cached.')
+    parser.add_argument('--numpyUnfold', action='store_true',
+                        help=('Unfold all variations at once with numpy '
+                              'instead of one at a time with RooUnfold.'))
+    parser.add_argument('--toys', type=int, default=0,
+                        help=('Number of Poisson toys (of data and response '
+                              'MC statistics) for statistical covariance and '
+                              'correlation matrices of the nominal result '
+                              '(default: no toys).'))
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help=('Number of processes to unfold variables and '
+                              'channels in parallel (default: 1, '
+                              'everything in this process).'))
+    parser.add_argument('--fineBinned', action='store_true',
+                        help=('Make all histograms and responses once with a '
+                              'fine uniform binning, store them, and rebin '
+                              'them to the binning in _binning on later runs '
+                              '(for trying out binnings quickly).'))
+    parser.add_argument('--redoFine', action='store_true',
+                        help=('With --fineBinned, remake the stored '
+                              'fine-binned histograms and responses.'))
 
     args=parser.parse_args()
 
+    _useRooUnfold = not args.numpyUnfold
+    _nToys = args.toys
+
     if not _exists(args.plotDir):
         _mkdir(args.plotDir)
     elif not _isdir(args.plotDir):
@@ -2165,5 +2934,6 @@ if __name__ == "__main__":
     main(args.dataDir, args.mcDir, args.plotDir, args.fakeRateFile,
          args.puWeightFile, args.lumi, args.nIter, args.amcatnlo,
          not args.noNorm, args.logy, args.looseSIP, args.noSIP, args.sfRemake,
-         args.redo, *args.variables)
+         args.redo, *args.variables, jobs=args.jobs,
+         fineBinned=args.fineBinned, redoFine=args.redoFine)
 
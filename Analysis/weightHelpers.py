@@ -46,6 +46,29 @@ def leptonEfficiencyWeights(channel, eSystematic='', mSystematic=''):
 
 _sfStrings = {'e':{},'m':{}}
 
+_sfFunctions = {}
+def _sfFunctionString(fileName, histName, *variables, **kwargs):
+    '''
+    Weight string (template) for histogram histName in file fileName in
+    ZZTools/data/leptonScaleFactors, made only once for each histogram and
+    set of arguments so nominal and shifted weights use the same functions
+    (and parts they have in common are only computed once when they're made
+    together; see NtupleSample.makeHistVariations).
+    kwargs are passed to WeightStringMaker.makeWeightStringFromHist.
+    '''
+    key = (fileName, histName, variables, tuple(sorted(kwargs.iteritems())))
+    if key not in _sfFunctions:
+        with _open(_path.join(_env['zzt'],'data','leptonScaleFactors',
+                              fileName)) as f:
+            h = _asRP(f.Get(histName)).clone()
+            h.SetDirectory(0)
+
+        wtMaker = _Weight('leptonSFs')
+        _sfFunctions[key] = wtMaker.makeWeightStringFromHist(h, *variables,
+                                                             **kwargs)
+
+    return _sfFunctions[key]
+
 def leptonEfficiencyWeightsFromHists(channel, eSystematic='', mSystematic='',
                                      eSelSFFile='eleSelectionSF_HZZ_Moriond17',
                                      eSelSFFileGap='',
@@ -71,31 +94,16 @@ def leptonEfficiencyWeightsFromHists(channel, eSystematic='', mSystematic='',
 
     if any('e' in chan for chan in channels):
         if eSystematic not in _sfStrings['e']:
-            with _open(_path.join(_env['zzt'],'data','leptonScaleFactors',
-                                  eSelSFFile)) as fEleSel:
-                hEleSel = _asRP(fEleSel.EGamma_SF2D).clone()
-                hEleSel.SetDirectory(0)
-            with _open(_path.join(_env['zzt'],'data','leptonScaleFactors',
-                                  eSelSFFileGap)) as fEleSelGap:
-                hEleSelGap = _asRP(fEleSelGap.EGamma_SF2D).clone()
-                hEleSelGap.SetDirectory(0)
-            with _open(_path.join(_env['zzt'],'data','leptonScaleFactors',
-                                  eRecoSFFile)) as fEleReco:
-                hEleReco = _asRP(fEleReco.EGamma_SF2D).clone()
-                hEleReco.SetDirectory(0)
-
-            wtMaker = _Weight('leptonSFs')
-
-            eSelTemp = wtMaker.makeWeightStringFromHist(hEleSel, '{obj}SCEta', '{obj}Pt')
-            eSelGapTemp = wtMaker.makeWeightStringFromHist(hEleSelGap, '{obj}SCEta', '{obj}Pt')
-            eRecoTemp = wtMaker.makeWeightStringFromHist(hEleReco, '{obj}SCEta', '100.')
+            eSelTemp = _sfFunctionString(eSelSFFile, 'EGamma_SF2D', '{obj}SCEta', '{obj}Pt')
+            eSelGapTemp = _sfFunctionString(eSelSFFileGap, 'EGamma_SF2D', '{obj}SCEta', '{obj}Pt')
+            eRecoTemp = _sfFunctionString(eRecoSFFile, 'EGamma_SF2D', '{obj}SCEta', '100.')
             eSFTemp = '({} * (({{obj}}IsGap)*{} + (!{{obj}}IsGap)*{}))'.format(eRecoTemp,
                                                                                eSelGapTemp,
                                                                                eSelTemp)
             if eSystematic:
-                eSelErrTemp = wtMaker.makeWeightStringFromHist(hEleSel, '{obj}SCEta', '{obj}Pt', getError=True)
-                eSelErrGapTemp = wtMaker.makeWeightStringFromHist(hEleSelGap, '{obj}SCEta', '{obj}Pt', getError=True)
-                eRecoErrTemp = wtMaker.makeWeightStringFromHist(hEleReco, '{obj}SCEta', '100', getError=True)
+                eSelErrTemp = _sfFunctionString(eSelSFFile, 'EGamma_SF2D', '{obj}SCEta', '{obj}Pt', getError=True)
+                eSelErrGapTemp = _sfFunctionString(eSelSFFileGap, 'EGamma_SF2D', '{obj}SCEta', '{obj}Pt', getError=True)
+                eRecoErrTemp = _sfFunctionString(eRecoSFFile, 'EGamma_SF2D', '{obj}SCEta', '100', getError=True)
                 eSFErrTemp = ('sqrt(({} + ({{obj}}Pt < 20. || {{obj}}Pt > 75.)*0.01)^2 + '
                               '(({{obj}}IsGap)*{} + (!{{obj}}IsGap)*{})^2)').format(eRecoErrTemp,
                                                                                     eSelErrGapTemp,
@@ -115,22 +123,11 @@ def leptonEfficiencyWeightsFromHists(channel, eSystematic='', mSystematic='',
 
     if any('m' in chan for chan in channels):
         if mSystematic not in _sfStrings['m']:
-            with _open(_path.join(_env['zzt'],'data','leptonScaleFactors',
-                                  mSFFile)) as fMuSF:
-                hMuSF = _asRP(fMuSF.FINAL).clone()
-                hMuSF.SetDirectory(0)
-                if mSystematic:
-                    hMuSFErr = _asRP(fMuSF.ERROR).clone()
-                    hMuSFErr.SetDirectory(0)
-
-            wtMaker = _Weight('leptonSFs')
-
-            muSFTemp = wtMaker.makeWeightStringFromHist(hMuSF, '{obj}Eta', '{obj}Pt')
+            muSFTemp = _sfFunctionString(mSFFile, 'FINAL', '{obj}Eta', '{obj}Pt')
 
             if mSystematic:
-                muSFErrTemp = wtMaker.makeWeightStringFromHist(hMuSFErr,
-                                                               '{obj}Eta',
-                                                               '{obj}Pt')
+                muSFErrTemp = _sfFunctionString(mSFFile, 'ERROR', '{obj}Eta',
+                                                '{obj}Pt')
 
                 if mSystematic.lower() == 'up':
                     sign = '+'
@@ -179,8 +176,9 @@ def puWeight(weightFile, systematic=''):
 
     puWeight = _Weight('puWeight')
     with _open(weightFileName) as f:
-        wtStr = puWeight.makeWeightStringFromHist(f.Get(sfName), 'nTruePU')
-    wtFunc = puWeight.getWeightFunction(-1)
+        wtStr, wtFunc = puWeight.makeWeightStringFromHist(f.Get(sfName),
+                                                          'nTruePU',
+                                                          withFunction=True)
     _puFuns[weightFile + '_' + systematic] = wtStr, wtFunc
     return wtStr, wtFunc
 
@@ -217,3 +215,47 @@ def baseMCWeight(channel, puWeightFile, eSyst='', mSyst='', puSyst='',
     return {
         c : '{} * {}'.format(w,puWtStr) for c,w in lepWeights.iteritems()
         }
+
+
+# systematic shifts for baseMCWeightVariations
+_mcWeightVariations = {
+    'nominal' : {},
+    'eEffUp' : {'eSyst' : 'up'},
+    'eEffDn' : {'eSyst' : 'dn'},
+    'mEffUp' : {'mSyst' : 'up'},
+    'mEffDn' : {'mSyst' : 'dn'},
+    'puUp' : {'puSyst' : 'up'},
+    'puDn' : {'puSyst' : 'dn'},
+    }
+
+def baseMCWeightVariations(channel, puWeightFile, variations=[], **kwargs):
+    '''
+    Nominal and systematically shifted versions of baseMCWeight, to make all
+    the histograms at once with makeHistVariations.
+
+    variations (list of str): which ones to include (default: all of
+        'nominal', 'eEffUp', 'eEffDn', 'mEffUp', 'mEffDn', 'puUp', 'puDn').
+    kwargs are passed to baseMCWeight.
+
+    Returns a dict of variation name -> weight string, or, for multiple
+    channels, channel -> dict of variation name -> weight string.
+    '''
+    if not variations:
+        variations = _mcWeightVariations.keys()
+
+    weights = {}
+    for v in variations:
+        try:
+            shifts = _mcWeightVariations[v]
+        except KeyError:
+            raise ValueError("Unknown MC weight variation {}".format(v))
+        args = kwargs.copy()
+        args.update(shifts)
+        weights[v] = baseMCWeight(channel, puWeightFile, **args)
+
+    if all(isinstance(w, str) for w in weights.values()):
+        return weights
+
+    return {
+        c : {v : w[c] for v, w in weights.iteritems()} for c in weights[variations[0]]
+        }
@@ -0,0 +1,240 @@
+'''
+
+HistCache.py
+
+On-disk cache of histograms, keyed by a hash of everything that goes into
+them (see NtupleSample.makeHist). Each histogram is stored in its own small
+ROOT file in $zzt/Analysis/savedResults/histCache. When the cache gets
+bigger than its size limit, the least recently used histograms are
+removed.
+
+To see or clean up the cache:
+    python SampleTools/HistCache.py list
+    python SampleTools/HistCache.py purge [--all] [--olderThan DAYS] [--maxSize MB]
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import logging
+from rootpy import log as rlog; rlog = rlog["/HistCache"]
+# don't show most silly ROOT messages
+logging.basicConfig(level=logging.WARNING)
+
+from rootpy.io import root_open
+from rootpy.ROOT import TNamed as _TNamed
+
+from Utilities import cacheDirectory as _cacheDirectory
+
+from hashlib import sha1 as _sha1
+from os import listdir as _listdir
+from os import remove as _rm
+from os import rename as _rename
+from os import stat as _stat
+from os import utime as _utime
+from os import getpid as _getpid
+from os.path import join as _join
+from os.path import isfile as _isfile
+from time import time as _time
+
+
+class HistCache(object):
+    '''
+    Histograms saved on disk, looked up by key (from HistCache.makeKey()).
+    '''
+    # default size limit (bytes)
+    defaultMaxSize = 500 * 1024 * 1024
+
+    def __init__(self, directory='', maxSize=defaultMaxSize):
+        if not directory:
+            directory = _cacheDirectory('histCache')
+        self.directory = directory
+        self.maxSize = maxSize
+
+        # total size of the cache, found the first time it's needed
+        self._size = None
+
+
+    @staticmethod
+    def makeKey(*parts):
+        '''
+        Hash of the string representations of parts.
+        '''
+        h = _sha1()
+        for p in parts:
+            h.update(repr(p))
+            h.update(';')
+        return h.hexdigest()
+
+
+    def _path(self, key):
+        return _join(self.directory, key + '.root')
+
+
+    def get(self, key):
+        '''
+        The histogram saved under key, or None if there isn't one.
+        '''
+        fName = self._path(key)
+        if not _isfile(fName):
+            return None
+
+        try:
+            with root_open(fName) as f:
+                h = f.Get('hist')
+                h.SetDirectory(0)
+        except Exception as e:
+            rlog.warning("Removing unreadable cache file {} ({})".format(fName, e))
+            self._remove(fName)
+            return None
+
+        # mark as recently used
+        _utime(fName, None)
+
+        return h
+
+
+    def put(self, key, hist, description=''):
+        '''
+        Save hist under key. description is stored with it for
+        HistCache.py list.
+        '''
+        fName = self._path(key)
+        tmpName = '{}.tmp{}'.format(fName, _getpid())
+
+        with root_open(tmpName, 'recreate') as f:
+            f.WriteTObject(hist, 'hist')
+            f.WriteTObject(_TNamed('description', description), 'description')
+
+        _rename(tmpName, fName)
+
+        if self._size is not None:
+            self._size += _stat(fName).st_size
+        self.evict()
+
+
+    def entries(self):
+        '''
+        List of (file name, size in bytes, time last used) for everything in
+        the cache, least recently used first.
+        '''
+        out = []
+        for fName in _listdir(self.directory):
+            if not fName.endswith('.root'):
+                continue
+            path = _join(self.directory, fName)
+            try:
+                st = _stat(path)
+            except OSError: # removed by someone else
+                continue
+            out.append((path, st.st_size, st.st_mtime))
+
+        out.sort(key=lambda x: x[2])
+        return out
+
+
+    def size(self):
+        if self._size is None:
+            self._size = sum(e[1] for e in self.entries())
+        return self._size
+
+
+    def evict(self, maxSize=None):
+        '''
+        Remove least recently used histograms until the cache is no bigger
+        than maxSize bytes (default: self.maxSize).
+        '''
+        if maxSize is None:
+            maxSize = self.maxSize
+
+        if self.size() <= maxSize:
+            return
+
+        size = 0
+        entries = self.entries()
+        for path, s, t in entries:
+            size += s
+        for path, s, t in entries:
+            if size <= maxSize:
+                break
+            self._remove(path)
+            size -= s
+
+        self._size = size
+
+
+    def purge(self, olderThan=None):
+        '''
+        Remove everything, or everything not used in the last olderThan
+        days.
+        '''
+        cutoff = _time() - olderThan * 86400. if olderThan is not None else None
+        for path, s, t in self.entries():
+            if cutoff is None or t < cutoff:
+                self._remove(path)
+
+        self._size = None
+
+
+    def _remove(self, path):
+        try:
+            _rm(path)
+        except OSError:
+            pass
+
+
+    @staticmethod
+    def description(path):
+        try:
+            with root_open(path) as f:
+                return f.Get('description').GetTitle()
+        except Exception:
+            return ''
+
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser as _Args
+
+    parser = _Args(description="Inspect or clean up the histogram cache.")
+    parser.add_argument('action', type=str, choices=['list', 'purge'],
+                        help='What to do.')
+    parser.add_argument('--dir', type=str, default='',
+                        help=('Cache directory (default '
+                              '$zzt/Analysis/savedResults/histCache).'))
+    parser.add_argument('--all', action='store_true',
+                        help='Purge: remove everything.')
+    parser.add_argument('--olderThan', type=float, default=None,
+                        help='Purge: remove histograms not used in this many days.')
+    parser.add_argument('--maxSize', type=float, default=None,
+                        help=('Purge: remove least recently used histograms '
+                              'until the cache is this many MB.'))
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='List: show what each histogram is.')
+
+    args = parser.parse_args()
+
+    cache = HistCache(args.dir)
+
+    if args.action == 'list':
+        entries = cache.entries()
+        now = _time()
+        for path, s, t in entries:
+            line = '{}  {:8.1f} kB  last used {:.1f} days ago'.format(path.split('/')[-1][:-5],
+                                                                      s / 1024.,
+                                                                      (now - t) / 86400.)
+            if args.verbose:
+                line += '\n    ' + HistCache.description(path)
+            print line
+        print "{} histograms, {:.1f} MB total".format(len(entries),
+                                                     cache.size() / (1024. * 1024.))
+    else:
+        if args.all:
+            cache.purge()
+        elif args.olderThan is not None:
+            cache.purge(args.olderThan)
+        if args.maxSize is not None:
+            cache.evict(int(args.maxSize * 1024 * 1024))
+        if not (args.all or args.olderThan is not None or args.maxSize is not None):
+            parser.error("purge needs --all, --olderThan, or --maxSize")
+        print "Cache is now {:.1f} MB".format(cache.size() / (1024. * 1024.))
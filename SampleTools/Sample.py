@@ -15,16 +15,41 @@ logging.basicConfig(level=logging.WARNING)
 rlog["/ROOT.TCanvas.Print"].setLevel(rlog.WARNING)
 rlog["/ROOT.TUnixSystem.SetDisplay"].setLevel(rlog.ERROR)
 rlog["/rootpy.tree.chain"].setLevel(rlog.WARNING)
+rlog["/rootpy.compiled"].setLevel(rlog.WARNING)
 
 from Metadata.metadata import sampleInfo as _samples
 from Utilities import combineWeights as _combineWeights, removeXErrors as _removeXErrors
-
+from Utilities import fileSignature as _fileSignature
+from Utilities import WeightStringMaker as _WeightStringMaker
+from Utilities.drawExpressions import parseDrawVariables as _parseDrawVariables
+from Utilities.drawExpressions import parseExpression as _parseExpression
+from Utilities.drawExpressions import branchesNeeded as _branchesNeeded
+from Utilities.drawExpressions import evaluateExpression as _evaluateExpression
+from Utilities.drawExpressions import UnsupportedExpression as _UnsupportedExpression
+from Utilities.histArrays import fillHist as _fillHist
+from Utilities.histArrays import histContents as _histContents
+from Utilities.histArrays import addToHist as _addArraysToHist
+from Utilities.histArrays import axisEdges as _axisEdges
+from Utilities.histArrays import binVariations as _binVariations
+
+from mergeNtuples import fastMerge as _fastMerge
+from mergeNtuples import openChain as _openChain
+from mergeNtuples import getPremerged as _getPremerged
+from eventDedup import keptEntries as _keptEntries
+from eventDedup import savedKeptEntries as _savedKeptEntries
+from HistCache import HistCache
+from metaCatalog import summedWeights as _summedWeights
+from columnCache import findColumnSource as _findColumnSource
+
+from rootpy import asrootpy
+import rootpy.compiled as _rootComp
 from rootpy.io import root_open, TemporaryFile
 from rootpy.io import DoesNotExist as _RootpyDNE
 from rootpy.tree import Tree, TreeChain
 from rootpy.plotting import Hist, Hist2D, Canvas
 from rootpy.context import preserve_current_directory
 from rootpy.ROOT import TGraphAsymmErrors as _TGAE
+from rootpy.ROOT import TEntryList as _TEntryList
 
 from glob import glob
 from math import sqrt
@@ -32,6 +57,14 @@ from os import remove as _rm
 from os import close as _close
 from os.path import isfile as _isfile
 from numbers import Number as _Number
+from multiprocessing import Pool as _Pool
+from collections import OrderedDict as _ODict
+
+import numpy as _np
+try:
+    from root_numpy import tree2array as _tree2array
+except ImportError:
+    _tree2array = None
 
 # Workaround for weird ROOT bug
 _dummy = Hist(1,0,1)
@@ -40,6 +73,188 @@ _dummy.xaxis.SetTitle('\\mu\\mu')
 _dummy.draw()
 
 
+_rootComp.register_code(
+    '''
+    #include "TEntryList.h"
+    #include "TTree.h"
+
+    void _f_Fill_Entry_List(TEntryList* entryList, TTree* tree, long n,
+                            const long* entries)
+    {
+      for(long i = 0; i < n; ++i)
+        entryList->Enter(entries[i], tree);
+    }
+    ''', ['_f_Fill_Entry_List'])
+
+
+def _entryListFromArray(name, tree, entries):
+    '''
+    TEntryList for tree with the entry numbers in array entries, entered in
+    C++ instead of one Python call per entry.
+    '''
+    out = _TEntryList(name, '', tree)
+    entries = _np.ascontiguousarray(entries, dtype=_np.int_)
+    _rootComp._f_Fill_Entry_List(out, tree, len(entries), entries)
+    return out
+
+
+# Parallel histogramming (see makeHistInParallel)
+_defaultWorkers = 0
+# leaf-sample fills found while recording, fill key -> job
+_recordedFills = None
+# results of the fills when making the real histograms, fill key -> result
+_replayedFills = None
+# jobs for the worker processes (which get them by forking)
+_parallelJobs = []
+# objects that the worker processes must not delete, because they belong to
+# the parent process (e.g. temporary files)
+_keepAlive = []
+
+
+def setParallelWorkers(n):
+    '''
+    Default number of processes SampleGroup and SampleStack use to fill the
+    histograms of their samples in makeHist and makeHist2. 0 or 1 means do
+    everything in this process. Can be overridden for one call with the
+    workers keyword argument.
+    '''
+    global _defaultWorkers
+    _defaultWorkers = int(n)
+
+
+def _parallelWorkers(kwargs):
+    '''
+    Remove 'workers' from kwargs and return the number of processes to use,
+    which is 0 if we're already doing a parallel fill.
+    '''
+    workers = kwargs.pop('workers', _defaultWorkers)
+    if _recordedFills is not None or _replayedFills is not None:
+        return 0
+    return workers or 0
+
+
+def _histSignature(h):
+    return tuple([h.__class__.__name__] +
+                 [tuple(_axisEdges(ax)) for ax in
+                  [h.GetXaxis(), h.GetYaxis()][:h.GetDimension()]])
+
+
+def _fillInWorker(iJob):
+    '''
+    Do one leaf-sample fill in a worker process. The sample reopens its
+    files, because ROOT files opened before the fork would be shared with
+    the parent (and the other workers).
+    '''
+    sample, var, selection, columnar, hist = _parallelJobs[iJob]
+
+    if hasattr(sample, 'tempFile'):
+        _keepAlive.append(sample.tempFile)
+        del sample.tempFile
+    sample._ntuple = None
+    sample._entryList = None
+    # no temporary file needed
+    sample.mergeMode = 'chain'
+
+    h = hist.Clone()
+    h.SetDirectory(0)
+    sample.addToHist(h, var, selection, columnar)
+    contents, sumW2 = _histContents(h)
+    entries = h.GetEntries()
+
+    sample._ntuple = None
+    if hasattr(sample, 'tempFile'):
+        del sample.tempFile
+
+    return contents, sumW2, entries
+
+
+def makeHistInParallel(method, workers, *args, **kwargs):
+    '''
+    Call method(*args, **kwargs), where method is makeHist or makeHist2 of
+    some sample, with all the leaf-sample fills done in a pool of workers
+    processes.
+
+    method is run twice in this process. The first time, fills are only
+    recorded (histograms stay empty and postprocessing is turned off). The
+    second time, the fills are taken from the workers' results, so
+    everything else (summing, overflow merging, normalization,
+    postprocessing, formatting) happens here exactly as in serial mode.
+    Samples that can't be reloaded from their files (e.g. after applyCut)
+    are filled here. Compiled helpers the fills may need are compiled here
+    first, so the workers don't all try to compile them at once.
+    '''
+    global _recordedFills
+    global _replayedFills
+    global _parallelJobs
+
+    recordKwargs = kwargs.copy()
+    if 'postprocess' in recordKwargs:
+        recordKwargs['postprocess'] = False
+
+    _recordedFills = _ODict()
+    try:
+        method(*args, **recordKwargs)
+        jobs = _recordedFills
+    finally:
+        _recordedFills = None
+
+    keys = jobs.keys()
+    _parallelJobs = jobs.values()
+    try:
+        if len(keys) > 1:
+            # weight functions made in batch mode, and the skim entry list
+            # helper
+            _WeightStringMaker.compileAll()
+            _rootComp._f_Fill_Entry_List
+
+            pool = _Pool(min(workers, len(keys)))
+            try:
+                results = pool.map(_fillInWorker, range(len(keys)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_fillInWorker(i) for i in range(len(keys))]
+    finally:
+        _parallelJobs = []
+
+    _replayedFills = dict(zip(keys, results))
+    try:
+        return method(*args, **kwargs)
+    finally:
+        _replayedFills = None
+
+
+def _histSpec(spec, defaults):
+    '''
+    Turn (var, selection, binning[, weight[, options]]) into
+    (var, selection, binning, weight, options), with options including
+    defaults.
+    '''
+    if len(spec) < 3 or len(spec) > 5:
+        raise ValueError("Invalid histogram specification {}".format(spec))
+
+    var, selection, binning = spec[:3]
+    weight = spec[3] if len(spec) > 3 else ''
+    options = defaults.copy()
+    if len(spec) > 4:
+        options.update(spec[4])
+
+    return var, selection, binning, weight, options
+
+
+def _expressionStrings(x):
+    '''
+    All the expression strings in a var/selection/weight argument, which may
+    be a string, an iterable of strings, or a dict of either.
+    '''
+    if isinstance(x, basestring):
+        return [x]
+    if isinstance(x, dict):
+        return [e for v in x.values() for e in _expressionStrings(v)]
+    return [e for v in x for e in _expressionStrings(v)]
+
+
 class _SampleBase(object):
     def __init__(self, name, channel, dataIn,
                  initFromMetadata=False, *args, **kwargs):
@@ -113,6 +328,51 @@ class _SampleBase(object):
     def prettyName(self, name):
         self._prettyName = name
 
+    def makeHists(self, specs, **kwargs):
+        '''
+        Make many histograms with one pass over the ntuple(s).
+
+        specs (iterable): each item is (var, selection, binning[, weight[,
+            options]]), with the same meanings as the arguments of makeHist.
+            options is a dict of extra makeHist keyword arguments.
+        Any other keyword arguments are used as default options for every
+            histogram.
+
+        Everything the histograms need is read from the ntuples once, and each
+        distinct expression is evaluated once, so the cost scales with the
+        number of events rather than events times histograms. Histograms with
+        expressions that can't be done with arrays are made with TTree::Draw
+        as usual.
+
+        Returns a list of histograms in the same order as specs.
+        '''
+        specs = [_histSpec(spec, kwargs) for spec in specs]
+
+        expressions = set()
+        for var, selection, binning, weight, options in specs:
+            for x in (var, selection, weight):
+                expressions.update(_expressionStrings(x))
+
+        self.preloadColumns(expressions)
+        try:
+            return [self.makeHist(var, selection, binning, weight, **options)
+                    for var, selection, binning, weight, options in specs]
+        finally:
+            self.clearColumnCache()
+
+
+    def preloadColumns(self, expressions):
+        '''
+        Read everything needed to evaluate expressions into memory, to be used
+        for all columnar histograms until clearColumnCache() is called.
+        '''
+        pass
+
+
+    def clearColumnCache(self):
+        pass
+
+
     def setPostprocessor(self, f, *args):
         '''
         Set a function that is always run on a histogram made by this object.
@@ -125,10 +385,71 @@ class _SampleBase(object):
 
 
 class NtupleSample(_SampleBase):
+    # If True, histograms are filled from numpy arrays of the branches they
+    # need instead of with TTree::Draw. Can be overridden for one call with
+    # the columnar keyword argument of makeHist and makeHist2. Expressions
+    # that can't be done with arrays fall back to TTree::Draw.
+    columnar = False
+
+    # How ntuples from multiple files are combined:
+    #     'fast': copy the compressed baskets into a temporary file with
+    #             TChain::CloneTree(-1, 'fast')
+    #     'chain': don't copy, use a TChain with a TTreeCache
+    #     'copy': copy row by row through Python (slow; the old way)
+    # The default used to be 'copy'. 'fast' makes the same tree (ROOT falls
+    # back to copying entries itself if the files can't be fast-cloned), so
+    # set this to 'copy' only to get the old behavior back exactly.
+    mergeMode = 'fast'
+
+    # If this is a SampleTools.HistCache.HistCache, histograms are saved in
+    # it and reused when the input files, cuts, and everything passed to
+    # makeHist(2) are the same (see useHistCache()). Functions made by
+    # WeightStringMaker are named for the contents of their histograms, so
+    # those are part of the key, but the contents of other compiled
+    # functions used in weight strings aren't.
+    histCache = None
+
+    _ntuple = None
+
+    # If True, applyCut doesn't copy the ntuple, it just keeps track of
+    # which entries pass (see applyCut). Can be overridden for a single cut
+    # with the skim argument of applyCut.
+    skimMode = False
+
+    # entries of the ntuple passing skims (None if no skims), and the
+    # corresponding TEntryList for TTree::Draw
+    _entryIndex = None
+    _entryList = None
+
+    # Read branches from columnar copies of the input files (see
+    # SampleTools.columnCache) when there are any
+    useColumnCache = True
+    # ColumnSource for this sample (False if there isn't one, None if we
+    # haven't looked yet)
+    _colSource = None
+    # entries of the input files (all of them one after another) that make
+    # up the ntuple, or None if it's all of them
+    _rawEntries = None
+
+    # Arrays read by preloadColumns() (branch name -> array) and expressions
+    # evaluated from them (see Utilities.drawExpressions.evaluateExpression)
+    _columnCache = None
+    _evalCache = None
+
+    # while makeHistVariations is running: the variable, the selections for
+    # all the variations, and their contents once they're binned (for each
+    # binning)
+    _variationFills = None
+
     def __init__(self, name, channel, dataIn, initFromMetadata=False,
                  *args, **kwargs):
         self.weight = ''
 
+        # cuts applied with applyCut, for the histogram cache key
+        # (None if there was a cut that can't be represented)
+        self._cutHistory = []
+        self._inputSignature = None
+
         super(NtupleSample, self).__init__(name, channel, dataIn, initFromMetadata, *args, **kwargs)
 
         self.oldNtuples = []
@@ -137,8 +458,13 @@ class NtupleSample(_SampleBase):
         if isinstance(inputs, Tree):
             self.ntuple = inputs
             self.files = [self.ntuple.GetCurrentFile().GetName()]
+            # can't tell what's in the tree from the file
+            self._cutHistory = None
+            self._fromFiles = False
             return self.ntuple
 
+        self._fromFiles = True
+
         if isinstance(inputs, str):
             inputs = [inputs]
 
@@ -152,25 +478,68 @@ class NtupleSample(_SampleBase):
                                                         '\n'.join(inputs))
                           )
 
-        self.ntuple = self.combineNtuples(self.files, self.channel)
-        return self.ntuple
+        # files are opened and combined the first time the ntuple is needed
+        self._ntuple = None
+        return None
+
+    @property
+    def ntuple(self):
+        if self._ntuple is None:
+            self.load()
+        return self._ntuple
+    @ntuple.setter
+    def ntuple(self, tree):
+        self._ntuple = tree
+
+    def load(self):
+        '''
+        Open and combine the input files now instead of waiting until the
+        ntuple is first used.
+        '''
+        if self._ntuple is None:
+            # rootpy Tree even if it's a chain, since row-by-row cuts and
+            # dedup copy the rows through its buffer
+            self._ntuple = asrootpy(self.combineNtuples(self.files,
+                                                        self.channel))
+        return self._ntuple
+
+    def isLoaded(self):
+        return self._ntuple is not None
 
     def combineNtuples(self, files, chan):
         '''
         Gets the ntuple from a file or files. No redundant row culling or
-        anything. If there are multiple files, they are combined into a
-        TemporaryFile rather than just using a chain, due to some mysterious
-        TreeChain-related slowdown.
+        anything. If there are multiple files, how they're combined depends
+        on self.mergeMode. By default, they are combined into a TemporaryFile
+        with a fast (basket-level) clone; a TreeChain is slow due to some
+        mysterious TreeChain-related slowdown, and a TChain is only
+        reasonably fast with a TTreeCache.
+        If the files were already merged with
+        SampleTools.mergeNtuples.premergeNtuples, that file is used.
         '''
+        treePath = '{}/ntuple'.format(chan)
+
         if len(files) == 1:
             self.ntupleFile = root_open(files[0])
-            return self.ntupleFile.Get('{}/ntuple'.format(chan))
+            return self.ntupleFile.Get(treePath)
+
+        premerged = _getPremerged(files, chan)
+        if premerged is not None:
+            self.ntupleFile = root_open(premerged)
+            return self.ntupleFile.Get(treePath)
+
+        if self.mergeMode == 'chain':
+            return _openChain(files, treePath)
 
-        chain = TreeChain('{}/ntuple'.format(chan), files)
         if not hasattr(self, 'tempFile'):
             self.tempFile = _FileWrapper(TemporaryFile())
         self.tempFile.f.cd()
 
+        if self.mergeMode == 'fast':
+            return asrootpy(_fastMerge(files, treePath,
+                                       '{}_{}_ntuple'.format(self.name, chan)))
+
+        chain = TreeChain(treePath, files)
         out = Tree('{}_{}_ntuple'.format(self.name, chan))
         out.set_buffer(chain._buffer, create_branches=True)
 
@@ -179,10 +548,336 @@ class NtupleSample(_SampleBase):
 
         return out
 
-    def addToHist(self, hist, var, selection):
-        self.ntuple.Draw(var, selection, 'goff', hist)
+    def addToHist(self, hist, var, selection, columnar=False):
+        # parallel mode (see makeHistInParallel); samples that can't be
+        # reloaded from their files in another process are filled normally
+        # the second time through
+        canReload = self._canReload()
+        if _recordedFills is not None:
+            key = (id(self), var, selection, columnar, _histSignature(hist))
+            if canReload and key not in _recordedFills:
+                template = hist.Clone()
+                template.SetDirectory(0)
+                template.Reset()
+                _recordedFills[key] = (self, var, selection, columnar,
+                                       template)
+            return
+        if _replayedFills is not None and canReload:
+            key = (id(self), var, selection, columnar, _histSignature(hist))
+            if key in _replayedFills:
+                contents, sumW2, entries = _replayedFills[key]
+                _addArraysToHist(hist, contents, sumW2, entries)
+                hist.sumw2()
+                return
+
+        if self._variationFills is not None:
+            filled = self._variationFill(hist, var, selection)
+            if filled is not None:
+                _addArraysToHist(hist, *filled)
+                hist.sumw2()
+                return
+
+        if columnar:
+            try:
+                self._addToHistColumnar(hist, var, selection)
+                return
+            except _UnsupportedExpression as e:
+                rlog.debug("Using TTree::Draw for {} in {}: {}".format(var,
+                                                                      self.name,
+                                                                      e))
+
+        self._draw(var, selection, 'goff', hist)
         hist.sumw2()
 
+    def _draw(self, *args):
+        '''
+        TTree::Draw on the ntuple, only using entries passing skims.
+        '''
+        return self._withSkim(self.ntuple.Draw, *args)
+
+    def _withSkim(self, f, *args):
+        '''
+        Call f(*args) with the ntuple's entry list set to the entries passing
+        skims, for TTree methods like Draw and CopyTree. Weight functions
+        made in batch mode are compiled first, since the expressions may use
+        them.
+        '''
+        _WeightStringMaker.compileAll()
+
+        if self._entryIndex is None:
+            return f(*args)
+
+        if self._entryList is None:
+            self._entryList = _entryListFromArray('{}_{}_skim'.format(self.name,
+                                                                      self.channel),
+                                                  self.ntuple,
+                                                  self._entryIndex)
+
+        self.ntuple.SetEntryList(self._entryList)
+        try:
+            return f(*args)
+        finally:
+            self.ntuple.SetEntryList(0)
+
+    def _hasBranch(self, branch):
+        source = self._columnSource()
+        if source is not None and source.hasBranch(branch):
+            return True
+        return bool(self.ntuple.GetBranch(branch))
+
+    def _columnSource(self):
+        '''
+        SampleTools.columnCache.ColumnSource for the ntuple, if the input
+        files have been converted and the ntuple is still just their
+        contents (possibly skimmed). Otherwise None.
+        '''
+        if self._colSource is None:
+            self._colSource = False
+            if self.useColumnCache and self._canReload() and \
+                    self._rawEntriesKnown():
+                try:
+                    source = _findColumnSource(self.files, self.channel)
+                except (OSError, IOError, ValueError) as e:
+                    rlog.warning("Can't use column cache for {}: {}".format(self.name, e))
+                    source = None
+                if source is not None:
+                    self._colSource = source
+
+        return self._colSource or None
+
+    def _rawEntriesKnown(self):
+        '''
+        Whether we know which entries of the input files (all of them
+        one after another) make up the ntuple (see _rawEntries).
+        '''
+        return True
+
+    def _canReload(self):
+        '''
+        Whether the ntuple can be made again from the input files (i.e., it
+        didn't come from a Tree passed in directly, and no cuts copied it).
+        '''
+        return self._fromFiles and not self.oldNtuples
+
+    def _addToHistColumnar(self, hist, var, selection):
+        '''
+        Same as TTree::Draw(var, selection, 'goff', hist), but with numpy.
+        Raises UnsupportedExpression if that can't be done.
+        '''
+        # like TTree::Draw, 'y:x' puts x on the x axis
+        varExprs = _parseDrawVariables(var)[::-1]
+        if len(varExprs) != hist.GetDimension():
+            raise _UnsupportedExpression("{} variables for a {}-D "
+                                         "histogram".format(len(varExprs),
+                                                            hist.GetDimension()))
+        selExpr = _parseExpression(selection)
+
+        columns = self.getColumns(_branchesNeeded(selExpr, *varExprs))
+        nRows = len(self)
+
+        weights = self._evaluate(selExpr, columns, nRows)
+        values = [self._evaluate(v, columns, nRows) for v in varExprs]
+
+        _fillHist(hist, weights, *values)
+        hist.sumw2()
+
+    def _variationFill(self, hist, var, selection):
+        '''
+        Bin contents, squared weights and number of entries for a histogram
+        being made by makeHistVariations. All the variations are binned
+        together the first time one of them is needed. Returns None if this
+        isn't one of them or it can't be done with arrays.
+        '''
+        varVar, selections, filled = self._variationFills
+        if var != varVar or selection not in selections:
+            return None
+
+        sig = _histSignature(hist)
+        if sig not in filled:
+            try:
+                filled[sig] = self._binVariations(hist, var, selections)
+            except _UnsupportedExpression as e:
+                rlog.debug("Using TTree::Draw for variations of {} in {}: "
+                           "{}".format(var, self.name, e))
+                filled[sig] = None
+
+        if filled[sig] is None:
+            return None
+
+        contents, sumW2, nEntries = filled[sig]
+        i = selections.index(selection)
+        return contents[i], sumW2[i], int(nEntries[i])
+
+    def _binVariations(self, hist, var, selections):
+        '''
+        Bin var with each of selections (which include the weights) in one
+        pass, with the weights as a (events x selections) matrix.
+        '''
+        varExprs = _parseDrawVariables(var)[::-1]
+        if len(varExprs) != hist.GetDimension():
+            raise _UnsupportedExpression("{} variables for a {}-D "
+                                         "histogram".format(len(varExprs),
+                                                            hist.GetDimension()))
+        selExprs = [_parseExpression(s) for s in selections]
+
+        columns = self.getColumns(_branchesNeeded(*(selExprs + varExprs)))
+        nRows = len(self)
+
+        # the variations have most of their factors in common, so share
+        # them even if nothing is preloaded
+        cache = self._evalCache if self._evalCache is not None else {}
+
+        values = [_evaluateExpression(v, columns, nRows, cache)
+                  for v in varExprs]
+        weights = _np.column_stack([_evaluateExpression(s, columns, nRows, cache)
+                                    for s in selExprs])
+
+        return _binVariations(hist, weights, *values)
+
+    def binWithFactors(self, hist, var, selection, factors, weight=''):
+        '''
+        Bin var with selection and the sample's full weight, times each
+        column of factors (an array with one row per ntuple entry and one
+        column per variation), as in makeHistVariations. hist only gives the
+        binning and isn't changed. Returns arrays of contents, squared
+        weights and entries, as from Utilities.histArrays.binVariations.
+        Raises UnsupportedExpression if it can't be done with arrays.
+        '''
+        varExprs = _parseDrawVariables(var)[::-1]
+        if len(varExprs) != hist.GetDimension():
+            raise _UnsupportedExpression("{} variables for a {}-D "
+                                         "histogram".format(len(varExprs),
+                                                            hist.GetDimension()))
+        selExpr = _parseExpression(_combineWeights(_combineWeights(weight,
+                                                                   self.fullWeight()),
+                                                   selection))
+
+        columns = self.getColumns(_branchesNeeded(selExpr, *varExprs))
+        nRows = len(self)
+
+        weights = _np.asarray(self._evaluate(selExpr, columns, nRows),
+                              dtype=_np.float64).reshape(-1, 1)
+        values = [self._evaluate(v, columns, nRows) for v in varExprs]
+
+        return _binVariations(hist, weights * factors, *values)
+
+    def _evaluate(self, expr, columns, nRows):
+        # with preloaded columns, results (and parts of them, like scale
+        # factors shared by several weights) are kept for other histograms
+        return _evaluateExpression(expr, columns, nRows, self._evalCache)
+
+    def preloadColumns(self, expressions):
+        '''
+        Read all branches needed by expressions (and the sample's own weight)
+        in one pass. They are used for columnar histograms until
+        clearColumnCache() is called.
+        '''
+        nodes = []
+        for expr in list(expressions) + [self.fullWeight()]:
+            try:
+                nodes += _parseDrawVariables(expr)
+            except _UnsupportedExpression:
+                continue
+
+        # things that aren't branches will fail later and go to TTree::Draw
+        branches = {b:n for b,n in _branchesNeeded(*nodes).iteritems()
+                    if self._hasBranch(b)}
+
+        self.clearColumnCache()
+        try:
+            columns = self.getColumns(branches)
+        except _UnsupportedExpression as e:
+            rlog.debug("Can't preload branches for {}: {}".format(self.name, e))
+            return
+
+        self._columnCache = columns
+        self._evalCache = {}
+
+    def clearColumnCache(self):
+        self._columnCache = None
+        self._evalCache = None
+
+    def getColumns(self, branches):
+        '''
+        Read branches into numpy arrays. branches should be a dict of branch
+        name -> number of elements needed (0 for scalar branches), as from
+        Utilities.drawExpressions.branchesNeeded. Returns a dict of branch
+        name -> array; vector branches are 2-D, padded with NaN.
+        '''
+        if self._columnCache is not None:
+            out = {}
+            for b, n in branches.iteritems():
+                col = self._columnCache.get(b)
+                if col is None or (n and (col.ndim != 2 or col.shape[1] < n)):
+                    break
+                out[b] = col
+            else:
+                return out
+
+        source = self._columnSource()
+        if source is not None and source.hasBranches(branches):
+            out = source.read(branches)
+            for b in out:
+                if self._rawEntries is not None:
+                    out[b] = out[b][self._rawEntries]
+                if self._entryIndex is not None:
+                    out[b] = out[b][self._entryIndex]
+            return out
+
+        if _tree2array is None:
+            raise _UnsupportedExpression("root_numpy is needed to read "
+                                         "branches into arrays")
+
+        toRead = []
+        for b, n in branches.iteritems():
+            if not self.ntuple.GetBranch(b):
+                raise _UnsupportedExpression("{} is not a branch in {} "
+                                             "ntuple".format(b, self.name))
+            toRead.append((b, _np.nan, n) if n else b)
+
+        if not toRead:
+            return {}
+
+        arr = _tree2array(self.ntuple, branches=toRead)
+        if self._entryIndex is not None:
+            arr = arr[self._entryIndex]
+
+        return {b:arr[b] for b in branches}
+
+    def _histCacheKey(self, *args):
+        '''
+        Key for a histogram made from this sample's ntuple with args (which
+        should include everything that affects the histogram besides the
+        ntuple itself) in self.histCache, or None if it can't be cached.
+        '''
+        if self.histCache is None or self._cutHistory is None:
+            return None
+
+        if self._inputSignature is None:
+            try:
+                self._inputSignature = _fileSignature(*self.files)
+            except OSError:
+                return None
+
+        return self.histCache.makeKey(self.__class__.__name__, self.channel,
+                                      self._inputSignature, self._cutHistory,
+                                      *args)
+
+    def _getCachedHist(self, key):
+        if key is None:
+            return None
+
+        h = self.histCache.get(key)
+        if h is not None:
+            h.SetTitle(self.prettyName)
+        return h
+
+    def _putCachedHist(self, key, h, toDraw):
+        if key is not None and _recordedFills is None:
+            desc = '{} {}: {}'.format(self.name, self.channel,
+                                      ' + '.join('{} [{}]'.format(v,s) for v,s in toDraw))
+            self.histCache.put(key, h, desc)
+
     def makeHist(self, var, selection, binning, weight='', perUnitWidth=True,
                  postprocess=False, mergeOverflow=False, **kwargs):
         '''
@@ -190,6 +885,8 @@ class NtupleSample(_SampleBase):
         same length), the hists from the resulting var/selection/weight sets
         will be added together. If one or two are strings, they are reused the
         appropriate number of times.
+        If self.histCache is set, the histogram is taken from there when
+        nothing that goes into it has changed.
         '''
         if len(binning) != 3:
             binning = [binning]
@@ -211,32 +908,49 @@ class NtupleSample(_SampleBase):
         assert len(var) == len(selection) and len(selection) == len(weight), \
             "Invalid plotting parameters! Variable: {}, selection: {}, weight: {}.".format(var,selection,weight)
 
+        columnar = kwargs.get('columnar',
+                              self.columnar or self._columnCache is not None)
+
+        toDraw = []
         for v, s, w in zip(var, selection, weight):
             w = _combineWeights(w, self.fullWeight())
 
             s = _combineWeights(w, s)
 
-            self.addToHist(h, v, s)
-
-        h.sumw2()
+            toDraw.append((v, s))
 
-        if mergeOverflow:
-            h = h.merge_bins([(-2,-1)])
-            h.sumw2()
-            # have to reformat
-            h.SetTitle(self.prettyName)
+        cacheKey = self._histCacheKey('makeHist', toDraw, binning,
+                                      perUnitWidth, mergeOverflow)
+        cached = self._getCachedHist(cacheKey)
+        if cached is not None:
+            h = cached
             for a,b in self._format.iteritems():
                 setattr(h, a, b)
+        else:
+            for v, s in toDraw:
+                self.addToHist(h, v, s, columnar)
 
-        if perUnitWidth:
-            if not isinstance(perUnitWidth, _Number):
-                perUnitWidth = 1.
-            for ib in xrange(1,len(h)+1):
-                w = h.GetBinWidth(ib) / perUnitWidth
-                h.SetBinContent(ib, h.GetBinContent(ib) / w)
-                h.SetBinError(ib, h.GetBinError(ib) / w)
             h.sumw2()
 
+            if mergeOverflow:
+                h = h.merge_bins([(-2,-1)])
+                h.sumw2()
+                # have to reformat
+                h.SetTitle(self.prettyName)
+                for a,b in self._format.iteritems():
+                    setattr(h, a, b)
+
+            if perUnitWidth:
+                if not isinstance(perUnitWidth, _Number):
+                    perUnitWidth = 1.
+                for ib in xrange(1,len(h)+1):
+                    w = h.GetBinWidth(ib) / perUnitWidth
+                    h.SetBinContent(ib, h.GetBinContent(ib) / w)
+                    h.SetBinError(ib, h.GetBinError(ib) / w)
+                h.sumw2()
+
+            self._putCachedHist(cacheKey, h, toDraw)
+
         if postprocess:
             self._postprocessor(h)
 
@@ -278,6 +992,10 @@ class NtupleSample(_SampleBase):
         assert len(varX) == len(varY) and len(varY) == len(selection) and len(selection) == len(weight), \
             "Invalid plotting parameters! Variables: {} and {}, selection: {}, weight: {}.".format(varX,varY,selection,weight)
 
+        columnar = kwargs.get('columnar',
+                              self.columnar or self._columnCache is not None)
+
+        toDraw = []
         for vx, vy, s, w in zip(varX, varY, selection, weight):
             v = '{}:{}'.format(vx,vy)
 
@@ -285,24 +1003,40 @@ class NtupleSample(_SampleBase):
 
             s = _combineWeights(w, s)
 
-            self.addToHist(h, v, s)
+            toDraw.append((v, s))
 
-        h.sumw2()
+        cacheKey = self._histCacheKey('makeHist2', toDraw, binning,
+                                      mergeOverflowX, mergeOverflowY)
+        cached = self._getCachedHist(cacheKey)
+        if cached is not None:
+            h = cached
+            if mergeOverflowX or mergeOverflowY:
+                for a,b in self._format.iteritems():
+                    setattr(h, a, b)
+            else:
+                h.drawstyle = 'colz'
+        else:
+            for v, s in toDraw:
+                self.addToHist(h, v, s, columnar)
 
-        if mergeOverflowX:
-            h = h.merge_bins([(-2,-1)])
             h.sumw2()
-            if not mergeOverflowY: # this will happen there anyway
+
+            if mergeOverflowX:
+                h = h.merge_bins([(-2,-1)])
+                h.sumw2()
+                if not mergeOverflowY: # this will happen there anyway
+                    h.SetTitle(self.prettyName)
+                    for a,b in self._format.iteritems():
+                        setattr(h, a, b)
+            if mergeOverflowY:
+                h = h.merge_bins([(-2,-1)], 1)
+                h.sumw2()
+                # have to reformat
                 h.SetTitle(self.prettyName)
                 for a,b in self._format.iteritems():
                     setattr(h, a, b)
-        if mergeOverflowY:
-            h = h.merge_bins([(-2,-1)], 1)
-            h.sumw2()
-            # have to reformat
-            h.SetTitle(self.prettyName)
-            for a,b in self._format.iteritems():
-                setattr(h, a, b)
+
+            self._putCachedHist(cacheKey, h, toDraw)
 
 
         if postprocess:
@@ -311,6 +1045,53 @@ class NtupleSample(_SampleBase):
         return h
 
 
+    def makeHistVariations(self, var, selection, binning, weights,
+                           weight='', **kwargs):
+        '''
+        Make the same histogram with several different sample weights (e.g.
+        systematic shifts of scale factors and pileup weights) at once.
+
+        weights (dict): variation name -> weight to use instead of the
+            sample's weight (as with applyWeight(w, True)) for that
+            variation.
+        The other arguments are the same as for makeHist (var, selection and
+            weight should be strings).
+
+        Each histogram is made with makeHist (so the histogram cache,
+        formatting etc. all work the same), but the contents of all of them
+        are binned together the first time one is needed: the ntuple is read
+        once, factors the weights have in common are computed once, and an
+        (events x variations) weight matrix fills everything with one bin
+        lookup. If that can't be done with arrays, each histogram is filled
+        with TTree::Draw as usual.
+
+        Returns a dict of variation name -> histogram.
+        '''
+        names = list(weights)
+        oldWeight = self.weight
+        try:
+            # the selections makeHist will use
+            selections = []
+            for name in names:
+                self.weight = weights[name]
+                selections.append(_combineWeights(_combineWeights(weight,
+                                                                  self.fullWeight()),
+                                                  selection))
+
+            self._variationFills = (var, selections, {})
+
+            out = {}
+            for name in names:
+                self.weight = weights[name]
+                out[name] = self.makeHist(var, selection, binning, weight,
+                                          **kwargs)
+        finally:
+            self.weight = oldWeight
+            self._variationFills = None
+
+        return out
+
+
     def implicitWeight(self):
         return ''
 
@@ -345,7 +1126,7 @@ class NtupleSample(_SampleBase):
         '''
         return _combineWeights(self.weight, self.implicitWeight())
 
-    def applyCut(self, cut='', name=''):
+    def applyCut(self, cut='', name='', skim=None):
         '''
         cut (str, Cut, function, or other callable): selection for rows to copy.
             If a string or Cut, the Tree will be copied with CopyTree using
@@ -353,26 +1134,125 @@ class NtupleSample(_SampleBase):
             if cut(row) evaluates to True.
         name (str): name for new tree (defaults to name of old tree. Only used
             if cut is callable).
+        skim (bool): if this evaluates to True (default: self.skimMode), the
+            tree isn't copied. Instead, the entries passing the cut are found
+            (with numpy if possible) and only those are used from then on
+            by makeHist, iteration, len(), etc. Skims can be applied on top
+            of each other without copying anything.
         '''
+        if skim is None:
+            skim = self.skimMode
+
+        if self._cutHistory is not None:
+            if hasattr(cut, '__call__'):
+                self._cutHistory = None
+            else:
+                self._cutHistory = self._cutHistory + [str(cut)]
+
+        if skim:
+            self._skim(cut)
+            return self.ntuple
+
         self.oldNtuples.append(self.ntuple)
+
         if hasattr(cut, '__call__'):
             if not name:
                 name = self.oldNtuples[-1].GetName()
-            self.ntuple = Tree(name)
-            self.ntuple.set_buffer(self.oldNtuples[-1]._buffer,
-                                   create_branches=True)
-            for row in self.oldNtuples[-1]:
+            newNtuple = Tree(name)
+            newNtuple.set_buffer(asrootpy(self.oldNtuples[-1])._buffer,
+                                 create_branches=True)
+            for row in self:
                 if cut(row):
-                    self.ntuple.fill()
+                    newNtuple.fill()
+            self.ntuple = newNtuple
         else:
-            self.ntuple = asrootpy(self.oldNtuples[-1].CopyTree(cut))
+            self.ntuple = asrootpy(self._withSkim(self.oldNtuples[-1].CopyTree,
+                                                  cut))
+
+        # skims were for the old tree
+        self._entryIndex = None
+        self._entryList = None
+        self._colSource = None
+        self.clearColumnCache()
 
         return self.ntuple
 
 
+    def _skim(self, cut):
+        '''
+        Keep only entries passing cut from now on, without copying the tree.
+        '''
+        current = self.entryIndex()
+
+        if hasattr(cut, '__call__'):
+            passing = _np.array([bool(cut(row)) for row in self],
+                                dtype=bool)
+            newIndex = current[passing] if len(current) else current
+        else:
+            cut = str(cut)
+            try:
+                expr = _parseExpression(cut)
+                columns = self.getColumns(_branchesNeeded(expr))
+                result = _evaluateExpression(expr, columns, len(self))
+                # missing vector elements (NaN) fail the cut, like in
+                # TTree::Draw
+                passing = (result != 0.) & ~_np.isnan(result)
+                newIndex = current[passing]
+            except _UnsupportedExpression:
+                newIndex = self._entriesPassingDraw(cut)
+
+        self._entryIndex = newIndex
+        self._entryList = None
+        self.clearColumnCache()
+
+
+    def _entriesPassingDraw(self, cut):
+        '''
+        Entries (of those already passing skims) passing cut, from TTree::Draw.
+        '''
+        self.ntuple.SetEstimate(self.ntuple.GetEntries() + 1)
+        self._draw('Entry$', cut, 'goff')
+        n = self.ntuple.GetSelectedRows()
+        if n <= 0:
+            return _np.zeros(0, dtype=_np.int64)
+
+        v1 = self.ntuple.GetV1()
+        v1.SetSize(n)
+        return _np.array(_np.frombuffer(v1, dtype=_np.float64, count=n),
+                         dtype=_np.int64)
+
+
+    def entryIndex(self):
+        '''
+        Array of the entries of the ntuple in use (i.e., passing skims).
+        '''
+        if self._entryIndex is None:
+            return _np.arange(self._nUnskimmed(), dtype=_np.int64)
+        return self._entryIndex
+
+
+    def _nUnskimmed(self):
+        # if we have columns, no need to open the files just to count
+        if self._ntuple is None:
+            source = self._columnSource()
+            if source is not None:
+                if self._rawEntries is not None:
+                    return len(self._rawEntries)
+                return source.nEntries
+        return self.ntuple.GetEntries()
+
+
     def __iter__(self):
-        for row in self.ntuple:
-            yield row
+        if self._entryIndex is None:
+            for row in self.ntuple:
+                yield row
+            return
+
+        passing = _np.zeros(self.ntuple.GetEntries(), dtype=bool)
+        passing[self._entryIndex] = True
+        for i, row in enumerate(self.ntuple):
+            if passing[i]:
+                yield row
 
 
     def rows(self):
@@ -381,7 +1261,9 @@ class NtupleSample(_SampleBase):
 
 
     def __len__(self):
-        return self.ntuple.GetEntries()
+        if self._entryIndex is not None:
+            return len(self._entryIndex)
+        return self._nUnskimmed()
 
 
     def getEntries(self):
@@ -399,6 +1281,8 @@ class NtupleSample(_SampleBase):
 
 
 class MCSample(NtupleSample):
+    _sumWFromFiles = False
+
     def __init__(self, name, channel, dataIn, initFromMetadata=False, intLumi=1000, *args, **kwargs):
         self.isSignal = 0
         self.sumW = -1
@@ -422,24 +1306,24 @@ class MCSample(NtupleSample):
     def storeInputs(self, inputs):
         stored = super(MCSample, self).storeInputs(inputs)
 
-        # get the sum of the weights if applicable
-        if len(self.files) == 1:
-            try:
-                with root_open(self.files[0]) as f:
-                    metaTree = f.Get('metaInfo/metaInfo')
-                    self.sumW = metaTree.Draw('1', 'summedWeights').Integral()
-            except _RootpyDNE:
-                pass
-        else:
-            try:
-                metaChain = TreeChain('metaInfo/metaInfo', self.files)
-                self.sumW = metaChain.Draw('1', 'summedWeights').Integral()
-            except _RootpyDNE:
-                pass
+        # the sum of the weights is taken from the files (if they have it)
+        # when it's first needed, unless it's set by hand before then
+        self._sumWFromFiles = True
 
         return stored
 
 
+    def _getSumWFromFiles(self):
+        '''
+        Get the sum of the weights from the metaInfo trees, if applicable.
+        Each file is only read once; after that it's in the catalog (see
+        SampleTools.metaCatalog).
+        '''
+        sumW = _summedWeights(self.files)
+        if sumW is not None:
+            self._sumW = sumW
+
+
     def implicitWeight(self):
         if self.xsec > 0:
             w = 'genWeight * {} * {} * {} / {}'.format(self.intLumi, self.xsec,
@@ -463,9 +1347,13 @@ class MCSample(NtupleSample):
 
     @property
     def sumW(self):
+        if self._sumWFromFiles:
+            self._sumWFromFiles = False
+            self._getSumWFromFiles()
         return self._sumW
     @sumW.setter
     def sumW(self, val):
+        self._sumWFromFiles = False
         self._sumW = val
 
     @property
@@ -517,6 +1405,14 @@ class _FileWrapper(object):
                          "need to delete it manually".format(self.name))
 
 class DataSample(NtupleSample):
+    # Find duplicate events with numpy and save the result so it only has
+    # to be done once for a given set of files (see SampleTools.eventDedup).
+    # Otherwise, go row by row in Python.
+    fastDedup = True
+
+    # unknown until the ntuple is made
+    _rawEntries = False
+
     def __init__(self, name, channel, dataIn, *args, **kwargs):
         super(DataSample, self).__init__(name, channel, dataIn, *args, **kwargs)
 
@@ -527,17 +1423,38 @@ class DataSample(NtupleSample):
         ensuring that each event only appears once. For now, the version
         of the event chosen is just the first one seen.
         '''
-        chain = TreeChain('{}/ntuple'.format(chan), files)
+        if not self.fastDedup:
+            return self._dedupRowByRow(TreeChain('{}/ntuple'.format(chan),
+                                                 files),
+                                       chan)
+
+        merged = super(DataSample, self).combineNtuples(files, chan)
+
+        try:
+            return self._dedupIndexed(merged, files, chan)
+        except (ImportError, ValueError) as e:
+            rlog.warning(("Can't do fast dedup for {} ({}). Going row by "
+                          "row instead.").format(self.name, e))
+
+        return self._dedupRowByRow(merged, chan)
+
+
+    def _dedupRowByRow(self, tree, chan):
+        '''
+        Copy the first occurrence of each event in tree, keeping track of the
+        events seen in a Python set.
+        '''
         if not hasattr(self, 'tempFile'):
             self.tempFile = _FileWrapper(TemporaryFile())
         self.tempFile.f.cd()
 
         out = Tree('{}_{}_ntuple'.format(self.name, chan))
-        out.set_buffer(chain._buffer, create_branches=True)
+        tree = asrootpy(tree)
+        out.set_buffer(tree._buffer, create_branches=True)
 
         found = set()
 
-        for i,ev in enumerate(chain):
+        for i,ev in enumerate(tree):
             evID = (ev.run, ev.lumi, ev.evt)
             if evID in found:
                 continue
@@ -548,6 +1465,47 @@ class DataSample(NtupleSample):
         return out
 
 
+    def _dedupIndexed(self, merged, files, chan):
+        '''
+        Copy only the first occurrence of each event in merged (the ntuples
+        from files combined the usual way for NtupleSample), found with
+        SampleTools.eventDedup.keptEntries, via an entry list.
+        '''
+        kept = _keptEntries(merged, files, '{}/ntuple'.format(chan))
+        if len(kept) == merged.GetEntries():
+            self._rawEntries = None
+            return merged
+        self._rawEntries = kept
+
+        entryList = _entryListFromArray('{}_{}_kept'.format(self.name, chan),
+                                        merged, kept)
+        merged.SetEntryList(entryList)
+
+        if not hasattr(self, 'tempFile'):
+            self.tempFile = _FileWrapper(TemporaryFile())
+        self.tempFile.f.cd()
+
+        out = merged.CopyTree('')
+        out.SetName('{}_{}_ntuple'.format(self.name, chan))
+        merged.SetEntryList(0)
+
+        return asrootpy(out)
+
+
+    def _rawEntriesKnown(self):
+        # known after fast dedup, or from its saved index without merging
+        # the files at all
+        if self._rawEntries is False and self.fastDedup and \
+                self._ntuple is None:
+            kept = _savedKeptEntries(self.files,
+                                     '{}/ntuple'.format(self.channel))
+            if kept is not None:
+                self._rawEntries = kept
+            else:
+                self.load()
+        return self._rawEntries is not False
+
+
     def formatDefault(self):
         self.format(True, drawstyle='PE', legendstyle='LPE')
 
@@ -603,3 +1561,15 @@ class DataSample(NtupleSample):
 
 
 
+
+
+def useHistCache(use=True, directory='', maxSize=HistCache.defaultMaxSize):
+    '''
+    Turn the on-disk histogram cache on (or off, if use evaluates to False)
+    for all NtupleSamples. directory defaults to
+    $zzt/Analysis/savedResults/histCache; maxSize is in bytes.
+    '''
+    if use:
+        NtupleSample.histCache = HistCache(directory, maxSize)
+    else:
+        NtupleSample.histCache = None
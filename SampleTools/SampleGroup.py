@@ -12,6 +12,8 @@ from Metadata.metadata import groupInfo as _groups
 from Metadata.metadata import sampleInfo as _samples
 
 from Sample import _SampleBase
+from Sample import makeHistInParallel as _makeHistInParallel
+from Sample import _parallelWorkers
 from . import DataSample as _DataSample
 from Utilities import removeXErrors as _removeXErrors
 
@@ -75,9 +77,21 @@ class SampleGroup(_SampleBase):
         If perUnitWidth is a positive number, bins are normalized to that
             width. If it is a non-number that evaluates to True, bins are
             normalized to their width in the units of the x-axis.
+        If workers (keyword argument) is more than 1, the histograms of the
+            individual samples are filled in that many processes (see
+            SampleTools.setParallelWorkers)
         Note: if the postprocessor was added recursively, it is run only here,
             not on the histograms made by the child samples
         '''
+        workers = _parallelWorkers(kwargs)
+        if workers > 1:
+            return _makeHistInParallel(self.makeHist, workers, var, selection,
+                                       binning, weight,
+                                       perUnitWidth=perUnitWidth,
+                                       poissonErrors=poissonErrors,
+                                       postprocess=postprocess,
+                                       mergeOverflow=mergeOverflow, **kwargs)
+
         if not len(self):
             raise KeyError(("Group {} can't be drawn because it contains no "
                             "samples.").format(self.name))
@@ -170,8 +184,17 @@ class SampleGroup(_SampleBase):
                   weight='', postprocess=False, mergeOverflowX=False,
                   mergeOverflowY=False, **kwargs):
         '''
-        var[XY], selection and weight work the same as SampleGroup.makeHist()
+        var[XY], selection, weight and workers work the same as
+        SampleGroup.makeHist()
         '''
+        workers = _parallelWorkers(kwargs)
+        if workers > 1:
+            return _makeHistInParallel(self.makeHist2, workers, varX, varY,
+                                       selection, binningX, binningY, weight,
+                                       postprocess=postprocess,
+                                       mergeOverflowX=mergeOverflowX,
+                                       mergeOverflowY=mergeOverflowY, **kwargs)
+
         if not len(self):
             raise KeyError(("Group {} can't be drawn because it contains no "
                             "samples.").format(self.name))
@@ -246,6 +269,62 @@ class SampleGroup(_SampleBase):
         return h
 
 
+    def makeHistVariations(self, var, selection, binning, weights, weight='',
+                           perUnitWidth=True, postprocess=False,
+                           mergeOverflow=False, **kwargs):
+        '''
+        Make the same histogram with several different sample weights, each
+        one the sum over the samples in the group. See
+        NtupleSample.makeHistVariations (var, selection and weight must be
+        strings here). Returns a dict of variation name -> histogram.
+        '''
+        if not len(self):
+            raise KeyError(("Group {} can't be drawn because it contains no "
+                            "samples.").format(self.name))
+
+        bins = binning[:]
+        if len(bins) != 3:
+            bins = [bins]
+        out = {name : Hist(*bins, type='D', title=self.prettyName,
+                           **self._format) for name in weights}
+
+        for s in self.values():
+            hists = s.makeHistVariations(var, selection, binning, weights,
+                                         weight, perUnitWidth=perUnitWidth,
+                                         mergeOverflow=mergeOverflow,
+                                         **kwargs)
+            for name, h in hists.iteritems():
+                out[name] += h
+
+        for h in out.values():
+            if postprocess:
+                self._postprocessor(h)
+
+            if 'e' in h.drawstyle.lower() and h.uniform():
+                _removeXErrors(h)
+
+        return out
+
+
+    def load(self):
+        '''
+        Open and combine all the samples' input files now instead of when
+        they're first used.
+        '''
+        for s in self.values():
+            s.load()
+
+
+    def preloadColumns(self, expressions):
+        for s in self.values():
+            s.preloadColumns(expressions)
+
+
+    def clearColumnCache(self):
+        for s in self.values():
+            s.clearColumnCache()
+
+
     def formatDefault(self):
         self.format(True, drawstyle='hist', fillstyle='solid', legendstyle='F')
 
@@ -370,9 +449,26 @@ class SampleStack(_SampleBase):
                  postprocess=False, mergeOverflow=False,
                  *extraHists, **kwargs):
         '''
+        If workers (keyword argument) is more than 1, the histograms of the
+        individual samples are filled in that many processes (see
+        SampleTools.setParallelWorkers).
+        extraHists may also be passed as a keyword argument (a list).
         Note: if the postprocessor was added recursively, it is run only here,
         not on the histograms made by the child samples.
         '''
+        extraHists += tuple(kwargs.pop('extraHists', ()))
+
+        workers = _parallelWorkers(kwargs)
+        if workers > 1:
+            # everything by keyword, so postprocessing can be turned off
+            # while the fills are recorded
+            return _makeHistInParallel(self.makeHist, workers, var, selection,
+                                       binning, weight,
+                                       perUnitWidth=perUnitWidth,
+                                       postprocess=postprocess,
+                                       mergeOverflow=mergeOverflow,
+                                       extraHists=extraHists, **kwargs)
+
         sortByMax = kwargs.pop('sortByMax', True)
 
         hists = []
@@ -406,6 +502,17 @@ class SampleStack(_SampleBase):
     def makeHist2(self, varX, varY, selection, binningX, binningY,
                   weight='', postprocess=False, mergeOverflowX=False,
                   mergeOverflowY=False, *extraHists, **kwargs):
+        extraHists += tuple(kwargs.pop('extraHists', ()))
+
+        workers = _parallelWorkers(kwargs)
+        if workers > 1:
+            return _makeHistInParallel(self.makeHist2, workers, varX, varY,
+                                       selection, binningX, binningY, weight,
+                                       postprocess=postprocess,
+                                       mergeOverflowX=mergeOverflowX,
+                                       mergeOverflowY=mergeOverflowY,
+                                       extraHists=extraHists, **kwargs)
+
         sortByMax = kwargs.pop('sortByMax', True)
 
         hists = []
@@ -436,6 +543,60 @@ class SampleStack(_SampleBase):
         return stack
 
 
+    def makeHistVariations(self, var, selection, binning, weights, weight='',
+                           perUnitWidth=True, postprocess=False,
+                           mergeOverflow=False, **kwargs):
+        '''
+        Make the same stack with several different sample weights. See
+        NtupleSample.makeHistVariations. Returns a dict of variation
+        name -> HistStack.
+        '''
+        sortByMax = kwargs.pop('sortByMax', True)
+
+        hists = {name : [] for name in weights}
+        importance = []
+        for s in self._samples:
+            sampleHists = s.makeHistVariations(var, selection, binning,
+                                               weights, weight,
+                                               perUnitWidth=perUnitWidth,
+                                               postprocess=(postprocess and not self._recursePostprocessor),
+                                               mergeOverflow=mergeOverflow,
+                                               **kwargs)
+            for name, h in sampleHists.iteritems():
+                if postprocess:
+                    self._postprocessor(h)
+                hists[name].append(h)
+
+            try:
+                importance.append(s.isSignal)
+            except AttributeError:
+                importance.append(0)
+
+        return {name : HistStack(SampleStack.orderForStack(h, importance,
+                                                           sortByMax),
+                                 drawstyle='histnoclear')
+                for name, h in hists.iteritems()}
+
+
+    def load(self):
+        '''
+        Open and combine all the samples' input files now instead of when
+        they're first used.
+        '''
+        for s in self:
+            s.load()
+
+
+    def preloadColumns(self, expressions):
+        for s in self:
+            s.preloadColumns(expressions)
+
+
+    def clearColumnCache(self):
+        for s in self:
+            s.clearColumnCache()
+
+
     def applyWeight(self, w, reset=False):
         '''
         Apply weight w to all samples in the stack.
@@ -1,2 +1,2 @@
-from Sample import MCSample, DataSample
+from Sample import MCSample, DataSample, useHistCache, setParallelWorkers
 from SampleGroup import SampleGroup, SampleStack
@@ -0,0 +1,421 @@
+'''
+
+columnCache.py
+
+Columnar copies of ntuple directories, for reading a few branches quickly
+(and sharing them between processes through the page cache) instead of
+going through the ROOT files every time.
+
+A converted directory has, for each channel, one .npy file per branch
+holding that branch for all entries of all files, one after another.
+Vector branches are stored flattened ({branch}.data.npy) with the
+offset of each entry's first element ({branch}.offsets.npy, one longer
+than the number of entries). index.json lists the input files (with sizes
+and modification times, so changed files aren't used) and the range of
+entries each one has in each channel.
+
+NtupleSample uses a converted copy automatically when all of its files are
+in one (see NtupleSample.getColumns). To convert:
+    python SampleTools/columnCache.py /data/nawoods/ntuples/someDir/results_full
+Copies put somewhere other than $zzt/Analysis/savedResults/columnCache
+(with --out) are listed in directories.txt there, so they're found too.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import logging
+from rootpy import log as rlog; rlog = rlog["/columnCache"]
+# don't show most silly ROOT messages
+logging.basicConfig(level=logging.WARNING)
+
+import numpy as _np
+from numpy.lib.format import open_memmap as _openMemmap
+try:
+    from root_numpy import tree2array as _tree2array
+except ImportError:
+    _tree2array = None
+
+from rootpy.io import root_open
+
+from Utilities import cacheDirectory as _cacheDirectory
+from metaCatalog import fileInfo as _fileInfo
+
+from glob import glob as _glob
+from hashlib import sha1 as _sha1
+from json import load as _loadJSON
+from json import dump as _dumpJSON
+from os import listdir as _listdir
+from os import rename as _rename
+from os import stat as _stat
+from os import makedirs as _makedirs
+from fcntl import flock as _flock
+from fcntl import LOCK_EX as _LOCK_EX
+from fcntl import LOCK_UN as _LOCK_UN
+from os.path import join as _join
+from os.path import abspath as _abspath
+from os.path import dirname as _dirname
+from os.path import isfile as _isfile
+from os.path import isdir as _isdir
+
+
+def _defaultRoot():
+    return _cacheDirectory('columnCache')
+
+
+def _branchFile(cacheDir, channel, branch, part=''):
+    if part:
+        return _join(cacheDir, channel, '{}.{}.npy'.format(branch, part))
+    return _join(cacheDir, channel, '{}.npy'.format(branch))
+
+
+def convertDirectory(directory, outDir='', channels=[], branches=[],
+                     pattern='*.root'):
+    '''
+    Make a columnar copy of the ntuples in the files matching pattern in
+    directory.
+
+    outDir (str): where to put it (default: a directory in
+        $zzt/Analysis/savedResults/columnCache named for the input).
+    channels (list of str): channels to convert (default: all directories in
+        the files with an ntuple in them).
+    branches (list of str): branches to convert (default: all).
+
+    Returns the output directory.
+    '''
+    if _tree2array is None:
+        raise ImportError("root_numpy is needed to convert ntuples")
+
+    directory = _abspath(directory)
+    files = sorted(_glob(_join(directory, pattern)))
+    if not files:
+        raise IOError("No files matching {} in {}".format(pattern, directory))
+
+    if not outDir:
+        name = _sha1('{}:{}'.format(directory, pattern)).hexdigest()[:16]
+        outDir = _join(_defaultRoot(), name)
+    outDir = _abspath(outDir)
+
+    # entry counts (and sums of weights) come from the metadata catalog
+    infos = _fileInfo(files)
+
+    if not channels:
+        channels = sorted(set(ch for info in infos for ch in info['entries']))
+
+    index = {
+        'source' : _join(directory, pattern),
+        'files' : [],
+        'channels' : {},
+        }
+    starts = {ch : 0 for ch in channels}
+    for fName, info in zip(files, infos):
+        ranges = {}
+        for ch in channels:
+            n = info['entries'].get(ch, 0)
+            ranges[ch] = [starts[ch], starts[ch] + n]
+            starts[ch] += n
+        index['files'].append({
+                'path' : fName,
+                'size' : info['size'],
+                'mtime' : info['mtime'],
+                'sumW' : info['sumW'],
+                'ranges' : ranges,
+                })
+
+    for ch in channels:
+        index['channels'][ch] = _convertChannel(files, ch, starts[ch],
+                                                [f['ranges'][ch] for f in index['files']],
+                                                outDir, branches)
+
+    indexFile = _join(outDir, 'index.json')
+    with open(indexFile + '.tmp', 'w') as f:
+        _dumpJSON(index, f)
+    _rename(indexFile + '.tmp', indexFile)
+
+    if _dirname(outDir) != _abspath(_defaultRoot()):
+        _registerDirectory(outDir)
+
+    _indexes[:] = []
+
+    return outDir
+
+
+def _convertChannel(files, channel, nEntries, ranges, outDir, branches):
+    '''
+    Write the column files for one channel. Returns a dict with the number
+    of entries and the type of each branch. If branches is empty, all the
+    branches of the first file are used, and every other file must have the
+    same ones.
+    '''
+    chanDir = _join(outDir, channel)
+    if not _isdir(chanDir):
+        _makedirs(chanDir)
+
+    scalars = {}
+    # branch -> (list of arrays of lengths, list of flattened data arrays)
+    vectors = {}
+
+    # with no branch list, each file's branches are checked against the first
+    allBranches = not branches
+    firstBranches = set(branches or [])
+    firstFile = None
+
+    for fName, (start, stop) in zip(files, ranges):
+        if stop == start:
+            continue
+
+        with root_open(fName) as f:
+            tree = f.Get('{}/ntuple'.format(channel))
+            arr = _tree2array(tree, branches=(None if allBranches else branches))
+
+        if allBranches and firstFile is None:
+            firstBranches = set(arr.dtype.names)
+            firstFile = fName
+        elif allBranches and set(arr.dtype.names) != firstBranches:
+            missing = sorted(firstBranches - set(arr.dtype.names))
+            extra = sorted(set(arr.dtype.names) - firstBranches)
+            raise ValueError(("Branches of {0}/ntuple in {1} differ from {2} "
+                              "(missing: {3}; extra: {4}). Convert them "
+                              "separately or list the branches to "
+                              "use.").format(channel, fName, firstFile,
+                                             ', '.join(missing) or 'none',
+                                             ', '.join(extra) or 'none'))
+
+        for b in arr.dtype.names:
+            col = arr[b]
+            if col.dtype == _np.object_:
+                lengths = _np.array([len(x) for x in col], dtype=_np.int64)
+                nonEmpty = [x for x in col if len(x)]
+                if nonEmpty:
+                    data = _np.concatenate(nonEmpty)
+                else:
+                    data = _np.zeros(0)
+                lens, datas = vectors.setdefault(b, ([], []))
+                lens.append(lengths)
+                datas.append(data)
+            else:
+                if b not in scalars:
+                    scalars[b] = _openMemmap(_branchFile(outDir, channel, b),
+                                             mode='w+', dtype=col.dtype,
+                                             shape=(nEntries,))
+                scalars[b][start:stop] = col
+
+    branchInfo = {}
+    for b, out in scalars.iteritems():
+        out.flush()
+        branchInfo[b] = {'dtype' : out.dtype.str, 'vector' : False}
+    del scalars
+
+    for b, (lens, datas) in vectors.iteritems():
+        offsets = _np.zeros(nEntries + 1, dtype=_np.int64)
+        _np.cumsum(_np.concatenate(lens), out=offsets[1:])
+        nonEmpty = [d for d in datas if len(d)]
+        data = _np.concatenate(nonEmpty) if nonEmpty else _np.zeros(0)
+        _np.save(_branchFile(outDir, channel, b, 'offsets'), offsets)
+        _np.save(_branchFile(outDir, channel, b, 'data'), data)
+        branchInfo[b] = {'dtype' : data.dtype.str, 'vector' : True}
+
+    return {'nEntries' : nEntries, 'branches' : branchInfo}
+
+
+def _registryFile():
+    return _join(_defaultRoot(), 'directories.txt')
+
+
+def _registeredDirectories():
+    '''
+    Converted directories outside the default location.
+    '''
+    if not _isfile(_registryFile()):
+        return []
+    with open(_registryFile()) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _registerDirectory(cacheDir):
+    '''
+    Add a converted directory outside the default location to the list of
+    places to look.
+    '''
+    with open(_registryFile() + '.lock', 'w') as lockFile:
+        _flock(lockFile, _LOCK_EX)
+        try:
+            if cacheDir not in _registeredDirectories():
+                with open(_registryFile(), 'a') as f:
+                    f.write(cacheDir + '\n')
+        finally:
+            _flock(lockFile, _LOCK_UN)
+
+
+# (cache directory, index) for all converted directories, loaded when needed
+_indexes = []
+
+
+def _loadIndexes(root=''):
+    if not _indexes:
+        if not root:
+            root = _defaultRoot()
+        dirs = [_join(root, d) for d in sorted(_listdir(root))]
+        dirs += [d for d in _registeredDirectories() if d not in dirs]
+        for d in dirs:
+            indexFile = _join(d, 'index.json')
+            if not _isfile(indexFile):
+                continue
+            with open(indexFile) as f:
+                _indexes.append((d, _loadJSON(f)))
+    return _indexes
+
+
+def findColumnSource(files, channel):
+    '''
+    A ColumnSource for the channel/ntuple trees of files (in that order), or
+    None if they aren't all in an up-to-date converted directory.
+    '''
+    byPath = {}
+    for cacheDir, index in _loadIndexes():
+        if channel not in index['channels']:
+            continue
+        for fInfo in index['files']:
+            byPath[fInfo['path']] = (cacheDir, index, fInfo)
+
+    pieces = []
+    for fName in files:
+        path = _abspath(fName)
+        try:
+            cacheDir, index, fInfo = byPath[path]
+        except KeyError:
+            return None
+
+        st = _stat(path)
+        if fInfo['size'] != st.st_size or fInfo['mtime'] != int(st.st_mtime):
+            rlog.debug("Column cache for {} is out of date".format(path))
+            return None
+
+        start, stop = fInfo['ranges'][channel]
+        pieces.append((cacheDir, index['channels'][channel]['branches'],
+                       start, stop))
+
+    return ColumnSource(channel, pieces)
+
+
+class ColumnSource(object):
+    '''
+    Reads branches of one channel's ntuple for a list of files from
+    converted directories, with memory mapping.
+    '''
+    def __init__(self, channel, pieces):
+        '''
+        pieces (list): (cache directory, branch info dict, first entry,
+            last entry + 1) for each file, in order.
+        '''
+        self.channel = channel
+
+        # merge consecutive pieces of the same directory, so the usual case
+        # (one sample's files, in order) is one slice of each array
+        self.pieces = []
+        for piece in pieces:
+            if self.pieces:
+                cacheDir, info, start, stop = self.pieces[-1]
+                if piece[0] == cacheDir and piece[2] == stop:
+                    self.pieces[-1] = (cacheDir, info, start, piece[3])
+                    continue
+            self.pieces.append(piece)
+
+        self.nEntries = sum(p[3] - p[2] for p in self.pieces)
+
+
+    def hasBranch(self, branch):
+        return all(branch in p[1] for p in self.pieces)
+
+
+    def hasBranches(self, branches):
+        return all(self.hasBranch(b) for b in branches)
+
+
+    def read(self, branches):
+        '''
+        Read branches (a dict of branch name -> number of elements needed, 0
+        for scalar branches, as for NtupleSample.getColumns). Returns a
+        dict of branch name -> array; vector branches are 2-D, padded with
+        NaN. Scalar branches from a single file range are read-only memory
+        maps.
+        '''
+        out = {}
+        for b, n in branches.iteritems():
+            parts = [self._readPiece(p, b, n) for p in self.pieces]
+            if len(parts) == 1:
+                out[b] = parts[0]
+            else:
+                out[b] = _np.concatenate(parts)
+
+        return out
+
+
+    def _readPiece(self, piece, branch, n):
+        cacheDir, info, start, stop = piece
+
+        if not info[branch]['vector']:
+            col = _np.load(_branchFile(cacheDir, self.channel, branch),
+                           mmap_mode='r')
+            return col[start:stop]
+
+        if not n:
+            # not usable as an array, same as an unindexed vector branch from
+            # root_numpy
+            return _np.empty(stop - start, dtype=_np.object_)
+
+        offsets = _np.load(_branchFile(cacheDir, self.channel, branch, 'offsets'),
+                           mmap_mode='r')[start:stop+1]
+        data = _np.load(_branchFile(cacheDir, self.channel, branch, 'data'),
+                        mmap_mode='r')
+
+        first = _np.asarray(offsets[:-1])
+        counts = _np.asarray(offsets[1:]) - first
+
+        out = _np.full((stop - start, n), _np.nan)
+        for k in xrange(n):
+            has = counts > k
+            out[has, k] = data[first[has] + k]
+
+        return out
+
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser as _Args
+
+    parser = _Args(description=("Make memory-mappable columnar copies of "
+                                "ntuple directories."))
+    parser.add_argument('directories', type=str, nargs='*',
+                        help='Directories of ntuple files to convert.')
+    parser.add_argument('--pattern', type=str, default='*.root',
+                        help='Only convert files matching this pattern.')
+    parser.add_argument('--channels', type=str, nargs='*', default=[],
+                        help='Channels to convert (default: all).')
+    parser.add_argument('--branches', type=str, nargs='*', default=[],
+                        help='Branches to convert (default: all).')
+    parser.add_argument('--out', type=str, default='',
+                        help=('Output directory (only with one input '
+                              'directory; default is in '
+                              '$zzt/Analysis/savedResults/columnCache).'))
+    parser.add_argument('--list', action='store_true',
+                        help='List the converted directories.')
+
+    args = parser.parse_args()
+
+    if args.out and len(args.directories) > 1:
+        parser.error("--out can only be used with one input directory")
+
+    for d in args.directories:
+        out = convertDirectory(d, args.out, args.channels, args.branches,
+                               args.pattern)
+        print "Converted {} to {}".format(d, out)
+
+    if args.list:
+        for cacheDir, index in _loadIndexes():
+            print "{}: {} ({} files)".format(cacheDir, index['source'],
+                                             len(index['files']))
+            for ch, chInfo in sorted(index['channels'].iteritems()):
+                print "    {}: {} entries, {} branches".format(ch,
+                                                               chInfo['nEntries'],
+                                                               len(chInfo['branches']))
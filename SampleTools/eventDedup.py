@@ -0,0 +1,158 @@
+'''
+
+eventDedup.py
+
+Find the first occurrence of each event in ntuples from overlapping
+primary datasets, with numpy instead of a Python set of event IDs.
+
+Events are identified by (run, lumi, evt), like the old row-by-row dedup,
+packed into 16-byte keys that sort the same way the numbers do (run and
+lumi in the first 8 bytes, evt in the last 8, all big-endian). The list of
+kept entries for each set of files is saved in
+$zzt/Analysis/savedResults/dedupIndex, keyed by the files' paths, sizes and
+modification times, so dedup only has to be done once.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import logging
+from rootpy import log as rlog; rlog = rlog["/eventDedup"]
+# don't show most silly ROOT messages
+logging.basicConfig(level=logging.WARNING)
+
+import numpy as _np
+try:
+    from root_numpy import tree2array as _tree2array
+except ImportError:
+    _tree2array = None
+
+from Utilities import cacheDirectory as _cacheDirectory
+from Utilities import fileSignature as _fileSignature
+
+from os import rename as _rename
+from os.path import join as _join
+from os.path import isfile as _isfile
+
+
+_MAX_RUN_LUMI = 1 << 32
+
+# what goes in the keys, so saved indices made with different keys aren't
+# used
+_KEY_FIELDS = 'run:lumi:evt'
+
+# entries read at a time
+CHUNK_SIZE = 1000000
+
+
+def packEventIDs(run, lumi, evt):
+    '''
+    Pack arrays of run, lumi section and event numbers into 16-byte keys
+    (a 1-D array of numpy void scalars). Raises ValueError if a run or
+    lumi number doesn't fit in 32 bits.
+    '''
+    run = _np.asarray(run, dtype=_np.uint64)
+    lumi = _np.asarray(lumi, dtype=_np.uint64)
+
+    if len(run) and (run.max() >= _MAX_RUN_LUMI or
+                     lumi.max() >= _MAX_RUN_LUMI):
+        raise ValueError("Run or lumi number too big to pack into an "
+                         "event key")
+
+    keys = _np.empty((len(run), 2), dtype='>u8')
+    keys[:,0] = (run << _np.uint64(32)) | lumi
+    keys[:,1] = _np.asarray(evt, dtype=_np.uint64)
+
+    return keys.view('V16').ravel()
+
+
+def firstOccurrences(keyChunks):
+    '''
+    Entry numbers of the first occurrence of every key, where keyChunks
+    iterates over consecutive chunks of the keys of all entries.
+    Only the (sorted) set of keys seen so far is kept between chunks.
+    '''
+    seen = None
+    kept = []
+    offset = 0
+
+    for keys in keyChunks:
+        uniqueKeys, firstIndex = _np.unique(keys, return_index=True)
+
+        if seen is None:
+            isNew = _np.ones(len(uniqueKeys), dtype=bool)
+            seen = uniqueKeys
+        else:
+            isNew = ~_np.in1d(uniqueKeys, seen, assume_unique=True)
+            # merge while staying sorted
+            seen = _np.union1d(seen, uniqueKeys[isNew])
+
+        kept.append(_np.sort(firstIndex[isNew]).astype(_np.int64) + offset)
+        offset += len(keys)
+
+    if not kept:
+        return _np.zeros(0, dtype=_np.int64)
+    return _np.concatenate(kept)
+
+
+def _keyChunks(tree, chunkSize):
+    nEntries = tree.GetEntries()
+    for start in xrange(0, nEntries, chunkSize):
+        ids = _tree2array(tree, branches=['run', 'lumi', 'evt'],
+                          start=start, stop=min(start + chunkSize, nEntries))
+        yield packEventIDs(ids['run'], ids['lumi'], ids['evt'])
+
+
+def dedupIndexFile(files, treePath):
+    '''
+    Where the kept-entry index for these files is saved.
+    '''
+    sig = _fileSignature(*files, tree=treePath, key=_KEY_FIELDS)
+    return _join(_cacheDirectory('dedupIndex'), sig + '.npy')
+
+
+def savedKeptEntries(files, treePath):
+    '''
+    The saved index of kept entries for treePath in files (see keptEntries),
+    or None if there isn't one. The files don't have to be opened.
+    '''
+    indexFile = dedupIndexFile(files, treePath)
+    if not _isfile(indexFile):
+        return None
+    return _np.load(indexFile)
+
+
+def keptEntries(tree, files, treePath, chunkSize=CHUNK_SIZE, useSaved=True):
+    '''
+    Array of the entry numbers in tree (which must be the combination of
+    treePath in files, in that order) of the first occurrence of each
+    event. If useSaved evaluates to True, a saved index is used if there is
+    one, and the result is saved otherwise.
+
+    Raises ValueError if the run or lumi numbers can't be packed into
+    keys, and ImportError if root_numpy isn't available.
+    '''
+    indexFile = dedupIndexFile(files, treePath)
+
+    if useSaved:
+        kept = savedKeptEntries(files, treePath)
+        if kept is not None:
+            if len(kept) == 0 or kept[-1] < tree.GetEntries():
+                rlog.debug("Using saved dedup index {}".format(indexFile))
+                return kept
+            rlog.warning("Saved dedup index {} doesn't match the ntuple; "
+                         "remaking it.".format(indexFile))
+
+    if _tree2array is None:
+        raise ImportError("root_numpy is needed for vectorized dedup")
+
+    kept = firstOccurrences(_keyChunks(tree, chunkSize))
+
+    if useSaved:
+        # write to a temporary name and move, so a crash can't leave a
+        # partial index
+        tmpFile = indexFile[:-4] + '.tmp.npy'
+        _np.save(tmpFile, kept)
+        _rename(tmpFile, indexFile)
+
+    return kept
@@ -0,0 +1,237 @@
+'''
+
+mergeNtuples.py
+
+Faster ways to combine ntuples from many files into one tree:
+    fastMerge:       copy compressed baskets directly with
+                     TChain::CloneTree(-1, 'fast'), without decompressing or
+                     going through Python row by row.
+    openChain:       don't copy at all, just use a TChain with a TTreeCache
+                     big enough to keep reading efficient.
+    premergeNtuples: fast-merge many independent samples at once in a pool
+                     of worker processes. NtupleSample picks up the merged
+                     files automatically when the same inputs are used.
+
+Run this as a script to compare merging speeds:
+    python SampleTools/mergeNtuples.py '/path/to/ntuples/ZZTo4L*.root' \
+        --channel eeee --draw Z1Mass
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import logging
+from rootpy import log as rlog; rlog = rlog["/mergeNtuples"]
+# don't show most silly ROOT messages
+logging.basicConfig(level=logging.WARNING)
+
+from rootpy import asrootpy as _asrootpy
+from rootpy.ROOT import TChain as _TChain
+from rootpy.ROOT import TFile as _TFile
+
+from multiprocessing import Pool as _Pool
+from tempfile import mkdtemp as _mkdtemp
+from shutil import rmtree as _rmtree
+from atexit import register as _atexitRegister
+from os.path import join as _join
+
+
+# default TTreeCache size for chains (bytes)
+CHAIN_CACHE_SIZE = 100 * 1024 * 1024
+
+
+def openChain(files, treePath, cacheSize=CHAIN_CACHE_SIZE):
+    '''
+    Make a TChain of treePath in all files, with a TTreeCache of cacheSize
+    bytes reading all branches (so reads are done in large blocks rather
+    than basket by basket, which is what makes naive chains slow).
+    Returns it as a rootpy Tree, like the other ways of getting an ntuple.
+    '''
+    chain = _TChain(treePath)
+    for f in files:
+        chain.Add(f)
+
+    chain.SetCacheSize(cacheSize)
+    chain.AddBranchToCache('*', True)
+
+    return _asrootpy(chain)
+
+
+def fastMerge(files, treePath, name=''):
+    '''
+    Merge treePath from all files into a new tree in the current directory
+    by copying baskets directly (no decompression or per-row copying). If
+    name is given, the new tree is renamed to that.
+    '''
+    chain = _TChain(treePath)
+    for f in files:
+        chain.Add(f)
+
+    out = chain.CloneTree(-1, 'fast')
+    if not out:
+        raise IOError("Failed to merge {} from {} files".format(treePath,
+                                                               len(files)))
+    if name:
+        out.SetName(name)
+
+    return out
+
+
+_premerged = {}
+_premergeDir = []
+
+
+def _premergeKey(files, channel):
+    # order matters: entry numbers (e.g. in saved dedup indices) and which
+    # copy of a duplicated event comes first depend on it
+    return (tuple(files), channel)
+
+
+def getPremerged(files, channel):
+    '''
+    Path to the file with the premerged ntuple for these files and channel,
+    or None if it wasn't premerged.
+    '''
+    return _premerged.get(_premergeKey(files, channel))
+
+
+def _premergeDirectory():
+    if not _premergeDir:
+        _premergeDir.append(_mkdtemp(prefix='zzt_premerge_'))
+        _atexitRegister(_rmtree, _premergeDir[0], True)
+    return _premergeDir[0]
+
+
+def _mergeToFile(args):
+    '''
+    Worker function for premergeNtuples.
+    '''
+    files, channel, outFileName = args
+
+    fOut = _TFile(outFileName, 'recreate')
+    fOut.mkdir(channel).cd()
+    out = fastMerge(files, '{}/ntuple'.format(channel), 'ntuple')
+    out.Write()
+    fOut.Close()
+
+    return outFileName
+
+
+def premergeNtuples(jobs, nWorkers=4):
+    '''
+    Merge the ntuples for many independent samples in parallel.
+
+    jobs (iterable): (files, channel) pairs, where files is a list of input
+        file names (already globbed) and channel is the channel directory
+        in the files (the tree is channel/ntuple).
+    nWorkers (int): number of processes to use.
+
+    The merged files are temporary and deleted when the program exits.
+    Afterwards, NtupleSamples with the same input files (in the same order)
+    and channel use the merged files instead of merging again.
+
+    Returns a dict of (files, channel) -> merged file name.
+    '''
+    toMerge = []
+    for files, channel in jobs:
+        if len(files) < 2 or getPremerged(files, channel) is not None:
+            continue
+        outFileName = _join(_premergeDirectory(),
+                            'merged{}_{}.root'.format(len(_premerged) + len(toMerge),
+                                                      channel))
+        toMerge.append((list(files), channel, outFileName))
+
+    if nWorkers > 1 and len(toMerge) > 1:
+        pool = _Pool(min(nWorkers, len(toMerge)))
+        try:
+            pool.map(_mergeToFile, toMerge)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in toMerge:
+            _mergeToFile(job)
+
+    out = {}
+    for files, channel, outFileName in toMerge:
+        _premerged[_premergeKey(files, channel)] = outFileName
+        out[(tuple(files), channel)] = outFileName
+
+    return out
+
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser as _Args
+    from glob import glob as _glob
+    from time import time as _time
+
+    from rootpy.io import TemporaryFile
+    from rootpy.tree import Tree, TreeChain
+
+    parser = _Args(description=("Compare ways of combining ntuples from "
+                                "many files."))
+    parser.add_argument('files', type=str, nargs='+',
+                        help='Input files (may be glob patterns).')
+    parser.add_argument('--channel', type=str, default='eeee',
+                        help='Channel directory containing the ntuple.')
+    parser.add_argument('--draw', type=str, default='',
+                        help=('If specified, also time drawing this variable '
+                              'from the combined ntuple.'))
+    parser.add_argument('--modes', type=str, nargs='*',
+                        default=['copy', 'fast', 'chain'],
+                        help='Which ways of combining to time.')
+    parser.add_argument('--nWorkers', type=int, default=0,
+                        help=('If > 0, also time premerging all the '
+                              'channels in a pool of this many processes.'))
+
+    args = parser.parse_args()
+
+    files = []
+    for f in args.files:
+        files += _glob(f)
+    if len(files) < 2:
+        raise IOError("Need at least two files to test merging")
+
+    treePath = '{}/ntuple'.format(args.channel)
+
+    tempFile = TemporaryFile()
+
+    for mode in args.modes:
+        start = _time()
+
+        if mode == 'copy':
+            tempFile.cd()
+            chain = TreeChain(treePath, files)
+            out = Tree('copied')
+            out.set_buffer(chain._buffer, create_branches=True)
+            for row in chain:
+                out.fill()
+        elif mode == 'fast':
+            tempFile.cd()
+            out = fastMerge(files, treePath, 'fastMerged')
+        elif mode == 'chain':
+            out = openChain(files, treePath)
+        else:
+            raise ValueError("Unknown mode {}".format(mode))
+
+        nEntries = out.GetEntries()
+        merged = _time()
+
+        print "{}: combined {} entries from {} files in {:.2f} s".format(mode, nEntries,
+                                                                         len(files),
+                                                                         merged - start)
+
+        if args.draw:
+            out.Draw(args.draw, '', 'goff')
+            print "    drew {} in {:.2f} s".format(args.draw, _time() - merged)
+
+    if args.nWorkers > 0:
+        channels = ['eeee', 'eemm', 'mmmm']
+        start = _time()
+        premergeNtuples([(files, ch) for ch in channels], args.nWorkers)
+        print "premerge: merged {} channels with {} workers in {:.2f} s".format(len(channels),
+                                                                                args.nWorkers,
+                                                                                _time() - start)
+
+    tempFile.Close()
@@ -0,0 +1,220 @@
+'''
+
+metaCatalog.py
+
+Catalog of per-file ntuple metadata (sum of generator weights from the
+metaInfo tree and number of entries in each ntuple), so it only has to be
+read from the files once. Files are identified by path, size and
+modification time, so changed files are automatically read again. The
+catalog is a JSON file in $zzt/Analysis/savedResults/metaCatalog.
+
+To fill the catalog for a whole ntuple directory ahead of time:
+    python SampleTools/metaCatalog.py /data/nawoods/ntuples/someDir/results_full
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import logging
+from rootpy import log as rlog; rlog = rlog["/metaCatalog"]
+# don't show most silly ROOT messages
+logging.basicConfig(level=logging.WARNING)
+
+from rootpy.io import root_open
+from rootpy.io import DoesNotExist as _RootpyDNE
+
+from Utilities import cacheDirectory as _cacheDirectory
+
+from fcntl import flock as _flock
+from fcntl import LOCK_EX as _LOCK_EX
+from fcntl import LOCK_UN as _LOCK_UN
+from json import load as _loadJSON
+from json import dump as _dumpJSON
+from os import stat as _stat
+from os import rename as _rename
+from os import getpid as _getpid
+from os.path import join as _join
+from os.path import abspath as _abspath
+from os.path import isfile as _isfile
+
+
+def _catalogFile():
+    return _join(_cacheDirectory('metaCatalog'), 'catalog.json')
+
+
+# in-memory copy of the catalog
+_catalog = {}
+_loaded = []
+
+
+def _load():
+    if not _loaded:
+        _catalog.update(_read())
+        _loaded.append(True)
+    return _catalog
+
+
+def _read():
+    fName = _catalogFile()
+    if not _isfile(fName):
+        return {}
+    try:
+        with open(fName) as f:
+            return _loadJSON(f)
+    except ValueError:
+        rlog.warning("Ignoring corrupted metadata catalog {}".format(fName))
+        return {}
+
+
+def _save(newInfo):
+    '''
+    Add newInfo (path -> info dict) to the catalog on disk. The file is
+    read again first so entries added by other jobs aren't lost, and
+    written to a temporary file and moved so it's never half-written. Jobs
+    saving at the same time take turns, so none of them overwrites the
+    others' entries with an old copy.
+    '''
+    fName = _catalogFile()
+
+    with open(fName + '.lock', 'w') as lockFile:
+        _flock(lockFile, _LOCK_EX)
+        try:
+            onDisk = _read()
+            onDisk.update(newInfo)
+
+            tmpName = '{}.tmp{}'.format(fName, _getpid())
+            with open(tmpName, 'w') as f:
+                _dumpJSON(onDisk, f)
+            _rename(tmpName, fName)
+        finally:
+            _flock(lockFile, _LOCK_UN)
+
+    _catalog.update(onDisk)
+
+
+def _fileID(fName):
+    st = _stat(fName)
+    return st.st_size, int(st.st_mtime)
+
+
+def readFileInfo(fName):
+    '''
+    Read the metadata from one file. Returns a dict with
+        'sumW': sum of the generator weights (None if there's no metaInfo)
+        'entries': dict of ntuple directory (channel) -> number of entries
+    '''
+    info = {'sumW' : None, 'entries' : {}}
+
+    with root_open(fName) as f:
+        try:
+            metaTree = f.Get('metaInfo/metaInfo')
+            info['sumW'] = metaTree.Draw('1', 'summedWeights').Integral()
+        except _RootpyDNE:
+            pass
+
+        for key in f.GetListOfKeys():
+            if key.GetClassName() != 'TDirectoryFile' or key.GetName() == 'metaInfo':
+                continue
+            try:
+                ntuple = f.Get('{}/ntuple'.format(key.GetName()))
+            except _RootpyDNE:
+                continue
+            info['entries'][key.GetName()] = ntuple.GetEntries()
+
+    return info
+
+
+def fileInfo(files, save=True):
+    '''
+    Get the metadata (see readFileInfo) for each of files, reading it only
+    for files that aren't in the catalog or have changed. If save evaluates
+    to True, newly read information is added to the catalog on disk.
+    Returns a list of info dicts in the same order as files.
+    '''
+    catalog = _load()
+
+    out = []
+    newInfo = {}
+    for fName in files:
+        path = _abspath(fName)
+        size, mtime = _fileID(path)
+
+        info = catalog.get(path)
+        if info is None or info['size'] != size or info['mtime'] != mtime:
+            info = readFileInfo(path)
+            info['size'] = size
+            info['mtime'] = mtime
+            newInfo[path] = info
+
+        out.append(info)
+
+    if newInfo:
+        if save:
+            _save(newInfo)
+        else:
+            catalog.update(newInfo)
+
+    return out
+
+
+def summedWeights(files):
+    '''
+    Total sum of generator weights in files, or None if none of them has a
+    metaInfo tree. Raises ValueError if only some of them do, because the
+    sum of the rest would silently normalize the sample wrong.
+    '''
+    files = list(files)
+    infos = fileInfo(files)
+    missing = [f for f, info in zip(files, infos) if info['sumW'] is None]
+    if len(missing) == len(infos):
+        return None
+    if missing:
+        for f in missing:
+            rlog.error("No sum of weights (metaInfo) in {}".format(f))
+        raise ValueError("{} of {} files have no sum of weights".format(len(missing),
+                                                                        len(infos)))
+
+    return sum(info['sumW'] for info in infos)
+
+
+def nEntries(files, channel):
+    '''
+    Total number of entries in the channel/ntuple trees of files.
+    '''
+    return sum(info['entries'].get(channel, 0) for info in fileInfo(files))
+
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser as _Args
+    from os import walk as _walk
+    from fnmatch import fnmatch as _fnmatch
+
+    parser = _Args(description=("Add all ntuple files in some directories to "
+                                "the metadata catalog."))
+    parser.add_argument('directories', type=str, nargs='+',
+                        help='Directories to search (recursively).')
+    parser.add_argument('--pattern', type=str, default='*.root',
+                        help='Only include files matching this pattern.')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='Print the information for each file.')
+
+    args = parser.parse_args()
+
+    files = []
+    for d in args.directories:
+        for dirPath, dirNames, fileNames in _walk(d):
+            files += [_join(dirPath, f) for f in sorted(fileNames)
+                      if _fnmatch(f, args.pattern)]
+
+    files = list(files)
+    infos = fileInfo(files)
+
+    if args.verbose:
+        for f, info in zip(files, infos):
+            print f
+            print "    sumW: {}".format(info['sumW'])
+            for ch, n in sorted(info['entries'].iteritems()):
+                print "    {}: {} entries".format(ch, n)
+
+    print "Catalog has information on {} files.".format(len(files))
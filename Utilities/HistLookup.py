@@ -0,0 +1,162 @@
+'''
+
+HistLookup.py
+
+Look up histogram bin contents (or errors) for whole arrays of values at
+once with numpy, e.g. to get scale factors for millions of leptons in one
+go. Values outside the histogram get the first or last bin on each axis,
+exactly like the weight functions made by WeightStringMaker, and values
+are rounded to single precision first like the arguments of those
+functions, so the results are identical.
+
+Run this as a script to check against TH1::FindBin and time a lookup:
+    python Utilities/HistLookup.py --n 10000000
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import numpy as _np
+
+from Utilities.histArrays import axisEdges as _axisEdges
+from Utilities.histArrays import binsFromEdges as _binsFromEdges
+
+
+class HistLookup(object):
+    '''
+    Vectorized bin lookup in a 1- or 2-D histogram. The binning and contents
+    are copied, so the histogram can be changed or deleted afterwards.
+
+    lookup = HistLookup(h)
+    sfs = lookup(pt, eta) # same as h.GetBinContent(h.FindBin(pt, eta)),
+                          # with under/overflow moved to the nearest bin
+    errs = lookup.error(pt, eta)
+    '''
+    def __init__(self, h, getError=False):
+        '''
+        h (TH1 or TH2): histogram to look up values in.
+        getError (bool): if True, calling the lookup gives the bin error
+            instead of the content.
+        '''
+        self.dim = h.GetDimension()
+        if self.dim not in (1, 2):
+            raise ValueError("Can only look up values in 1- or 2-D "
+                             "histograms, not {}-D {}".format(self.dim,
+                                                              h.GetName()))
+
+        self.getError = getError
+
+        self._axes = []
+        for ax in [h.GetXaxis(), h.GetYaxis()][:self.dim]:
+            if ax.GetXbins().GetSize() == 0:
+                uniformRange = (ax.GetXmin(), ax.GetXmax())
+            else:
+                uniformRange = None
+            self._axes.append((_axisEdges(ax), uniformRange))
+
+        nCells = h.GetNcells()
+        self._contents = _np.array([h.GetBinContent(i) for i in xrange(nCells)])
+        self._errors = _np.array([h.GetBinError(i) for i in xrange(nCells)])
+
+
+    def bins(self, *values):
+        '''
+        ROOT global bin numbers for values (one array per axis), with values
+        outside the histogram moved to the first or last bin on that axis.
+        '''
+        if len(values) != self.dim:
+            raise ValueError("Need {} arrays to look up values in a {}-D "
+                             "histogram, got {}".format(self.dim, self.dim,
+                                                        len(values)))
+
+        out = 0
+        stride = 1
+        for (edges, uniformRange), x in zip(self._axes, values):
+            # the compiled functions take floats
+            x = _np.asarray(x, dtype=_np.float32).astype(_np.float64)
+            nBins = len(edges) - 1
+            axBins = _np.clip(_binsFromEdges(edges, x, uniformRange), 1, nBins)
+            out = out + stride * axBins
+            stride *= nBins + 2
+
+        return out
+
+
+    def _lookup(self, table, values):
+        bins = self.bins(*values)
+        out = table[bins]
+
+        # missing values (e.g. past the end of a vector branch) stay missing
+        missing = _np.zeros(out.shape, dtype=bool)
+        for x in values:
+            missing |= _np.isnan(_np.asarray(x, dtype=_np.float64))
+        if missing.any():
+            out[missing] = _np.nan
+
+        return out
+
+
+    def content(self, *values):
+        '''
+        Array of bin contents for values (one array per axis).
+        '''
+        return self._lookup(self._contents, values)
+
+
+    def error(self, *values):
+        '''
+        Array of bin errors for values (one array per axis).
+        '''
+        return self._lookup(self._errors, values)
+
+
+    def __call__(self, *values):
+        if self.getError:
+            return self.error(*values)
+        return self.content(*values)
+
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser as _Args
+    from time import time as _time
+
+    from rootpy.plotting import Hist2D
+
+    parser = _Args(description=("Check HistLookup against ROOT and time it."))
+    parser.add_argument('--n', type=int, default=10000000,
+                        help='Number of values to look up for the timing.')
+    parser.add_argument('--nCheck', type=int, default=100000,
+                        help='Number of values to check against ROOT.')
+
+    args = parser.parse_args()
+
+    rand = _np.random.RandomState(12345)
+
+    h = Hist2D([0., 10., 20., 35., 50., 75., 100., 200.], 10, -2.5, 2.5)
+    for i in xrange(h.GetNcells()):
+        h.SetBinContent(i, rand.uniform(0.8, 1.2))
+        h.SetBinError(i, rand.uniform(0., 0.1))
+
+    lookup = HistLookup(h)
+
+    pt = rand.exponential(40., args.nCheck)
+    eta = rand.uniform(-3., 3., args.nCheck)
+    sfs = lookup(pt, eta)
+
+    nBad = 0
+    for x, y, sf in zip(pt, eta, sfs):
+        binx = min(max(h.GetXaxis().FindBin(float(_np.float32(x))), 1),
+                   h.GetNbinsX())
+        biny = min(max(h.GetYaxis().FindBin(float(_np.float32(y))), 1),
+                   h.GetNbinsY())
+        if h.GetBinContent(binx, biny) != sf:
+            nBad += 1
+    print "{} of {} lookups differ from ROOT".format(nBad, args.nCheck)
+
+    pt = rand.exponential(40., args.n)
+    eta = rand.uniform(-3., 3., args.n)
+    start = _time()
+    lookup(pt, eta)
+    print "Looked up {} values in {:.1f} ms".format(args.n,
+                                                    (_time() - start) * 1000.)
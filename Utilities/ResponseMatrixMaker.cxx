@@ -1,6 +1,13 @@
 #include "ResponseMatrixMaker.hxx"
+#include "TBranch.h"
+#include "TBranchElement.h"
+#include "TBranchObject.h"
+#include "TLeaf.h"
+#include "TObjArray.h"
 #include<cstdlib>
+#include<cstring> // std::memcpy
 #include<iostream>
+#include<stdexcept>
 #include<cmath> // std::sqrt
 
 
@@ -97,9 +104,113 @@ namespace
 
     return h.GetBinError(bin);
   }
+
+  const Vec<size_t> scaleIndicesWeCareAbout = {1,2,3,4,6,8};
+
+  // ROOT only fills one address per branch, so when several response matrix
+  // makers point the same branch at their own members, only the last one
+  // would get anything. This watches the makers set their branches one at a
+  // time, gives each branch back to the first one that wanted it, and after
+  // every GetEntry() copies its value to everyone else who wanted it.
+  // Object branches (vectors) can't just be copied, so the later makers'
+  // pointers are pointed at the first maker's object instead.
+  class BranchSharer
+  {
+   public:
+    BranchSharer(TChain& t) :
+      tree(t)
+    {
+      tree.LoadTree(0);
+      addresses = getAddresses();
+    }
+
+    // Call after each maker sets its branches
+    void update()
+    {
+      for(const auto& addr : getAddresses())
+        {
+          void*& owned = addresses[addr.first];
+
+          if(addr.second == owned)
+            continue;
+
+          if(owned)
+            {
+              copies.push_back(BranchCopy(tree.GetBranch(addr.first.c_str()),
+                                          owned, addr.second));
+              tree.SetBranchAddress(addr.first.c_str(), owned);
+            }
+          else
+            owned = addr.second;
+        }
+    }
+
+    // Call after each GetEntry()
+    void copy() const
+    {
+      for(const auto& c : copies)
+        {
+          if(c.nBytes)
+            std::memcpy(c.to, c.from, c.nBytes);
+          else
+            *static_cast<void**>(c.to) = *static_cast<void**>(c.from);
+        }
+    }
+
+   private:
+    struct BranchCopy
+    {
+      BranchCopy(TBranch* b, void* from, void* to) :
+        from(from), to(to), nBytes(0)
+      {
+        if(b->InheritsFrom(TBranchElement::Class()) ||
+           b->InheritsFrom(TBranchObject::Class()))
+          return;
+
+        TObjArray* leaves = b->GetListOfLeaves();
+        for(int i = 0; i < leaves->GetEntriesFast(); ++i)
+          {
+            TLeaf* leaf = static_cast<TLeaf*>(leaves->At(i));
+            nBytes += leaf->GetLenType() * leaf->GetLenStatic();
+          }
+      }
+
+      void* from;
+      void* to;
+      size_t nBytes; // 0 for object branches
+    };
+
+    Map<Str, void*> getAddresses() const
+    {
+      Map<Str, void*> out;
+
+      TObjArray* branches = tree.GetListOfBranches();
+      if(!branches) // no trees in the chain
+        return out;
+
+      for(int i = 0; i < branches->GetEntriesFast(); ++i)
+        {
+          TBranch* b = static_cast<TBranch*>(branches->At(i));
+          out[b->GetName()] = b->GetAddress();
+        }
+
+      return out;
+    }
+
+    TChain& tree;
+    Map<Str, void*> addresses;
+    Vec<BranchCopy> copies;
+  };
 };
 
 
+ResponseMatrixMakerInterface::~ResponseMatrixMakerInterface()
+{
+  if(composite)
+    composite->removeResponseMaker(*this);
+}
+
+
 template<typename T>
 ResponseMatrixMakerBase<T>::ResponseMatrixMakerBase(const Str& channel,
                                                     const Str& varName,
@@ -113,8 +224,40 @@ ResponseMatrixMakerBase<T>::ResponseMatrixMakerBase(const Str& channel,
 {
   scale = 1.;
   skipSyst = false;
+  hasLHE = false;
+  doPUWt = false;
+  doPUWtUp = false;
+  doPUWtDn = false;
+
+  trueMZ1 = &trueMZ1Value;
+  trueMZ2 = &trueMZ2Value;
+  scaleWtPtr = &scaleWeights;
+  pdfWtPtr = &pdfAndAlphaSWeights;
 
   pdfResponses = TH3D("null", "null", 1, 0., 1., 1, 0., 1., 1, 0., 1.);
+
+  if(channel.find("eeee") != Str::npos)
+    {
+      objects = Vec<Str>({"e1","e2","e3","e4"});
+      hasE = true;
+      hasMu = false;
+    }
+  else if(channel.find("eemm") != Str::npos)
+    {
+      objects = Vec<Str>({"e1","e2","m1","m2"});
+      hasE = true;
+      hasMu = true;
+    }
+  else
+    {
+      objects = Vec<Str>({"m1","m2","m3","m4"});
+      hasE = false;
+      hasMu = true;
+    }
+
+  isJetVar = (varName.find("jet") != Str::npos ||
+              varName.find("Jet") != Str::npos ||
+              varName.find("jj") != Str::npos);
 }
 
 
@@ -133,7 +276,12 @@ template<typename T>
 const TH2D& ResponseMatrixMakerBase<T>::getResponse(const Str& syst)
 {
   if(!responses.size())
-    setup();
+    {
+      if(composite)
+        composite->setup();
+      else
+        setup();
+    }
 
   return responses.at(syst);
 }
@@ -143,7 +291,12 @@ template<typename T>
 const TH3D& ResponseMatrixMakerBase<T>::getPDFResponses()
 {
   if(!responses.size())
-    setup();
+    {
+      if(composite)
+        composite->setup();
+      else
+        setup();
+    }
 
   return pdfResponses;
 }
@@ -153,7 +306,12 @@ template<typename T>
 const Vec<TH2D>& ResponseMatrixMakerBase<T>::getScaleResponses()
 {
   if(!responses.size())
-    setup();
+    {
+      if(composite)
+        composite->setup();
+      else
+        setup();
+    }
 
   return scaleResponses;
 }
@@ -184,13 +342,70 @@ void ResponseMatrixMakerBase<T>::setup()
   for(const auto& fn : fileNames)
     recoTree->Add(fn.c_str());
 
+  // Scale and PDF systematics only done for samples that have LHE info (e.g.
+  // not MCFM)
+  bookResponses(bool(recoTree->FindBranch("pdfWeights")));
+
+  // Get gen info
+  UPtr<TChain> trueTree = UPtr<TChain>(new TChain((getChannel()+"Gen/ntuple").c_str(),
+                                                  ("trueChain_"+getVar() + "_" + getChannel()).c_str()));
+  for(const auto& fn : fileNames)
+    trueTree->Add(fn.c_str());
+
+  setTrueTree(*trueTree);
+
+  for(size_t row = 0; row < size_t(std::abs(trueTree->GetEntries())); ++row)
+    {
+      trueTree->GetEntry(row);
+      readTrueEvent();
+    }
+
+  trueTree.reset(); // gone -- don't use any more
+
+  setRecoTree(*recoTree, true);
+
+  // Loop through base reco tree, fill most things
+  for(size_t row = 0; row < size_t(std::abs(recoTree->GetEntries())); ++row)
+    {
+      recoTree->GetEntry(row);
+      fillRecoEvent();
+    }
+
+  recoTree.reset(); // gone -- don't use any more
+
+  // systematics requiring other ntuples
+  for(auto& treeInfo : systTreesNeeded(systFileNames))
+    {
+      const Str& systName = treeInfo.first;
+      const Str& treeName = treeInfo.second;
+
+      UPtr<TChain> t = UPtr<TChain>(new TChain((getChannel()+"/ntuple").c_str(),
+                                               ("chain_"+getVar() + "_" + getChannel()).c_str()));
+      for(const auto& fn : systFileNames[treeName])
+        t->Add(fn.c_str());
+
+      setRecoTree(*t, false);
+
+      for(size_t row = 0; row < size_t(std::abs(t->GetEntries())); ++row)
+        {
+          t->GetEntry(row);
+          fillSystEvent(systName);
+        }
+    } // new tree disappears here
+
+  finishResponses();
+}
+
+
+template<typename T>
+void ResponseMatrixMakerBase<T>::bookResponses(bool hasLHEInfo)
+{
+  hasLHE = hasLHEInfo;
+
   // set up lots of things
   Vec<Str> systs = Vec<Str>({"",
         "pu_up","pu_dn",
         });
-  const bool isJetVar = (varName.find("jet") != Str::npos ||
-                         varName.find("Jet") != Str::npos ||
-                         varName.find("jj") != Str::npos);
   if(isJetVar && !skipSyst)
     {
       systs.push_back("jer_up");
@@ -198,62 +413,24 @@ void ResponseMatrixMakerBase<T>::setup()
       systs.push_back("jes_up");
       systs.push_back("jes_dn");
     }
-  bool hasE, hasMu;
-  Vec<Str> objects;
-  if(channel.find("eeee") != Str::npos)
-    {
-      objects = Vec<Str>({"e1","e2","e3","e4"});
-      hasE = true;
-      hasMu = false;
-      if(!skipSyst)
-        {
-          systs.push_back("eEff_up");
-          systs.push_back("eEff_dn");
-          systs.push_back("eScale_up");
-          systs.push_back("eScale_dn");
-          systs.push_back("eRhoRes_up");
-          systs.push_back("eRhoRes_dn");
-          systs.push_back("ePhiRes_up");
-        }
-    }
-  else if(channel.find("eemm") != Str::npos)
+  if(hasE && !skipSyst)
     {
-      objects = Vec<Str>({"e1","e2","m1","m2"});
-      hasE = true;
-      hasMu = true;
-      if(!skipSyst)
-        {
-          systs.push_back("eEff_up");
-          systs.push_back("eEff_dn");
-          systs.push_back("mEff_up");
-          systs.push_back("mEff_dn");
-          systs.push_back("eScale_up");
-          systs.push_back("eScale_dn");
-          systs.push_back("eRhoRes_up");
-          systs.push_back("eRhoRes_dn");
-          systs.push_back("ePhiRes_up");
-          systs.push_back("mClosure_up");
-          systs.push_back("mClosure_dn");
-        }
+      systs.push_back("eEff_up");
+      systs.push_back("eEff_dn");
+      systs.push_back("eScale_up");
+      systs.push_back("eScale_dn");
+      systs.push_back("eRhoRes_up");
+      systs.push_back("eRhoRes_dn");
+      systs.push_back("ePhiRes_up");
     }
-  else
+  if(hasMu && !skipSyst)
     {
-      objects = Vec<Str>({"m1","m2","m3","m4"});
-      hasE = false;
-      hasMu = true;
-      if(!skipSyst)
-        {
-          systs.push_back("mEff_up");
-          systs.push_back("mEff_dn");
-          systs.push_back("mClosure_up");
-          systs.push_back("mClosure_dn");
-        }
+      systs.push_back("mEff_up");
+      systs.push_back("mEff_dn");
+      systs.push_back("mClosure_up");
+      systs.push_back("mClosure_dn");
     }
 
-  // Scale and PDF systematics only done for samples that have LHE info (e.g.
-  // not MCFM)
-  bool hasLHE = bool(recoTree->FindBranch("pdfWeights"));
-  const Vec<size_t> scaleIndicesWeCareAbout = {1,2,3,4,6,8};
   if(hasLHE && !skipSyst)
     {
       for(auto i : scaleIndicesWeCareAbout)
@@ -264,24 +441,16 @@ void ResponseMatrixMakerBase<T>::setup()
                  binning.size()-1, &binning[0]));
         }
 
-      if(!skipSyst)
-        {
-          Vec<float> iterationBins;
-          for(size_t i = 0; i <= nPDFVariations; ++i)
-            iterationBins.push_back(float(i));
-          pdfResponses = TH3D("pdfResponses", "",
-                              binning.size()-1, &binning[0],
-                              binning.size()-1, &binning[0],
-                              iterationBins.size()-1, &iterationBins[0]);
-
-          auto scaleWtPtr = &scaleWeights;
-          auto pdfWtPtr = &pdfAndAlphaSWeights;
-          recoTree->SetBranchAddress("scaleWeights", &scaleWtPtr);
-          recoTree->SetBranchAddress("pdfWeights", &pdfWtPtr);
-
-          systs.push_back("alphaS_up");
-          systs.push_back("alphaS_dn");
-        }
+      Vec<float> iterationBins;
+      for(size_t i = 0; i <= nPDFVariations; ++i)
+        iterationBins.push_back(float(i));
+      pdfResponses = TH3D("pdfResponses", "",
+                          binning.size()-1, &binning[0],
+                          binning.size()-1, &binning[0],
+                          iterationBins.size()-1, &iterationBins[0]);
+
+      systs.push_back("alphaS_up");
+      systs.push_back("alphaS_dn");
     }
 
   for(auto& s : systs)
@@ -295,215 +464,208 @@ void ResponseMatrixMakerBase<T>::setup()
                        binning.size()-1, &binning[0],
                        binning.size()-1, &binning[0]);
 
-  // Get gen info
-  UPtr<TChain> trueTree = UPtr<TChain>(new TChain((getChannel()+"Gen/ntuple").c_str(),
-                                                  ("trueChain_"+getVar() + "_" + getChannel()).c_str()));
-  for(const auto& fn : fileNames)
-    trueTree->Add(fn.c_str());
+  doPUWt = (puWeightHists.find("") != puWeightHists.end());
+  doPUWtUp = (puWeightHists.find("up") != puWeightHists.end());
+  doPUWtDn = (puWeightHists.find("dn") != puWeightHists.end());
+}
 
-  UPtr<UMap<size_t, T> > trueVals = this->getTrueValues(*trueTree.get(),
-                                                        objects);
 
-  trueTree.reset(); // gone -- don't use any more
+template<typename T>
+void ResponseMatrixMakerBase<T>::setTrueTree(TChain& trueTree)
+{
+  trueVals.reset(new UMap<size_t, T>());
 
-  // Set up common branches
-  setCommonBranches(*recoTree, objects);
+  this->setTrueBranches(trueTree, objects);
 
-  this->setRecoBranches(*recoTree.get(), objects);
+  // after the subclass, in case it already uses the Z mass branches
+  trueTree.SetBranchAddress("evt", &trueEvt);
+  trueMZ1 = this->getmZPtr(trueTree, objects.at(0), objects.at(1),
+                           trueMZ1Value);
+  trueMZ2 = this->getmZPtr(trueTree, objects.at(2), objects.at(3),
+                           trueMZ2Value);
+}
 
-  bool doPUWt = (puWeightHists.find("") != puWeightHists.end());
-  bool doPUWtUp = (puWeightHists.find("up") != puWeightHists.end());
-  bool doPUWtDn = (puWeightHists.find("dn") != puWeightHists.end());
 
-  // Loop through base reco tree, fill most things
-  for(size_t row = 0; row < size_t(std::abs(recoTree->GetEntries())); ++row)
-    {
-      recoTree->GetEntry(row);
+template<typename T>
+void ResponseMatrixMakerBase<T>::readTrueEvent()
+{
+  if(!this->selectTrueEvent(*trueMZ1,*trueMZ2))
+    return;
 
-      // elements needed for event weights
-      float puWt = (doPUWt ? ::getContentFromHist(puWeightHists.at(""), truePU) : 1.);
-      float puWtUp = (doPUWtUp ? ::getContentFromHist(puWeightHists.at("up"), truePU) : 1.);
-      float puWtDn = (doPUWtDn ? ::getContentFromHist(puWeightHists.at("dn"), truePU) : 1.);
+  T val;
+  if(this->getTrueValue(val))
+    (*trueVals)[trueEvt] = val;
+}
 
-      float lepSF = this->getLepSF(objects);
-      float lepSFEUp = 1.;
-      float lepSFEDn = 1.;
-      float lepSFMUp = 1.;
-      float lepSFMDn = 1.;
 
-      if(hasE)
-        {
-          lepSFEUp = this->getLepSF(objects, 1., 0.);
-          lepSFEDn = this->getLepSF(objects, -1., 0.);
-        }
-      if(hasMu)
-        {
-          lepSFMUp = this->getLepSF(objects, 0., 1.);
-          lepSFMDn = this->getLepSF(objects, 0., -1.);
-        }
+template<typename T>
+void ResponseMatrixMakerBase<T>::setRecoTree(TChain& t, bool withLHEWeights)
+{
+  // Set up common branches
+  setCommonBranches(t, objects);
 
-      // for(size_t i = 0; i < objects.size(); ++i)
-      //   {
-      //     if(objects.at(i)[0] == "e")
-      //       {
-      //         lepSF *= ::getContentFromHist(leptonSFHists["e"][""], lPt.at(i), std::abs(lEta.at(i)));
-      //         lepSFEUp *= ::getContentFromHist(leptonSFHists["e"]["up"], lPt.at(i), std::abs(lEta.at(i)));
-      //         lepSFEDn *= ::getContentFromHist(leptonSFHists["e"]["dn"], lPt.at(i), std::abs(lEta.at(i)));
-      //       }
-      //     if(objects.at(i)[0] == "m")
-      //       {
-      //         lepSF *= ::getContentFromHist(leptonSFHists["m"][""], lPt.at(i), lEta.at(i));
-      //         lepSFMUp *= ::getContentFromHist(leptonSFHists["m"]["up"], lPt.at(i), lEta.at(i));
-      //         lepSFMDn *= ::getContentFromHist(leptonSFHists["m"]["dn"], lPt.at(i), lEta.at(i));
-      //       }
-      //   }
-
-      auto iTrue = trueVals->find(evt);
-      if(iTrue == trueVals->end())
-        continue;
-      const T& trueVal = iTrue->second;
-
-      if(this->selectEvent())
-        {
-          // Nominal value
-          const T val = this->getEventResponse();
+  if(withLHEWeights && hasLHE && !skipSyst)
+    {
+      scaleWtPtr = &scaleWeights;
+      pdfWtPtr = &pdfAndAlphaSWeights;
+      t.SetBranchAddress("scaleWeights", &scaleWtPtr);
+      t.SetBranchAddress("pdfWeights", &pdfWtPtr);
+    }
 
-          const float nominalWeight = scale * puWt * lepSF * genWeight;
+  this->setRecoBranches(t, objects);
+}
 
-          // fill histos that use nominal value but with different weights
-          this->fillResponse(responses[""], val, trueVal, nominalWeight);
 
-          if(!skipSyst)
-            {
-              this->fillResponse(responses["pu_up"], val, trueVal, scale * puWtUp * lepSF * genWeight);
-              this->fillResponse(responses["pu_dn"], val, trueVal, scale * puWtDn * lepSF * genWeight);
-
-              if(hasE)
-                {
-                  this->fillResponse(responses["eEff_up"], val, trueVal, scale * puWt * lepSFEUp * genWeight);
-                  this->fillResponse(responses["eEff_dn"], val, trueVal, scale * puWt * lepSFEDn * genWeight);
-                }
-              if(hasMu)
-                {
-                  this->fillResponse(responses["mEff_up"], val, trueVal, scale * puWt * lepSFMUp * genWeight);
-                  this->fillResponse(responses["mEff_dn"], val, trueVal, scale * puWt * lepSFMDn * genWeight);
-                }
-
-              if(hasLHE && pdfAndAlphaSWeights.at(0))
-                {
-                  // fill once for each scale variation
-                  float nominalWeightScaleNorm = nominalWeight / scaleWeights.at(0);
-                  for(size_t ind = 0; ind < scaleIndicesWeCareAbout.size(); ++ind)
-                    this->fillResponse(scaleResponses.at(ind), val, trueVal,
-                                       nominalWeightScaleNorm * scaleWeights.at(scaleIndicesWeCareAbout.at(ind)));
-
-                  // fill the 3-D histogram with one response for each PDF variation
-                  float nominalWeightPDFNorm = nominalWeight / pdfAndAlphaSWeights.at(0);
-                  for(size_t ind = 0; ind < nPDFVariations; ++ind)
-                    this->fillResponse(pdfResponses, val, trueVal, ind,
-                                       nominalWeightPDFNorm * pdfAndAlphaSWeights.at(ind));
-
-                  // the last two items in the PDF weight vector are alpha_S variations
-                  this->fillResponse(responses["alphaS_up"], val, trueVal,
-                                     nominalWeightPDFNorm * pdfAndAlphaSWeights.at(iAlphaSUp));
-                  this->fillResponse(responses["alphaS_dn"], val, trueVal,
-                                     nominalWeightPDFNorm * pdfAndAlphaSWeights.at(iAlphaSDn));
-                }
-
-              // changes to jet scale/resolution actually change numbers
-              if(isJetVar)
-                {
-                  if(this->selectEvent("jer_up"))
-                    this->fillResponse(responses["jer_up"], this->getEventResponse("jer_up"),
-                                       trueVal, nominalWeight);
-                  if(this->selectEvent("jer_dn"))
-                    this->fillResponse(responses["jer_dn"], this->getEventResponse("jer_dn"),
-                                       trueVal, nominalWeight);
-                  if(this->selectEvent("jes_up"))
-                    this->fillResponse(responses["jes_up"], this->getEventResponse("jes_up"),
-                                       trueVal, nominalWeight);
-                  if(this->selectEvent("jes_dn"))
-                    this->fillResponse(responses["jes_dn"], this->getEventResponse("jes_dn"),
-                                       trueVal, nominalWeight);
-                }
-            }
-        }
+template<typename T>
+void ResponseMatrixMakerBase<T>::fillRecoEvent()
+{
+  // elements needed for event weights
+  float puWt = (doPUWt ? ::getContentFromHist(puWeightHists.at(""), truePU) : 1.);
+  float puWtUp = (doPUWtUp ? ::getContentFromHist(puWeightHists.at("up"), truePU) : 1.);
+  float puWtDn = (doPUWtDn ? ::getContentFromHist(puWeightHists.at("dn"), truePU) : 1.);
+
+  float lepSF = this->getLepSF(objects);
+  float lepSFEUp = 1.;
+  float lepSFEDn = 1.;
+  float lepSFMUp = 1.;
+  float lepSFMDn = 1.;
+
+  if(hasE)
+    {
+      lepSFEUp = this->getLepSF(objects, 1., 0.);
+      lepSFEDn = this->getLepSF(objects, -1., 0.);
+    }
+  if(hasMu)
+    {
+      lepSFMUp = this->getLepSF(objects, 0., 1.);
+      lepSFMDn = this->getLepSF(objects, 0., -1.);
     }
 
-  recoTree.reset(); // gone -- don't use any more
+  auto iTrue = trueVals->find(evt);
+  if(iTrue == trueVals->end())
+    return;
+  const T& trueVal = iTrue->second;
 
-  Map<Str,Str> systTreesNeeded;
-  if(hasE && !skipSyst)
+  if(!this->selectEvent())
+    return;
+
+  // Nominal value
+  const T val = this->getEventResponse();
+
+  const float nominalWeight = scale * puWt * lepSF * genWeight;
+
+  // fill histos that use nominal value but with different weights
+  this->fillResponse(responses[""], val, trueVal, nominalWeight);
+
+  if(skipSyst)
+    return;
+
+  this->fillResponse(responses["pu_up"], val, trueVal, scale * puWtUp * lepSF * genWeight);
+  this->fillResponse(responses["pu_dn"], val, trueVal, scale * puWtDn * lepSF * genWeight);
+
+  if(hasE)
     {
-      if(systFileNames.find("eScaleUp") != systFileNames.end())
-        systTreesNeeded["eScale_up"] = "eScaleUp";
-      if(systFileNames.find("eScaleDn") != systFileNames.end())
-        systTreesNeeded["eScale_dn"] = "eScaleDn";
-      if(systFileNames.find("eRhoResUp") != systFileNames.end())
-        systTreesNeeded["eRhoRes_up"] = "eRhoResUp";
-      if(systFileNames.find("eRhoResDn") != systFileNames.end())
-        systTreesNeeded["eRhoRes_dn"] = "eRhoResDn";
-      if(systFileNames.find("ePhiResUp") != systFileNames.end())
-        systTreesNeeded["ePhiRes_up"] = "ePhiResUp";
+      this->fillResponse(responses["eEff_up"], val, trueVal, scale * puWt * lepSFEUp * genWeight);
+      this->fillResponse(responses["eEff_dn"], val, trueVal, scale * puWt * lepSFEDn * genWeight);
     }
-  if(hasMu && !skipSyst)
+  if(hasMu)
     {
-      if(systFileNames.find("mClosureUp") != systFileNames.end())
-        systTreesNeeded["mClosure_up"] = "mClosureUp";
-      if(systFileNames.find("mClosureDn") != systFileNames.end())
-        systTreesNeeded["mClosure_dn"] = "mClosureDn";
+      this->fillResponse(responses["mEff_up"], val, trueVal, scale * puWt * lepSFMUp * genWeight);
+      this->fillResponse(responses["mEff_dn"], val, trueVal, scale * puWt * lepSFMDn * genWeight);
     }
 
-  // systematics requiring other ntuples
-  for(auto& treeInfo : systTreesNeeded)
+  if(hasLHE && pdfWtPtr->at(0))
     {
-      const Str& systName = treeInfo.first;
-      const Str& treeName = treeInfo.second;
+      // fill once for each scale variation
+      float nominalWeightScaleNorm = nominalWeight / scaleWtPtr->at(0);
+      for(size_t ind = 0; ind < scaleIndicesWeCareAbout.size(); ++ind)
+        this->fillResponse(scaleResponses.at(ind), val, trueVal,
+                           nominalWeightScaleNorm * scaleWtPtr->at(scaleIndicesWeCareAbout.at(ind)));
+
+      // fill the 3-D histogram with one response for each PDF variation
+      float nominalWeightPDFNorm = nominalWeight / pdfWtPtr->at(0);
+      for(size_t ind = 0; ind < nPDFVariations; ++ind)
+        this->fillResponse(pdfResponses, val, trueVal, ind,
+                           nominalWeightPDFNorm * pdfWtPtr->at(ind));
+
+      // the last two items in the PDF weight vector are alpha_S variations
+      this->fillResponse(responses["alphaS_up"], val, trueVal,
+                         nominalWeightPDFNorm * pdfWtPtr->at(iAlphaSUp));
+      this->fillResponse(responses["alphaS_dn"], val, trueVal,
+                         nominalWeightPDFNorm * pdfWtPtr->at(iAlphaSDn));
+    }
 
-      UPtr<TChain> t = UPtr<TChain>(new TChain((getChannel()+"/ntuple").c_str(),
-                                               ("chain_"+getVar() + "_" + getChannel()).c_str()));
-      for(const auto& fn : systFileNames[treeName])
-        t->Add(fn.c_str());
+  // changes to jet scale/resolution actually change numbers
+  if(isJetVar)
+    {
+      if(this->selectEvent("jer_up"))
+        this->fillResponse(responses["jer_up"], this->getEventResponse("jer_up"),
+                           trueVal, nominalWeight);
+      if(this->selectEvent("jer_dn"))
+        this->fillResponse(responses["jer_dn"], this->getEventResponse("jer_dn"),
+                           trueVal, nominalWeight);
+      if(this->selectEvent("jes_up"))
+        this->fillResponse(responses["jes_up"], this->getEventResponse("jes_up"),
+                           trueVal, nominalWeight);
+      if(this->selectEvent("jes_dn"))
+        this->fillResponse(responses["jes_dn"], this->getEventResponse("jes_dn"),
+                           trueVal, nominalWeight);
+    }
+}
 
-      setCommonBranches(*t, objects);
-      this->setRecoBranches(*t, objects);
 
-      for(size_t row = 0; row < size_t(std::abs(t->GetEntries())); ++row)
-        {
-          t->GetEntry(row);
+template<typename T>
+void ResponseMatrixMakerBase<T>::fillSystEvent(const Str& syst)
+{
+  float puWt = (doPUWt ? ::getContentFromHist(puWeightHists.at(""), truePU) : 1.);
 
-          float puWt = (doPUWt ? ::getContentFromHist(puWeightHists.at(""), truePU) : 1.);
+  float lepSF = this->getLepSF(objects);
 
-          float lepSF = this->getLepSF(objects);
+  auto iTrue = trueVals->find(evt);
 
-           // for(size_t i = 0; i < objects.size(); ++i)
-           //   {
-           //     if(objects.at(i)[0] == "e")
-           //       {
-           //         lepSF *= ::getContentFromHist(leptonSFHists["e"][""], lPt.at(i), std::abs(lEta.at(i)));
-           //       }
-           //     if(objects.at(i)[0] == "m")
-           //       {
-           //         lepSF *= ::getContentFromHist(leptonSFHists["m"][""], lPt.at(i), lEta.at(i));
-           //       }
-           //   }
+  if(iTrue == trueVals->end())
+    return;
 
-          auto iTrue = trueVals->find(evt);
+  const T& trueVal = iTrue->second;
 
-          if(iTrue == trueVals->end())
-            continue;
+  if(this->selectEvent(syst))
+    {
+      this->fillResponse(responses[syst], this->getEventResponse(),
+                         trueVal, scale * puWt * lepSF * genWeight);
+    }
+}
 
-          const T& trueVal = iTrue->second;
 
-          if(this->selectEvent(systName))
-            {
-              this->fillResponse(responses[systName], this->getEventResponse(),
-                                 trueVal, scale * puWt * lepSF * genWeight);
-            }
-        }
-    } // new tree disappears here
+template<typename T>
+Map<Str,Str>
+ResponseMatrixMakerBase<T>::systTreesNeeded(const UMap<Str, Vec<Str> >& systFiles) const
+{
+  Map<Str,Str> out;
+  if(skipSyst)
+    return out;
 
-  trueVals.reset();
+  if(hasE)
+    {
+      if(systFiles.find("eScaleUp") != systFiles.end())
+        out["eScale_up"] = "eScaleUp";
+      if(systFiles.find("eScaleDn") != systFiles.end())
+        out["eScale_dn"] = "eScaleDn";
+      if(systFiles.find("eRhoResUp") != systFiles.end())
+        out["eRhoRes_up"] = "eRhoResUp";
+      if(systFiles.find("eRhoResDn") != systFiles.end())
+        out["eRhoRes_dn"] = "eRhoResDn";
+      if(systFiles.find("ePhiResUp") != systFiles.end())
+        out["ePhiRes_up"] = "ePhiResUp";
+    }
+  if(hasMu)
+    {
+      if(systFiles.find("mClosureUp") != systFiles.end())
+        out["mClosure_up"] = "mClosureUp";
+      if(systFiles.find("mClosureDn") != systFiles.end())
+        out["mClosure_dn"] = "mClosureDn";
+    }
+
+  return out;
 }
 
 
@@ -579,37 +741,19 @@ BranchValueResponseMatrixMaker<T>::BranchValueResponseMatrixMaker(const Str& cha
 {;}
 
 
-template<typename T>
-UPtr<UMap<size_t, T> >
-BranchValueResponseMatrixMaker<T>::getTrueValues(TChain& t,
-                                                 const Vec<Str>& objects,
-                                                 const Str& syst) const
+template<typename T> void
+BranchValueResponseMatrixMaker<T>::setTrueBranches(TChain& t,
+                                                   const Vec<Str>& objects)
 {
-  UPtr<UMap<size_t, T> > out(new UMap<size_t, T>());
-
-  unsigned long long trueEvt;
-  T val;
-  t.SetBranchAddress("evt", &trueEvt);
-  t.SetBranchAddress(this->getVar().c_str(), &val);
-
-  float _doNotUse1 = 0.;
-  float _doNotUse2 = 0.;
-  float *const mZ1 = this->getmZPtr(t, objects.at(0), objects.at(1),
-                                    _doNotUse1);
-  float *const mZ2 = this->getmZPtr(t, objects.at(2), objects.at(3),
-                                    _doNotUse2);
-
-  for(size_t row = 0; row < size_t(std::abs(t.GetEntries())); ++row)
-    {
-      t.GetEntry(row);
-
-      if(!this->selectTrueEvent(*mZ1,*mZ2))
-        continue;
+  t.SetBranchAddress(this->getVar().c_str(), &trueValue);
+}
 
-      (*out)[trueEvt] = val;
-    }
 
-  return std::move(out);
+template<typename T> bool
+BranchValueResponseMatrixMaker<T>::getTrueValue(T& val) const
+{
+  val = trueValue;
+  return true;
 }
 
 
@@ -635,19 +779,14 @@ AbsValueResponseMatrixMaker<R>::AbsValueResponseMatrixMaker(const Str& channel,
 {;}
 
 
-template<class R>
-UPtr<UMap<size_t, typename R::ValType> >
-AbsValueResponseMatrixMaker<R>::getTrueValues(TChain& trueTree,
-                                              const Vec<Str>& objects,
-                                              const Str& syst) const
+template<class R> bool
+AbsValueResponseMatrixMaker<R>::getTrueValue(typename R::ValType& val) const
 {
-  UPtr<UMap<size_t, typename R::ValType> > out = R::getTrueValues(trueTree,
-                                                                  objects,
-                                                                  syst);
-  for(auto& val : *out)
-    this->doAbs(val.second);
+  if(!R::getTrueValue(val))
+    return false;
 
-  return std::move(out);
+  this->doAbs(val);
+  return true;
 }
 
 
@@ -715,39 +854,23 @@ DijetBranchResponseMatrixMaker::DijetBranchResponseMatrixMaker(const Str& channe
 {;}
 
 
-UPtr<UMap<size_t, float> >
-DijetBranchResponseMatrixMaker::getTrueValues(TChain& trueTree,
-                                              const Vec<Str>& objects,
-                                              const Str& syst) const
+void
+DijetBranchResponseMatrixMaker::setTrueBranches(TChain& trueTree,
+                                                const Vec<Str>& objects)
 {
-  UPtr<UMap<size_t, float> > out(new UMap<size_t, float>());
+  JetBranchResponseMatrixMakerBase<float>::setTrueBranches(trueTree, objects);
 
-  unsigned long long trueEvt;
-  float trueVal;
-  unsigned int trueNJets;
-  trueTree.SetBranchAddress("evt", &trueEvt);
-  trueTree.SetBranchAddress(this->getVar().c_str(), &trueVal);
   trueTree.SetBranchAddress("nJets", &trueNJets);
+}
 
-  float _doNotUse1 = 0.;
-  float _doNotUse2 = 0.;
-  float *const mZ1 = this->getmZPtr(trueTree, objects.at(0), objects.at(1),
-                                    _doNotUse1);
-  float *const mZ2 = this->getmZPtr(trueTree, objects.at(2), objects.at(3),
-                                    _doNotUse2);
-
-  for(size_t row = 0; row < size_t(std::abs(trueTree.GetEntries())); ++row)
-    {
-      trueTree.GetEntry(row);
-
-      if(!this->selectTrueEvent(*mZ1,*mZ2))
-        continue;
 
-      if(trueNJets >= 2)
-        (*out)[trueEvt] = trueVal;
-    }
+bool
+DijetBranchResponseMatrixMaker::getTrueValue(float& val) const
+{
+  if(trueNJets < 2)
+    return false;
 
-  return std::move(out);
+  return JetBranchResponseMatrixMakerBase<float>::getTrueValue(val);
 }
 
 
@@ -796,32 +919,13 @@ SelectedZResponseMatrixMakerBase::SelectedZResponseMatrixMakerBase(const Str& ch
 {;}
 
 
-UPtr<UMap<size_t, float> >
-SelectedZResponseMatrixMakerBase::getTrueValues(TChain& trueTree,
-                                                const Vec<Str>& objects,
-                                                const Str& syst) const
+void
+SelectedZResponseMatrixMakerBase::setTrueBranches(TChain& trueTree,
+                                                  const Vec<Str>& objects)
 {
-  UPtr<UMap<size_t, float> > out(new UMap<size_t, float>());
-
-  unsigned long long trueEvt;
-  float z1CompTrue;
-  float z2CompTrue;
-  float z1RespTrueValue;
-  float z2RespTrueValue;
-  float* z1RespTruePtr;
-  float* z2RespTruePtr;
-
-  trueTree.SetBranchAddress("evt", &trueEvt);
   trueTree.SetBranchAddress(z1CompVarName.c_str(), &z1CompTrue);
   trueTree.SetBranchAddress(z2CompVarName.c_str(), &z2CompTrue);
 
-  float _doNotUse1 = 0.;
-  float _doNotUse2 = 0.;
-  float *const mZ1 = this->getmZPtr(trueTree, objects.at(0), objects.at(1),
-                                    _doNotUse1);
-  float *const mZ2 = this->getmZPtr(trueTree, objects.at(2), objects.at(3),
-                                    _doNotUse2);
-
   if(compIsResp)
     {
       z1RespTruePtr = &z1CompTrue;
@@ -834,20 +938,16 @@ SelectedZResponseMatrixMakerBase::getTrueValues(TChain& trueTree,
       z1RespTruePtr = &z1RespTrueValue;
       z2RespTruePtr = &z2RespTrueValue;
     }
+}
 
-  for(size_t row = 0; row < size_t(std::abs(trueTree.GetEntries())); ++row)
-    {
-      trueTree.GetEntry(row);
-
-      if(!this->selectTrueEvent(*mZ1,*mZ2))
-        continue;
 
-      (*out)[trueEvt] = (this->z1IsBetter(z1CompTrue, z2CompTrue) ?
-                         *z1RespTruePtr :
-                         *z2RespTruePtr);
-    }
-
-  return std::move(out);
+bool
+SelectedZResponseMatrixMakerBase::getTrueValue(float& val) const
+{
+  val = (this->z1IsBetter(z1CompTrue, z2CompTrue) ?
+         *z1RespTruePtr :
+         *z2RespTruePtr);
+  return true;
 }
 
 
@@ -972,39 +1072,20 @@ ZZCompositeResponseMatrixMakerBase::ZZCompositeResponseMatrixMakerBase(const Str
 {;}
 
 
-UPtr<UMap<size_t, float> >
-ZZCompositeResponseMatrixMakerBase::getTrueValues(TChain& trueTree,
-                                                  const Vec<Str>& objects,
-                                                  const Str& syst) const
+void
+ZZCompositeResponseMatrixMakerBase::setTrueBranches(TChain& trueTree,
+                                                    const Vec<Str>& objects)
 {
-  UPtr<UMap<size_t, float> > out(new UMap<size_t, float>());
-
-  unsigned long long trueEvt;
-  float z1VarTrue;
-  float z2VarTrue;
-
-  trueTree.SetBranchAddress("evt", &trueEvt);
   trueTree.SetBranchAddress(z1VarName.c_str(), &z1VarTrue);
   trueTree.SetBranchAddress(z2VarName.c_str(), &z2VarTrue);
+}
 
-  float _doNotUse1 = 0.;
-  float _doNotUse2 = 0.;
-  float *const mZ1 = this->getmZPtr(trueTree, objects.at(0), objects.at(1),
-                                    _doNotUse1);
-  float *const mZ2 = this->getmZPtr(trueTree, objects.at(2), objects.at(3),
-                                    _doNotUse2);
-
-  for(size_t row = 0; row < size_t(std::abs(trueTree.GetEntries())); ++row)
-    {
-      trueTree.GetEntry(row);
-
-      if(!this->selectTrueEvent(*mZ1,*mZ2))
-        continue;
 
-      (*out)[trueEvt] = this->calculateZZVar(z1VarTrue, z2VarTrue);
-    }
-
-  return std::move(out);
+bool
+ZZCompositeResponseMatrixMakerBase::getTrueValue(float& val) const
+{
+  val = this->calculateZZVar(z1VarTrue, z2VarTrue);
+  return true;
 }
 
 
@@ -1071,43 +1152,22 @@ ZZDeltaRResponseMatrixMaker::ZZDeltaRResponseMatrixMaker(const Str& channel,
 {;}
 
 
-UPtr<UMap<size_t, float> >
-ZZDeltaRResponseMatrixMaker::getTrueValues(TChain& trueTree,
-                                           const Vec<Str>& objects,
-                                           const Str& syst) const
+void
+ZZDeltaRResponseMatrixMaker::setTrueBranches(TChain& trueTree,
+                                             const Vec<Str>& objects)
 {
-  UPtr<UMap<size_t, float> > out(new UMap<size_t, float>());
-
-  unsigned long long trueEvt;
-  float z1EtaTrue;
-  float z2EtaTrue;
-  float z1PhiTrue;
-  float z2PhiTrue;
-
-  trueTree.SetBranchAddress("evt", &trueEvt);
   trueTree.SetBranchAddress(z1EtaBranchName.c_str(), &z1EtaTrue);
   trueTree.SetBranchAddress(z2EtaBranchName.c_str(), &z2EtaTrue);
   trueTree.SetBranchAddress(z1PhiBranchName.c_str(), &z1PhiTrue);
   trueTree.SetBranchAddress(z2PhiBranchName.c_str(), &z2PhiTrue);
+}
 
-  float _doNotUse1 = 0.;
-  float _doNotUse2 = 0.;
-  float *const mZ1 = this->getmZPtr(trueTree, objects.at(0), objects.at(1),
-                                    _doNotUse1);
-  float *const mZ2 = this->getmZPtr(trueTree, objects.at(2), objects.at(3),
-                                    _doNotUse2);
-
-  for(size_t row = 0; row < size_t(std::abs(trueTree.GetEntries())); ++row)
-    {
-      trueTree.GetEntry(row);
-
-      if(!this->selectTrueEvent(*mZ1,*mZ2))
-        continue;
-
-      (*out)[trueEvt] = ::deltaR(z1EtaTrue, z1PhiTrue, z2EtaTrue, z2PhiTrue);
-    }
 
-  return std::move(out);
+bool
+ZZDeltaRResponseMatrixMaker::getTrueValue(float& val) const
+{
+  val = ::deltaR(z1EtaTrue, z1PhiTrue, z2EtaTrue, z2PhiTrue);
+  return true;
 }
 
 void
@@ -1158,42 +1218,28 @@ MultiBranchResponseMatrixMakerBase<T>::MultiBranchResponseMatrixMakerBase(const
 
 
 template<typename T>
-UPtr<UMap<size_t, Vec<T> > >
-MultiBranchResponseMatrixMakerBase<T>::getTrueValues(TChain& trueTree,
-                                                     const Vec<Str>& objects,
-                                                     const Str& syst) const
+void
+MultiBranchResponseMatrixMakerBase<T>::setTrueBranches(TChain& trueTree,
+                                                       const Vec<Str>& objects)
 {
-  UPtr<UMap<size_t, Vec<T> > > out(new UMap<size_t, Vec<T> >());
-
   const Vec<Str> varNames = this->constructVarNames(this->getChannel(),
                                                     this->getVar());
 
-  unsigned long long trueEvt;
-  Vec<T> trueValues(varNames.size());
+  trueValues.resize(varNames.size());
 
-  trueTree.SetBranchAddress("evt", &trueEvt);
+  // same danger as in setRecoBranches
   for(size_t i = 0; i < varNames.size(); ++i)
     trueTree.SetBranchAddress(varNames[i].c_str(), &trueValues[i]);
+}
 
-  float _doNotUse1 = 0.;
-  float _doNotUse2 = 0.;
-  float *const mZ1 = this->getmZPtr(trueTree, objects.at(0), objects.at(1),
-                                    _doNotUse1);
-  float *const mZ2 = this->getmZPtr(trueTree, objects.at(2), objects.at(3),
-                                    _doNotUse2);
-
-  for(size_t row = 0; row < size_t(std::abs(trueTree.GetEntries())); ++row)
-    {
-      trueTree.GetEntry(row);
-
-      if(!this->selectTrueEvent(*mZ1,*mZ2))
-        continue;
-
-      // copies elements so should be safe
-      (*out)[trueEvt] = trueValues;
-    }
 
-  return std::move(out);
+template<typename T>
+bool
+MultiBranchResponseMatrixMakerBase<T>::getTrueValue(Vec<T>& vals) const
+{
+  // copies elements so should be safe
+  vals = trueValues;
+  return true;
 }
 
 
@@ -1284,45 +1330,28 @@ LeptonMaxBranchResponseMatrixMaker::LeptonMaxBranchResponseMatrixMaker(const Str
 {;}
 
 
-UPtr<UMap<size_t, float> >
-LeptonMaxBranchResponseMatrixMaker::getTrueValues(TChain& trueTree,
-                                                  const Vec<Str>& objects,
-                                                  const Str& syst) const
+void
+LeptonMaxBranchResponseMatrixMaker::setTrueBranches(TChain& trueTree,
+                                                    const Vec<Str>& objects)
 {
-  UPtr<UMap<size_t, float> > out(new UMap<size_t, float>());
-
-  unsigned long long trueEvt;
-  Vec<float> trueValues(varNames.size());
+  trueValues.resize(varNames.size());
 
-  trueTree.SetBranchAddress("evt", &trueEvt);
   for(size_t i = 0; i < varNames.size(); ++i)
     trueTree.SetBranchAddress(varNames[i].c_str(), &trueValues[i]);
+}
 
-  float _doNotUse1 = 0.;
-  float _doNotUse2 = 0.;
-  float *const mZ1 = this->getmZPtr(trueTree, objects.at(0), objects.at(1),
-                                    _doNotUse1);
-  float *const mZ2 = this->getmZPtr(trueTree, objects.at(2), objects.at(3),
-                                    _doNotUse2);
 
-  for(size_t row = 0; row < size_t(std::abs(trueTree.GetEntries())); ++row)
+bool
+LeptonMaxBranchResponseMatrixMaker::getTrueValue(float& val) const
+{
+  val = -999999999.;
+  for(const auto& v : trueValues)
     {
-      trueTree.GetEntry(row);
-
-      if(!this->selectTrueEvent(*mZ1,*mZ2))
-        continue;
-
-      float max = -999999999.;
-      for(const auto& val : trueValues)
-        {
-          if(val > max)
-            max = val;
-        }
-
-      (*out)[trueEvt] = max;
+      if(v > val)
+        val = v;
     }
 
-  return std::move(out);
+  return true;
 }
 
 
@@ -1384,53 +1413,41 @@ NthJetResponseMatrixMaker<T,_N>::NthJetResponseMatrixMaker(const Str& channel, c
   allJetValues["jes_dn"] = &allJetValues_jesDn_object;
   allJetValues["jer_up"] = &allJetValues_jerUp_object;
   allJetValues["jer_dn"] = &allJetValues_jerDn_object;
+  allJetsTrue = &allJetsTrue_object;
 
   gROOT->ProcessLine("#include<vector>");
 }
 
 
-template<typename T, size_t _N>
-UPtr<UMap<size_t, T> >
-NthJetResponseMatrixMaker<T,_N>::getTrueValues(TChain& trueTree,
-                                               const Vec<Str>& objects,
-                                               const Str& syst) const
+template<typename T, size_t _N> void
+NthJetResponseMatrixMaker<T,_N>::setTrueBranches(TChain& trueTree,
+                                                 const Vec<Str>& objects)
 {
-  UPtr<UMap<size_t, T> > out(new UMap<size_t, T>());
-
-  unsigned long long trueEvt;
-
-  // some pointer bullshit to make ROOT happy
-  Vec<T> allJetsTrue_object;
-  Vec<T>* allJetsTrue = &allJetsTrue_object;
-  trueTree.SetBranchAddress("evt", &trueEvt);
+  allJetsTrue = &allJetsTrue_object;
   trueTree.SetBranchAddress(this->getVar().c_str(), &allJetsTrue);
+}
 
-  float _doNotUse1 = 0.;
-  float _doNotUse2 = 0.;
-  float *const mZ1 = this->getmZPtr(trueTree, objects.at(0), objects.at(1),
-                                    _doNotUse1);
-  float *const mZ2 = this->getmZPtr(trueTree, objects.at(2), objects.at(3),
-                                    _doNotUse2);
-
-  for(size_t row = 0; row < size_t(std::abs(trueTree.GetEntries())); ++row)
-    {
-      trueTree.GetEntry(row);
-
-      if(!this->selectTrueEvent(*mZ1,*mZ2))
-        continue;
 
-      if(allJetsTrue->size() > _N)
-        (*out)[trueEvt] = allJetsTrue->at(_N);
-    }
+template<typename T, size_t _N> bool
+NthJetResponseMatrixMaker<T,_N>::getTrueValue(T& val) const
+{
+  if(allJetsTrue->size() <= _N)
+    return false;
 
-  return std::move(out);
+  val = allJetsTrue->at(_N);
+  return true;
 }
 
 
 template<typename T, size_t _N> void
 NthJetResponseMatrixMaker<T,_N>::setRecoBranches(TChain& t, const Vec<Str>& objects)
 {
-  allJetValues.clear();
+  // use our own objects so ROOT doesn't make (and later delete) its own
+  allJetValues[""] = &allJetValues_object;
+  allJetValues["jes_up"] = &allJetValues_jesUp_object;
+  allJetValues["jes_dn"] = &allJetValues_jesDn_object;
+  allJetValues["jer_up"] = &allJetValues_jerUp_object;
+  allJetValues["jer_dn"] = &allJetValues_jerDn_object;
 
   t.SetBranchAddress(this->getVar().c_str(), &allJetValues[""]);
   t.SetBranchAddress((this->getVar()+"_jesUp").c_str(), &allJetValues["jes_up"]);
@@ -1663,6 +1680,163 @@ RelaxGenZCuts<R>::RelaxGenZCuts(const Str& channel, const Str& varName,
 {;}
 
 
+CompositeResponseMatrixMaker::CompositeResponseMatrixMaker(const Str& channel) :
+  channel(channel)
+{;}
+
+
+CompositeResponseMatrixMaker::~CompositeResponseMatrixMaker()
+{
+  for(auto maker : makers)
+    maker->composite = nullptr;
+}
+
+
+void
+CompositeResponseMatrixMaker::addResponseMaker(ResponseMatrixMakerInterface& maker)
+{
+  if(maker.composite == this)
+    return;
+
+  if(maker.composite)
+    throw std::invalid_argument("Response matrix maker for " + maker.getVar() +
+                                " is already in another composite");
+  if(maker.getChannel() != channel)
+    throw std::invalid_argument("Can't add " + maker.getChannel() +
+                                " response matrix maker for " +
+                                maker.getVar() + " to " + channel +
+                                " composite");
+
+  maker.composite = this;
+  makers.push_back(&maker);
+}
+
+
+void
+CompositeResponseMatrixMaker::removeResponseMaker(ResponseMatrixMakerInterface& maker)
+{
+  for(auto iMaker = makers.begin(); iMaker != makers.end(); ++iMaker)
+    {
+      if(*iMaker == &maker)
+        {
+          makers.erase(iMaker);
+          maker.composite = nullptr;
+          return;
+        }
+    }
+}
+
+
+void
+CompositeResponseMatrixMaker::setup()
+{
+  Vec<ResponseMatrixMakerInterface*> toMake;
+  for(auto maker : makers)
+    {
+      if(!maker->responsesMade())
+        toMake.push_back(maker);
+    }
+
+  if(toMake.empty())
+    return;
+
+  UPtr<TChain> recoTree(new TChain((channel+"/ntuple").c_str(),
+                                   ("recoChain_composite_" + channel).c_str()));
+  for(const auto& fn : fileNames)
+    recoTree->Add(fn.c_str());
+
+  // Scale and PDF systematics only done for samples that have LHE info (e.g.
+  // not MCFM)
+  const bool hasLHE = bool(recoTree->FindBranch("pdfWeights"));
+  for(auto maker : toMake)
+    maker->bookResponses(hasLHE);
+
+  // Get gen info for everything at once
+  UPtr<TChain> trueTree(new TChain((channel+"Gen/ntuple").c_str(),
+                                   ("trueChain_composite_" + channel).c_str()));
+  for(const auto& fn : fileNames)
+    trueTree->Add(fn.c_str());
+
+  {
+    ::BranchSharer shared(*trueTree);
+    for(auto maker : toMake)
+      {
+        maker->setTrueTree(*trueTree);
+        shared.update();
+      }
+
+    for(size_t row = 0; row < size_t(std::abs(trueTree->GetEntries())); ++row)
+      {
+        trueTree->GetEntry(row);
+        shared.copy();
+
+        for(auto maker : toMake)
+          maker->readTrueEvent();
+      }
+  }
+
+  trueTree.reset(); // gone -- don't use any more
+
+  // Loop through base reco tree once, fill most things for everything
+  {
+    ::BranchSharer shared(*recoTree);
+    for(auto maker : toMake)
+      {
+        maker->setRecoTree(*recoTree, true);
+        shared.update();
+      }
+
+    for(size_t row = 0; row < size_t(std::abs(recoTree->GetEntries())); ++row)
+      {
+        recoTree->GetEntry(row);
+        shared.copy();
+
+        for(auto maker : toMake)
+          maker->fillRecoEvent();
+      }
+  }
+
+  recoTree.reset(); // gone -- don't use any more
+
+  // systematic tree -> (maker, systematic) pairs that need it
+  Map<Str, Vec<std::pair<ResponseMatrixMakerInterface*, Str> > > systTreeUsers;
+  for(auto maker : toMake)
+    {
+      for(const auto& treeInfo : maker->systTreesNeeded(systFileNames))
+        systTreeUsers[treeInfo.second].push_back(std::make_pair(maker,
+                                                                treeInfo.first));
+    }
+
+  // systematics requiring other ntuples, each read once
+  for(const auto& users : systTreeUsers)
+    {
+      UPtr<TChain> t(new TChain((channel+"/ntuple").c_str(),
+                                ("chain_composite_" + channel).c_str()));
+      for(const auto& fn : systFileNames.at(users.first))
+        t->Add(fn.c_str());
+
+      ::BranchSharer shared(*t);
+      for(const auto& user : users.second)
+        {
+          user.first->setRecoTree(*t, false);
+          shared.update();
+        }
+
+      for(size_t row = 0; row < size_t(std::abs(t->GetEntries())); ++row)
+        {
+          t->GetEntry(row);
+          shared.copy();
+
+          for(const auto& user : users.second)
+            user.first->fillSystEvent(user.second);
+        }
+    } // new tree disappears here
+
+  for(auto maker : toMake)
+    maker->finishResponses();
+}
+
+
 typedef SimpleValueResponseMatrixMakerBase<float> FloatResponseMatrixMakerBase;
 typedef BranchValueResponseMatrixMaker<float> FloatBranchResponseMatrixMaker;
 typedef AbsValueResponseMatrixMaker<FloatBranchResponseMatrixMaker> AbsFloatBranchResponseMatrixMaker;
@@ -1744,4 +1918,7 @@ typedef UseSFHists<FullSpectrumFloatResponseMatrixMaker> SFHistFullSpectrumFloat
 #pragma link C++ class SFHistSecondJetAbsFloatResponseMatrixMaker;
 
 #pragma link C++ class FullSpectrumFloatResponseMatrixMaker;
+
+#pragma link C++ class ResponseMatrixMakerInterface;
+#pragma link C++ class CompositeResponseMatrixMaker;
 #endif
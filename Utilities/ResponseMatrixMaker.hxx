@@ -26,8 +26,56 @@ template <typename T>
 using UPtr = typename std::unique_ptr<T>;
 
 
+class CompositeResponseMatrixMaker;
+
+
+// The steps of making responses, independent of the type of value a
+// response matrix maker deals with, so CompositeResponseMatrixMaker can do
+// them for many different makers in the same loops
+class ResponseMatrixMakerInterface
+{
+ public:
+  ResponseMatrixMakerInterface() : composite(nullptr) {;}
+  virtual ~ResponseMatrixMakerInterface();
+
+  virtual const Str& getVar() const = 0;
+  virtual const Str& getChannel() const = 0;
+
+ protected:
+  friend class CompositeResponseMatrixMaker;
+
+  virtual bool responsesMade() const = 0;
+
+  // Make (empty) response histograms for all systematics
+  virtual void bookResponses(bool hasLHEInfo) = 0;
+
+  // Point gen branches to member objects
+  virtual void setTrueTree(TChain& trueTree) = 0;
+  // Store the true value from the current gen tree entry, if it has one
+  virtual void readTrueEvent() = 0;
+
+  // Point reco branches to member objects. LHE weights are only needed from
+  // the nominal tree.
+  virtual void setRecoTree(TChain& t, bool withLHEWeights) = 0;
+  // Fill nominal, weight, and jet systematic responses from the current
+  // nominal reco tree entry
+  virtual void fillRecoEvent() = 0;
+  // Fill one systematic response from the current entry of its own tree
+  virtual void fillSystEvent(const Str& syst) = 0;
+
+  // Systematic name -> systematic tree (key in syst file map) needed for it
+  virtual Map<Str,Str> systTreesNeeded(const UMap<Str, Vec<Str> >& systFiles) const = 0;
+
+  // Throw away the true values when everything is filled
+  virtual void finishResponses() = 0;
+
+  // If this is set, the composite fills the responses instead of this object
+  CompositeResponseMatrixMaker* composite;
+};
+
+
 template <typename T>
-class ResponseMatrixMakerBase
+class ResponseMatrixMakerBase : public ResponseMatrixMakerInterface
 {
  public:
   ResponseMatrixMakerBase(const Str& channel, const Str& varName,
@@ -51,7 +99,8 @@ class ResponseMatrixMakerBase
 
   // Get the response histogram for a particular systematic (or the central
   // value with an empty string)
-  // The first time this is called, setup() is called
+  // The first time this is called, setup() is called (or the composite's
+  // setup(), if this has been added to one)
   const TH2D& operator()(const Str& syst="") {return getResponse(syst);}
   const TH2D& getResponse(const Str& syst="");
   // For PDF errors, get the 100 copies of the response matrix
@@ -76,10 +125,13 @@ class ResponseMatrixMakerBase
  protected:
   typedef T ValType;
 
-  // Event number -> value(s)
-  virtual UPtr<UMap<size_t, T> > getTrueValues(TChain& trueTree,
-                                               const Vec<Str>& objects,
-                                               const Str& syst = "") const = 0;
+  // Point gen branches to correct addresses (child member objects). Event
+  // number and Z masses are done by this class.
+  virtual void setTrueBranches(TChain& trueTree, const Vec<Str>& objects) = 0;
+
+  // Use these branches to get the true value(s) for the current gen event.
+  // Return false if the event has no true value (e.g. too few jets)
+  virtual bool getTrueValue(T& val) const = 0;
 
   // Point branches to correct addresses (child member objects)
   virtual void setRecoBranches(TChain& t, const Vec<Str>& objects) = 0;
@@ -117,6 +169,17 @@ class ResponseMatrixMakerBase
   // Vec<float> lPt;
   // Vec<float> lEta;
 
+  // Steps of setup(), also used by CompositeResponseMatrixMaker
+  bool responsesMade() const {return responses.size();}
+  void bookResponses(bool hasLHEInfo);
+  void setTrueTree(TChain& trueTree);
+  void readTrueEvent();
+  void setRecoTree(TChain& t, bool withLHEWeights);
+  void fillRecoEvent();
+  void fillSystEvent(const Str& syst);
+  Map<Str,Str> systTreesNeeded(const UMap<Str, Vec<Str> >& systFiles) const;
+  void finishResponses() {trueVals.reset();}
+
  private:
   // Set up branches from this class (as opposed to subclasses)
   void setCommonBranches(TChain& t, const Vec<Str>& objects);
@@ -128,13 +191,32 @@ class ResponseMatrixMakerBase
   const Str varName;
   const Str channel;
 
+  Vec<Str> objects;
+  bool hasE;
+  bool hasMu;
+  bool isJetVar;
+  bool hasLHE;
+  bool doPUWt;
+  bool doPUWtUp;
+  bool doPUWtDn;
+
+  UPtr<UMap<size_t, T> > trueVals;
+  unsigned long long trueEvt;
+  float trueMZ1Value;
+  float trueMZ2Value;
+  float* trueMZ1;
+  float* trueMZ2;
+
   Vec<float> lSF;
   Vec<float> lSFErr;
   float truePU;
   unsigned long long evt;
   float genWeight;
+  // more pointer nonsense for ROOT
   Vec<float> scaleWeights;
   Vec<float> pdfAndAlphaSWeights;
+  Vec<float>* scaleWtPtr;
+  Vec<float>* pdfWtPtr;
   UMap<Str, TH1D> puWeightHists;
   UMap<Str, UMap<Str, TH2F> > leptonSFHists;
 
@@ -185,9 +267,8 @@ class BranchValueResponseMatrixMaker : public SimpleValueResponseMatrixMakerBase
  protected:
   typedef typename SimpleValueResponseMatrixMakerBase<T>::ValType ValType;
 
-  virtual UPtr<UMap<size_t, T> > getTrueValues(TChain& trueTree,
-                                               const Vec<Str>& objects,
-                                               const Str& syst = "") const;
+  virtual void setTrueBranches(TChain& trueTree, const Vec<Str>& objects);
+  virtual bool getTrueValue(T& val) const;
 
   // Point branches to correct addresses (child member objects)
   virtual void setRecoBranches(TChain& t, const Vec<Str>& objects);
@@ -201,6 +282,7 @@ class BranchValueResponseMatrixMaker : public SimpleValueResponseMatrixMakerBase
 
  private:
   T value;
+  T trueValue;
 };
 
 
@@ -219,9 +301,7 @@ class AbsValueResponseMatrixMaker : public R
  protected:
   typedef typename R::ValType ValType;
 
-  virtual UPtr<UMap<size_t, T> > getTrueValues(TChain& trueTree,
-                                               const Vec<Str>& objects,
-                                               const Str& syst = "") const;
+  virtual bool getTrueValue(T& val) const;
 
   virtual T getEventResponse(const Str& option = "") const;
 
@@ -265,9 +345,10 @@ class DijetBranchResponseMatrixMaker : public JetBranchResponseMatrixMakerBase<f
  protected:
   typedef JetBranchResponseMatrixMakerBase<float>::ValType ValType;
 
-  virtual UPtr<UMap<size_t, float> > getTrueValues(TChain& trueTree,
-                                                   const Vec<Str>& objects,
-                                                   const Str& syst = "") const;
+  // gets true nJets as well as the value
+  virtual void setTrueBranches(TChain& trueTree, const Vec<Str>& objects);
+  // requires true nJets >= 2
+  virtual bool getTrueValue(float& val) const;
 
   // gets nJets branch (and nJets systematic branches) as well as the
   // value branch
@@ -282,6 +363,7 @@ class DijetBranchResponseMatrixMaker : public JetBranchResponseMatrixMakerBase<f
   unsigned int nJets_jesDn;
   unsigned int nJets_jerUp;
   unsigned int nJets_jerDn;
+  unsigned int trueNJets;
 };
 
 
@@ -296,9 +378,8 @@ class SelectedZResponseMatrixMakerBase : public SimpleValueResponseMatrixMakerBa
  protected:
   typedef typename SimpleValueResponseMatrixMakerBase<float>::ValType ValType;
 
-  virtual UPtr<UMap<size_t, float> > getTrueValues(TChain& trueTree,
-                                                   const Vec<Str>& objects,
-                                                   const Str& syst = "") const;
+  virtual void setTrueBranches(TChain& trueTree, const Vec<Str>& objects);
+  virtual bool getTrueValue(float& val) const;
 
   // Point branches to correct addresses (child member objects)
   void setRecoBranches(TChain& t, const Vec<Str>& objects);
@@ -331,6 +412,14 @@ class SelectedZResponseMatrixMakerBase : public SimpleValueResponseMatrixMakerBa
   const Str z1RespVarName;
   const Str z2RespVarName;
 
+  // same for gen
+  float z1CompTrue;
+  float z2CompTrue;
+  float z1RespTrueValue;
+  float z2RespTrueValue;
+  float* z1RespTruePtr;
+  float* z2RespTruePtr;
+
   const bool compIsResp;
 };
 
@@ -429,9 +518,8 @@ class ZZCompositeResponseMatrixMakerBase : public SimpleValueResponseMatrixMaker
  protected:
   typedef typename SimpleValueResponseMatrixMakerBase<float>::ValType ValType;
 
-  virtual UPtr<UMap<size_t, float> > getTrueValues(TChain& trueTree,
-                                                   const Vec<Str>& objects,
-                                                   const Str& syst = "") const;
+  virtual void setTrueBranches(TChain& trueTree, const Vec<Str>& objects);
+  virtual bool getTrueValue(float& val) const;
 
   virtual void setRecoBranches(TChain& t, const Vec<Str>& objects);
 
@@ -448,6 +536,8 @@ class ZZCompositeResponseMatrixMakerBase : public SimpleValueResponseMatrixMaker
   const Str z2VarName;
   float z1InputVar;
   float z2InputVar;
+  float z1VarTrue;
+  float z2VarTrue;
 };
 
 
@@ -476,9 +566,8 @@ class ZZDeltaRResponseMatrixMaker : public SimpleValueResponseMatrixMakerBase<fl
  protected:
   typedef typename SimpleValueResponseMatrixMakerBase<float>::ValType ValType;
 
-  virtual UPtr<UMap<size_t, float> > getTrueValues(TChain& trueTree,
-                                                   const Vec<Str>& objects,
-                                                   const Str& syst = "") const;
+  virtual void setTrueBranches(TChain& trueTree, const Vec<Str>& objects);
+  virtual bool getTrueValue(float& val) const;
 
   virtual void setRecoBranches(TChain& t, const Vec<Str>& objects);
 
@@ -500,6 +589,10 @@ class ZZDeltaRResponseMatrixMaker : public SimpleValueResponseMatrixMakerBase<fl
   float z2Eta;
   float z1Phi;
   float z2Phi;
+  float z1EtaTrue;
+  float z2EtaTrue;
+  float z1PhiTrue;
+  float z2PhiTrue;
 };
 
 
@@ -545,9 +638,8 @@ class MultiBranchResponseMatrixMakerBase : public VectorValueResponseMatrixMaker
  protected:
   typedef typename VectorValueResponseMatrixMakerBase<T>::ValType ValType;
 
-  virtual UPtr<UMap<size_t, Vec<T> > > getTrueValues(TChain& trueTree,
-                                                     const Vec<Str>& objects,
-                                                     const Str& syst = "") const;
+  virtual void setTrueBranches(TChain& trueTree, const Vec<Str>& objects);
+  virtual bool getTrueValue(Vec<T>& vals) const;
 
   virtual void setRecoBranches(TChain& t, const Vec<Str>& objects);
 
@@ -562,6 +654,7 @@ class MultiBranchResponseMatrixMakerBase : public VectorValueResponseMatrixMaker
 
  private:
   Vec<T> values;
+  Vec<T> trueValues;
 };
 
 
@@ -603,9 +696,8 @@ class LeptonMaxBranchResponseMatrixMaker : public SimpleValueResponseMatrixMaker
  protected:
   typedef SimpleValueResponseMatrixMakerBase<float>::ValType ValType;
 
-  virtual UPtr<UMap<size_t, float> > getTrueValues(TChain& trueTree,
-                                                   const Vec<Str>& objects,
-                                                   const Str& syst = "") const;
+  virtual void setTrueBranches(TChain& trueTree, const Vec<Str>& objects);
+  virtual bool getTrueValue(float& val) const;
 
   virtual void setRecoBranches(TChain& t, const Vec<Str>& objects);
 
@@ -618,6 +710,7 @@ class LeptonMaxBranchResponseMatrixMaker : public SimpleValueResponseMatrixMaker
  private:
   const Vec<Str> varNames;
   Vec<float> values;
+  Vec<float> trueValues;
 };
 
 
@@ -632,9 +725,8 @@ class NthJetResponseMatrixMaker : public SimpleValueResponseMatrixMakerBase<T>
  protected:
   typedef typename SimpleValueResponseMatrixMakerBase<T>::ValType ValType;
 
-  virtual UPtr<UMap<size_t, T> > getTrueValues(TChain& trueTree,
-                                               const Vec<Str>& objects,
-                                               const Str& syst = "") const;
+  virtual void setTrueBranches(TChain& trueTree, const Vec<Str>& objects);
+  virtual bool getTrueValue(T& val) const;
 
   virtual void setRecoBranches(TChain& t, const Vec<Str>& objects);
 
@@ -650,6 +742,8 @@ class NthJetResponseMatrixMaker : public SimpleValueResponseMatrixMakerBase<T>
   Vec<T> allJetValues_jesDn_object;
   Vec<T> allJetValues_jerUp_object;
   Vec<T> allJetValues_jerDn_object;
+  Vec<T>* allJetsTrue;
+  Vec<T> allJetsTrue_object;
 };
 
 
@@ -725,3 +819,44 @@ class RelaxGenZCuts : public R
   // no copy constructor
   RelaxGenZCuts(const RelaxGenZCuts<R>&);
 };
+
+
+// Runs any number of response matrix makers for the same channel and files
+// together, reading each gen, reco, and systematic tree once for all of them
+// instead of once per maker. Makers are added by reference and are still
+// owned by the caller; their responses are gotten from them as usual, and the
+// first time any of them is asked, all of them are made.
+class CompositeResponseMatrixMaker
+{
+ public:
+  CompositeResponseMatrixMaker(const Str& channel);
+  virtual ~CompositeResponseMatrixMaker();
+
+  // Files to run over, for all the makers
+  void registerFile(const Str& f) {fileNames.push_back(f);}
+  void registerFile(const Str& f, const Str& syst)
+  {
+    if(systFileNames.find(syst) == systFileNames.end())
+      systFileNames[syst] = Vec<Str>();
+    systFileNames[syst].push_back(f);
+  }
+
+  // Each maker can be in only one composite
+  void addResponseMaker(ResponseMatrixMakerInterface& maker);
+  void removeResponseMaker(ResponseMatrixMakerInterface& maker);
+  size_t nResponseMakers() const {return makers.size();}
+
+  const Str& getChannel() const {return channel;}
+
+  // Make responses for all makers that don't have them yet
+  void setup();
+
+ private:
+  // no copy constructor
+  CompositeResponseMatrixMaker(const CompositeResponseMatrixMaker&);
+
+  const Str channel;
+  Vec<Str> fileNames;
+  UMap<Str, Vec<Str> > systFileNames;
+  Vec<ResponseMatrixMakerInterface*> makers;
+};
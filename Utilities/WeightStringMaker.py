@@ -5,6 +5,27 @@ WeightStringMaker.py
 Some utilities to make strings to do event weighting
 from histograms, JSONs, or C++/ROOT macros.
 
+In batch mode (WeightStringMaker.batchMode = True), the C++ functions
+aren't compiled one by one as they're made. They're all compiled together
+(automatically before NtupleSample draws anything, or with
+WeightStringMaker.compileAll()) into a library saved in
+$zzt/Analysis/savedResults/weightFunctions, which is just loaded next time
+the same functions are made from the same histograms.
+
+Functions are named for the histogram they use (its binning and contents)
+and how it's used, so the same weight string is made for the same inputs in
+every process, and a weight string made in one process can be used in
+another (forked processes have the functions already; others can get them
+with WeightStringMaker.exportState() and importState()). Everything is
+protected by a lock, so weights can be made from several threads, and
+compiling the library is protected by a file lock, so processes that need
+the same one at the same time wait for the first to compile it.
+
+Every function made from a histogram also gets a HistLookup with the same
+name, so strings using it can be evaluated with numpy (see
+Utilities.drawExpressions) and the lookups can be used directly on arrays
+(getWeightLookup()).
+
 Author: Nate Woods, U. Wisconsin
 
 '''
@@ -16,38 +37,88 @@ logging.basicConfig(level=logging.WARNING)
 rlog["/rootpy.compiled"].setLevel(rlog.WARNING)
 
 import rootpy.compiled as _comp
+import rootpy.ROOT as _ROOT
 from rootpy.ROOT import gROOT as _gROOT
+from rootpy.ROOT import gSystem as _gSystem
 try:
     gROOT = _gROOT._gROOT
 except AttributeError:
     gROOT = _gROOT
 from rootpy.plotting import Hist as _Hist, Hist2D as _Hist2D
 
+from Utilities.helpers import cacheDirectory as _cacheDirectory
+from Utilities.helpers import histHash as _histHash
+from Utilities.HistLookup import HistLookup as _HistLookup
+from Utilities.drawExpressions import registerFunction as _registerFunction
+
+from fcntl import flock as _flock
+from fcntl import LOCK_EX as _LOCK_EX
+from fcntl import LOCK_UN as _LOCK_UN
+from hashlib import sha1 as _sha1
+from threading import RLock as _RLock
+from os import rename as _rename
+from os import getpid as _getpid
+from os.path import join as _join
+from os.path import isfile as _isfile
+
+
+
+# protects everything shared between WeightStringMakers
+_lock = _RLock()
 
 
 class _WeightStringSingleton(type):
     '''
-    Have to do some kind of singleton thing to avoid duplicate functions.
-    Will need to change if ever used multithreaded.
+    One WeightStringMaker per function name prefix.
     '''
     _instances = {}
     def __call__(cls, fName, *args, **kwargs):
-        try:
-            return cls._instances[fName]
-        except KeyError:
-            cls._instances[fName] = super(_WeightStringSingleton, cls).__call__(fName, *args, **kwargs)
-            return cls._instances[fName]
+        with _lock:
+            try:
+                return cls._instances[fName]
+            except KeyError:
+                cls._instances[fName] = super(_WeightStringSingleton, cls).__call__(fName, *args, **kwargs)
+                return cls._instances[fName]
+
+
+class _LazyWeightFunction(object):
+    '''
+    Stands in for a weight function that hasn't been compiled yet in batch
+    mode; compiles everything the first time it's called.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self._f = None
+
+    def __call__(self, *args):
+        if self._f is None:
+            WeightStringMaker.compileAll()
+            self._f = getattr(_ROOT, self.name)
+        return self._f(*args)
+
 
 class WeightStringMaker(object):
     __metaclass__ = _WeightStringSingleton
 
-    _counter = 0
-    _hists = []
-    _functions = []
+    # If True, functions are compiled together when needed instead of one
+    # at a time, and the library is saved for next time
+    batchMode = False
+
+    # function name -> (histogram, function object, HistLookup)
+    _registry = {}
+    # function name -> (prefix, histogram, number of variables, getError),
+    # to make the same function in another process
+    _sources = {}
+
+    # code waiting to be compiled in batch mode
+    _pending = []
 
     def __init__(self, fName='weightFun'):
         self.fName = fName
 
+        # names of the functions asked for from this maker, in order
+        self._made = []
+
         self.codeBase = '''
             #include "TH1.h"
             #include "TROOT.h"
@@ -111,37 +182,140 @@ class WeightStringMaker(object):
         the bin that would be filled by variables.
         Optional bool argument getError gets the uncertainty of the bin
         instead of the content.
+        If optional bool argument withFunction is True, the function object
+        is returned too, as (string, function), so it's the one for this
+        string even if other threads are making functions at the same time.
+        '''
+        getError = bool(kwargs.pop('getError', False))
+        withFunction = bool(kwargs.pop('withFunction', False))
+
+        with _lock:
+            iName = self._register(h, len(variables), getError)
+            self._made.append(iName)
+            function = self._registry[iName][1]
+
+        wtStr = '{0}({1})'.format(iName, ', '.join(variables))
+        if withFunction:
+            return wtStr, function
+        return wtStr
+
+    def _register(self, h, nVariables, getError):
+        '''
+        Make the function for histogram h (unless it was made already) and
+        return its name.
         '''
-        # make a copy so we can change directory, save it in global scope
-        hCopy = h.clone()
+        contentOrErr = 'Error' if getError else 'Content'
+
+        hHash = _histHash(h)
+        suffix = '_' + _sha1('{};{};{}'.format(hHash, nVariables,
+                                               contentOrErr)).hexdigest()[:16]
+        iName = self.fName + suffix
+
+        if iName in self._registry:
+            return iName
+
+        # make a copy so we can change directory, save it in global scope.
+        # Name it for its contents so the generated code (and the library
+        # saved in batch mode) is the same every time
+        hCopy = h.clone('_wsm_{}_{}'.format(self.fName, hHash[:20]))
         hCopy.SetDirectory(gROOT)
-        self._hists.append(hCopy)
 
-        iName = "{0}{1}".format(self.fName, self._counter)
+        code = self.codeBase.format(suffix,
+                                    ', '.join('double x%d'%i for i in range(nVariables)),
+                                    hCopy.GetName(),
+                                    ', '.join("x%d"%i for i in range(nVariables)),
+                                    nVariables,
+                                    contentOrError=contentOrErr)
+
+        lookup = _HistLookup(hCopy, getError)
+        _registerFunction(iName, lookup)
+
+        if self.batchMode:
+            self._pending.append(code)
+            function = _LazyWeightFunction(iName)
+        else:
+            _comp.register_code(code, [iName,])
+
+            # Also forces system to compile code now
+            function = getattr(_comp, iName)
+
+        self._registry[iName] = (hCopy, function, lookup)
+        self._sources[iName] = (self.fName, hCopy, nVariables, getError)
+
+        return iName
+
+    @classmethod
+    def exportState(cls):
+        '''
+        Everything needed to make all the weight functions made so far in
+        another process (with importState()). Can be pickled.
+        '''
+        with _lock:
+            return [cls._sources[name] for name in sorted(cls._sources)]
+
+    @classmethod
+    def importState(cls, state):
+        '''
+        Make the weight functions from exportState() in another process, so
+        weight strings made there work here.
+        '''
+        with _lock:
+            for fName, h, nVariables, getError in state:
+                WeightStringMaker(fName)._register(h, nVariables, getError)
+
+    @classmethod
+    def compileAll(cls):
+        '''
+        Compile all functions made in batch mode that haven't been compiled
+        yet, as one library. If the same code was compiled before, the saved
+        library is loaded instead.
+        '''
+        with _lock:
+            cls._compilePending()
 
-        contentOrErr = 'Content'
-        if kwargs.pop('getError', False):
-            contentOrErr = 'Error'
+    @classmethod
+    def _compilePending(cls):
+        if not cls._pending:
+            return
 
-        _comp.register_code(
-            self.codeBase.format(self._counter,
-                                 ', '.join('double x%d'%i for i in range(len(variables))),
-                                 hCopy.GetName(),
-                                 ', '.join("x%d"%i for i in range(len(variables))),
-                                 len(variables),
-                                 contentOrError=contentOrErr),
-            [iName,])
-        out = '{0}({1})'.format(iName, ', '.join(variables))
+        code = '\n'.join(cls._pending)
+        codeHash = _sha1(code).hexdigest()[:16]
+        srcName = _join(_cacheDirectory('weightFunctions'),
+                        'weightFunctions_{}.C'.format(codeHash))
 
-        # Save function. Also forces system to compile code now
-        self._functions.append(getattr(_comp, iName))
+        # another process compiling the same library at the same time would
+        # write over the one we're loading
+        with open(srcName[:-2] + '.lock', 'w') as lockFile:
+            _flock(lockFile, _LOCK_EX)
+            try:
+                # ACLiC only recompiles if the source is newer than the
+                # library, so leave it alone if it's there
+                if not _isfile(srcName):
+                    tmpName = '{}.tmp{}'.format(srcName, _getpid())
+                    with open(tmpName, 'w') as f:
+                        f.write(code)
+                    _rename(tmpName, srcName)
 
-        self._counter += 1
+                if not _gSystem.CompileMacro(srcName, 'k'):
+                    raise RuntimeError("Failed to compile weight functions "
+                                       "in {}".format(srcName))
+            finally:
+                _flock(lockFile, _LOCK_UN)
 
-        return out
+        cls._pending[:] = []
 
     def getWeightFunction(self, i):
         '''
-        Return a function object for the ith weight function made.
+        Return a function object for the ith weight function made by this
+        maker. In batch mode, this is compiled the first time it's called.
+        '''
+        with _lock:
+            return self._registry[self._made[i]][1]
+
+    def getWeightLookup(self, i):
+        '''
+        Return the HistLookup (numpy version of the weight function) for the
+        ith weight function made by this maker.
         '''
-        return self._functions[i]
+        with _lock:
+            return self._registry[self._made[i]][2]
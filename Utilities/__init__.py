@@ -1,2 +1,3 @@
 from helpers import *
 from WeightStringMaker import WeightStringMaker
+from HistLookup import HistLookup
@@ -0,0 +1,473 @@
+'''
+
+checkResponseMatrixMakers.py
+
+Check that response matrix makers filled together by a
+CompositeResponseMatrixMaker give exactly the same responses as the same
+makers set up on their own (through their own setup()).
+
+Small fake ntuples with all the branches the makers use are made for each
+channel, once in a single file and once split over several files, so the
+chains cross file boundaries. Every response matrix maker class (plain and
+with scale factor histograms) is then made three ways:
+    - on its own, reading the single file (the reference)
+    - on its own, reading the split files
+    - in one composite with all the others, reading the split files
+and the nominal, every systematic, PDF and scale histograms from the last
+two are compared bin by bin to the reference.
+
+Exits with status 1 if anything differs by more than the tolerance.
+
+    python Utilities/checkResponseMatrixMakers.py [--channels eemm] [--nFiles 3]
+
+Nate Woods, U. Wisconsin
+
+'''
+
+import logging
+from rootpy import log as rlog; rlog = rlog["/checkResponseMatrixMakers"]
+# don't show most silly ROOT messages
+logging.basicConfig(level=logging.WARNING)
+
+from rootpy import ROOT as _ROOT
+from rootpy.plotting import Hist as _Hist
+from rootpy.plotting import Hist2D as _Hist2D
+from rootpy.stl import vector as _Vec
+
+from Utilities.responseMatrixLibrary import responseMatrixMakerClass as _responseMatrixMakerClass
+
+from array import array as _array
+from os.path import join as _join
+from shutil import rmtree as _rmtree
+from tempfile import mkdtemp as _mkdtemp
+
+import numpy as _np
+
+_VFloat = _Vec('float')
+
+
+_objects = {
+    'eeee' : ['e1','e2','e3','e4'],
+    'eemm' : ['e1','e2','m1','m2'],
+    'mmmm' : ['m1','m2','m3','m4'],
+    }
+
+_systs = ['eScaleUp', 'eScaleDn', 'mClosureUp']
+
+# leaf types of branches that aren't floats
+_leafTypes = {
+    'evt' : 'l',
+    'nJets' : 'i',
+    'nJets_jesUp' : 'i',
+    'nJets_jesDown' : 'i',
+    'nJets_jerUp' : 'i',
+    'nJets_jerDown' : 'i',
+    }
+_typeCodes = {'F' : 'f', 'i' : 'I', 'l' : 'L', 'O' : 'B'}
+
+_jetSysts = ['', '_jesUp', '_jesDown', '_jerUp', '_jerDown']
+
+# reco events with no gen event get their event number shifted by this
+_fakeEvtOffset = 1000000000
+
+
+def _linBins(n, lo, hi):
+    return [lo + i * (hi - lo) / float(n) for i in xrange(n+1)]
+
+
+def _makerSpecs(channel):
+    '''
+    (class name, variable, binning) for every response matrix maker class
+    used in the analysis, plus some extras.
+    '''
+    z1 = '_'.join(_objects[channel][:2])
+    z2 = '_'.join(_objects[channel][2:])
+
+    specs = [
+        ('FloatBranchResponseMatrixMaker', 'Mass', _linBins(10, 100., 800.)),
+        ('FullSpectrumFloatResponseMatrixMaker', 'Mass', _linBins(10, 100., 800.)),
+        ('FloatBranchResponseMatrixMaker', 'Pt', _linBins(8, 0., 300.)),
+        ('AbsFloatBranchResponseMatrixMaker', 'Eta', _linBins(6, 0., 6.)),
+        ('UIntBranchResponseMatrixMaker', 'nJets', _linBins(5, 0., 5.)),
+        ('JetUIntBranchResponseMatrixMaker', 'nJets', _linBins(5, 0., 5.)),
+        ('DijetBranchResponseMatrixMaker', 'mjj', _linBins(8, 0., 1000.)),
+        ('AbsDijetBranchResponseMatrixMaker', 'deltaEtajj', _linBins(6, 0., 6.)),
+        ('FloatBranchResponseMatrixMaker', z1+'_Mass', _linBins(6, 60., 120.)),
+        ('FloatBranchResponseMatrixMaker', z2+'_Pt', _linBins(6, 0., 300.)),
+        ('Z1ByMassResponseMatrixMaker', 'Mass', _linBins(6, 60., 120.)),
+        ('Z2ByMassResponseMatrixMaker', 'Mass', _linBins(6, 60., 120.)),
+        ('Z1ByMassResponseMatrixMaker', 'Pt', _linBins(6, 0., 300.)),
+        ('Z2ByMassResponseMatrixMaker', 'Pt', _linBins(6, 0., 300.)),
+        ('Z1ByPtResponseMatrixMaker', 'Pt', _linBins(6, 0., 300.)),
+        ('Z2ByPtResponseMatrixMaker', 'Pt', _linBins(6, 0., 300.)),
+        ('ZZAbsDeltaPhiResponseMatrixMaker', 'deltaPhiZZ', _linBins(6, 0., 3.1416)),
+        ('ZZDeltaRResponseMatrixMaker', 'deltaRZZ', _linBins(6, 0., 6.)),
+        ('AllLeptonBranchResponseMatrixMaker', 'Pt', _linBins(8, 0., 200.)),
+        ('LeptonMaxBranchResponseMatrixMaker', 'Pt', _linBins(8, 0., 200.)),
+        ('BothZsBranchResponseMatrixMaker', 'Pt', _linBins(6, 0., 300.)),
+        ('FirstJetFloatResponseMatrixMaker', 'jetPt', _linBins(6, 30., 500.)),
+        ('SecondJetFloatResponseMatrixMaker', 'jetPt', _linBins(6, 30., 500.)),
+        ('FirstJetAbsFloatResponseMatrixMaker', 'jetEta', _linBins(5, 0., 4.7)),
+        ('SecondJetAbsFloatResponseMatrixMaker', 'jetEta', _linBins(5, 0., 4.7)),
+        ]
+
+    return specs + [('SFHist'+c, v, b) for c, v, b in specs]
+
+
+def _makeEvents(channel, nEvents, rand):
+    '''
+    Fake gen and reco events for channel. Returns (gen rows, reco rows,
+    {systematic : reco rows}), each row a dict of branch values. Some reco
+    events have no gen event, and the reco events in the systematic trees
+    are shifted and have a few dropped.
+    '''
+    objects = _objects[channel]
+    zs = ['_'.join(objects[:2]), '_'.join(objects[2:])]
+
+    def physics(row, smear):
+        for z in zs:
+            row[z+'_Mass'] = float(rand.uniform(50., 130.) * smear)
+            row[z+'_Pt'] = float(rand.exponential(60.) * smear)
+            row[z+'_Eta'] = float(rand.uniform(-4., 4.))
+            row[z+'_Phi'] = float(rand.uniform(-3.1416, 3.1416))
+        for obj in objects:
+            row[obj+'Pt'] = float(rand.uniform(5., 200.) * smear)
+        row['Mass'] = float(rand.uniform(100., 800.) * smear)
+        row['Pt'] = float(rand.exponential(80.) * smear)
+        row['Eta'] = float(rand.uniform(-6., 6.))
+
+    def jets(row, suffix):
+        nJets = int(rand.randint(0, 5))
+        row['nJets'+suffix] = nJets
+        row['jetPt'+suffix] = sorted((float(pt) for pt in
+                                      30. + rand.exponential(80., nJets)),
+                                     reverse=True)
+        row['jetEta'+suffix] = [float(eta) for eta in
+                                rand.uniform(-4.7, 4.7, nJets)]
+        row['mjj'+suffix] = float(rand.uniform(0., 1000.)) if nJets >= 2 else -999.
+        row['deltaEtajj'+suffix] = float(rand.uniform(-6., 6.)) if nJets >= 2 else -999.
+
+    def reco(evt, smear):
+        row = {'evt' : evt}
+        physics(row, smear)
+        for suffix in _jetSysts:
+            jets(row, suffix)
+        for obj in objects:
+            row[obj+'Eta'] = float(rand.uniform(-2.5, 2.5))
+            if obj.startswith('e'):
+                row[obj+'SCEta'] = float(rand.uniform(-2.5, 2.5))
+                row[obj+'IsGap'] = int(rand.uniform() < 0.2)
+            row[obj+'EffScaleFactor'] = float(rand.uniform(0.9, 1.1))
+            row[obj+'EffScaleFactorError'] = float(rand.uniform(0.01, 0.05))
+        row['nTruePU'] = float(rand.uniform(0., 60.))
+        row['genWeight'] = float(rand.choice([-1., 1.]) * rand.uniform(0.5, 1.5))
+        row['scaleWeights'] = [float(w) for w in rand.uniform(0.8, 1.2, 9)]
+        row['pdfWeights'] = [float(w) for w in rand.uniform(0.9, 1.1, 102)]
+        return row
+
+    gen = []
+    recoRows = []
+    systRows = {s : [] for s in _systs}
+    for i in xrange(nEvents):
+        evt = 1000 + i
+        row = {'evt' : evt}
+        physics(row, 1.)
+        jets(row, '')
+        gen.append(row)
+
+        # some events aren't reconstructed, and some reconstructed events
+        # have no gen event
+        if rand.uniform() < 0.85:
+            recoRows.append(reco(evt, rand.uniform(0.9, 1.1)))
+        if rand.uniform() < 0.05:
+            recoRows.append(reco(_fakeEvtOffset + evt, 1.))
+
+        for syst in _systs:
+            if rand.uniform() < 0.8:
+                systRows[syst].append(reco(evt, rand.uniform(0.9, 1.1)))
+
+    return gen, recoRows, systRows
+
+
+def _fillTree(t, rows):
+    '''
+    Fill t with rows. Returns the branch buffers, which have to stay around
+    until t is written.
+    '''
+    buffers = {}
+    for name, val in sorted(rows[0].iteritems()):
+        if isinstance(val, list):
+            buffers[name] = _VFloat()
+            t.Branch(name, buffers[name])
+        else:
+            leafType = _leafTypes.get(name, 'O' if name.endswith('IsGap') else 'F')
+            buffers[name] = _array(_typeCodes[leafType], [0])
+            t.Branch(name, buffers[name], '{}/{}'.format(name, leafType))
+
+    for row in rows:
+        for name, val in row.iteritems():
+            buf = buffers[name]
+            if isinstance(val, list):
+                buf.clear()
+                for v in val:
+                    buf.push_back(v)
+            else:
+                buf[0] = val
+        t.Fill()
+
+    return buffers
+
+
+def _writeNtuple(fName, channel, gen, reco):
+    f = _ROOT.TFile.Open(fName, 'recreate')
+    for dirName, rows in [(channel+'Gen', gen), (channel, reco)]:
+        if not rows:
+            continue
+        f.mkdir(dirName).cd()
+        t = _ROOT.TTree('ntuple', '')
+        # the file deletes it
+        _ROOT.SetOwnership(t, False)
+        buffers = _fillTree(t, rows)
+        t.Write()
+    f.Close()
+
+
+def _writeFiles(outDir, channel, nEvents, nFiles, rand):
+    '''
+    Write the fake ntuples for channel, once in a single file and once split
+    over nFiles files (in unequal parts, keeping the event order). Returns
+    ({'' : single file list, syst : single file list, ...},
+     {'' : split file list, syst : split file list, ...}).
+    '''
+    gen, reco, systRows = _makeEvents(channel, nEvents, rand)
+
+    cuts = [int(nEvents * (i + rand.uniform(-0.3, 0.3)) / nFiles)
+            for i in xrange(1, nFiles)]
+    evtRanges = zip([0] + cuts, cuts + [nEvents])
+
+    def inRange(rows, lo, hi):
+        return [r for r in rows
+                if 1000 + lo <= r['evt'] % _fakeEvtOffset < 1000 + hi]
+
+    single = {}
+    split = {}
+    for syst, recoRows in [('', reco)] + sorted(systRows.iteritems()):
+        genRows = gen if not syst else []
+        name = channel + (('_'+syst) if syst else '')
+
+        fName = _join(outDir, name+'.root')
+        _writeNtuple(fName, channel, genRows, recoRows)
+        single[syst] = [fName]
+
+        split[syst] = []
+        for i, (lo, hi) in enumerate(evtRanges):
+            fName = _join(outDir, '{}_{}.root'.format(name, i))
+            _writeNtuple(fName, channel, inRange(genRows, lo, hi),
+                         inRange(recoRows, lo, hi))
+            split[syst].append(fName)
+
+    return single, split
+
+
+def _makeHists(rand):
+    hists = {}
+    for upOrDown, shift in [('', 1.), ('up', 1.1), ('dn', 0.9)]:
+        h = _Hist(60, 0., 60., type='D')
+        for b in xrange(1, 61):
+            h.SetBinContent(b, shift * rand.uniform(0.5, 1.5))
+        hists['pu_'+upOrDown] = h
+
+    for role in ['eSel', 'eSelGap', 'eReco', 'm', 'mErr']:
+        h = _Hist2D(5, -2.5, 2.5, 6, 0., 300., type='F')
+        for bx in xrange(1, 6):
+            for by in xrange(1, 7):
+                h.SetBinContent(bx, by, rand.uniform(0.9, 1.1) if role != 'mErr' else rand.uniform(0.01, 0.05))
+                h.SetBinError(bx, by, rand.uniform(0.01, 0.05))
+        hists[role] = h
+
+    return hists
+
+
+def _makeMaker(className, channel, varName, binning, files, hists):
+    C = _responseMatrixMakerClass(className)
+
+    vBinning = _VFloat()
+    for b in binning:
+        vBinning.push_back(b)
+
+    maker = C(channel, varName, vBinning)
+
+    for syst, fNames in files.iteritems():
+        for fName in fNames:
+            if syst:
+                maker.registerFile(fName, syst)
+            else:
+                maker.registerFile(fName)
+
+    maker.registerPUWeights(hists['pu_'])
+    maker.registerPUWeights(hists['pu_up'], 'up')
+    maker.registerPUWeights(hists['pu_dn'], 'dn')
+    maker.setConstantScale(0.7)
+
+    if className.startswith('SFHist'):
+        maker.registerElectronSelectionSFHist(hists['eSel'])
+        maker.registerElectronSelectionGapSFHist(hists['eSelGap'])
+        maker.registerElectronRecoSFHist(hists['eReco'])
+        maker.registerMuonSFHist(hists['m'])
+        maker.registerMuonSFErrorHist(hists['mErr'])
+
+    return maker
+
+
+def _responses(maker):
+    '''
+    All responses from maker, named as in the stored response files.
+    '''
+    out = {'nominal' : maker.getResponse('')}
+    for syst in maker.knownSystematics():
+        out['syst_'+syst] = maker.getResponse(syst)
+    out['pdf'] = maker.getPDFResponses()
+    for i, h in enumerate(maker.getScaleResponses()):
+        out['scale_{}'.format(i)] = h
+
+    return out
+
+
+def _contents(h):
+    '''
+    Contents and errors of every bin (including under/overflow) of h.
+    '''
+    nCells = h.GetNcells()
+    return (_np.array([h.GetBinContent(i) for i in xrange(nCells)]),
+            _np.array([h.GetBinError(i) for i in xrange(nCells)]))
+
+
+def _maxRelDiff(a, b):
+    diff = _np.abs(a - b)
+    scale = _np.maximum(_np.abs(a), _np.abs(b))
+    return max(0., _np.max(_np.where(diff > 0., diff / _np.maximum(scale, 1e-300), 0.)))
+
+
+def _compare(ref, test, tolerance):
+    '''
+    Names of the histograms in test that aren't in ref or differ from it
+    by more than tolerance, and names in ref missing from test.
+    '''
+    bad = sorted(set(ref) ^ set(test))
+    for name in sorted(set(ref) & set(test)):
+        refContents, refErrors = ref[name]
+        testContents, testErrors = test[name]
+        if refContents.shape != testContents.shape:
+            bad.append(name)
+        elif max(_maxRelDiff(refContents, testContents),
+                 _maxRelDiff(refErrors, testErrors)) > tolerance:
+            bad.append(name)
+
+    return bad
+
+
+def checkChannel(channel, outDir, nEvents, nFiles, tolerance, rand):
+    '''
+    Make and compare everything for one channel. Returns (number of
+    histograms compared, number that differ).
+    '''
+    single, split = _writeFiles(outDir, channel, nEvents, nFiles, rand)
+    hists = _makeHists(rand)
+    specs = _makerSpecs(channel)
+
+    composite = _responseMatrixMakerClass('CompositeResponseMatrixMaker')(channel)
+    for syst, fNames in split.iteritems():
+        for fName in fNames:
+            if syst:
+                composite.registerFile(fName, syst)
+            else:
+                composite.registerFile(fName)
+
+    compositeMakers = []
+    for className, varName, binning in specs:
+        maker = _makeMaker(className, channel, varName, binning, split, hists)
+        composite.addResponseMaker(maker)
+        compositeMakers.append(maker)
+
+    composite.setup()
+
+    compositeResponses = []
+    for maker in compositeMakers:
+        compositeResponses.append({n : _contents(h) for n, h in _responses(maker).iteritems()})
+
+    nCompared = 0
+    nBad = 0
+    for (className, varName, binning), fromComposite in zip(specs, compositeResponses):
+        ref = _makeMaker(className, channel, varName, binning, single, hists)
+        refResponses = {n : _contents(h) for n, h in _responses(ref).iteritems()}
+        del ref
+
+        if not refResponses['nominal'][0].any():
+            print "{} {} {}: reference nominal response is empty".format(channel, className, varName)
+            nBad += 1
+
+        alone = _makeMaker(className, channel, varName, binning, split, hists)
+        aloneResponses = {n : _contents(h) for n, h in _responses(alone).iteritems()}
+        del alone
+
+        for label, test in [('alone, split files', aloneResponses),
+                            ('composite, split files', fromComposite)]:
+            bad = _compare(refResponses, test, tolerance)
+            nCompared += len(refResponses)
+            nBad += len(bad)
+            if bad:
+                print "{} {} {} ({}): {} differ from reference: {}".format(
+                    channel, className, varName, label, len(bad), ', '.join(bad))
+
+    return nCompared, nBad
+
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser as _Args
+    from sys import exit as _exit
+
+    parser = _Args(description=("Check that response matrix makers in a "
+                                "composite give the same responses as on "
+                                "their own, with chains that cross file "
+                                "boundaries. Exits with status 1 if "
+                                "anything differs."))
+    parser.add_argument('--channels', type=str, nargs='*',
+                        default=['eeee','eemm','mmmm'],
+                        help='Channels to check.')
+    parser.add_argument('--nEvents', type=int, default=2000,
+                        help='Number of fake gen events per channel.')
+    parser.add_argument('--nFiles', type=int, default=3,
+                        help='Number of files to split the ntuples over (at least 2).')
+    parser.add_argument('--tolerance', type=float, default=1e-12,
+                        help=('Largest relative difference allowed in any '
+                              'bin content or error.'))
+    parser.add_argument('--keep', action='store_true',
+                        help="Don't delete the fake ntuples afterwards.")
+
+    args = parser.parse_args()
+
+    if args.nFiles < 2:
+        parser.error("Need at least 2 files to cross a file boundary")
+
+    rand = _np.random.RandomState(12345)
+    outDir = _mkdtemp(prefix='checkResponseMatrixMakers_')
+
+    nCompared = 0
+    nBad = 0
+    try:
+        for channel in args.channels:
+            nc, nb = checkChannel(channel, outDir, args.nEvents, args.nFiles,
+                                  args.tolerance, rand)
+            print "{}: {} of {} response histograms differ".format(channel, nb, nc)
+            nCompared += nc
+            nBad += nb
+    finally:
+        if args.keep:
+            print "Fake ntuples are in {}".format(outDir)
+        else:
+            _rmtree(outDir)
+
+    print "{} of {} response histograms differ".format(nBad, nCompared)
+    if nBad:
+        _exit(1)
@@ -0,0 +1,722 @@
+'''
+
+drawExpressions.py
+
+Parse the C-like expression strings used with TTree::Draw (variables,
+selections, weights) and evaluate them on numpy arrays instead of event by
+event inside ROOT.
+
+Expressions are parsed into trees of tuples:
+    ('num', value)
+    ('var', branchName)
+    ('index', branchName, i)         e.g. jetPt[0]
+    ('call', functionName, (args))
+    ('unary', op, operand)
+    ('binary', op, left, right)
+    ('ternary', condition, ifTrue, ifFalse)
+
+Nodes are made canonical as they're parsed: constant subexpressions are
+folded into numbers, and identical subexpressions (like the same scale
+factor lookup in several places of a long weight string) are the same
+object, wherever and in whichever string they appear. When an expression
+is evaluated, subexpressions that appear more than once are only computed
+once, and results can be kept in a cache shared between expressions (see
+evaluateExpression). Nodes remember their hash and what evaluation needs to
+know about the tree under them, so nothing is recomputed for an expression
+that has been evaluated before. The table of canonical nodes and parsed
+strings is emptied when it gets big (_maxParsed strings), so a long session
+doesn't keep every expression it has ever seen.
+
+Vector branch elements that don't exist in an entry are NaN in the
+columns. TTreeFormula skips an entry if any element the formula uses is
+missing, whatever the rest of the expression does with it, so the result
+is NaN in those entries even if the NaN would be lost along the way (in
+comparisons, !, or ?:).
+
+Anything that can't be done with arrays (unknown functions, special
+TTreeFormula variables like Iteration$, looping over vector branches)
+raises UnsupportedExpression, so callers can fall back to TTree::Draw.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import numpy as _np
+
+from re import compile as _reComp
+from re import VERBOSE as _VERBOSE
+
+
+class UnsupportedExpression(ValueError):
+    '''
+    Raised for expressions that can be handled by TTree::Draw but not by the
+    array-based evaluator.
+    '''
+    pass
+
+
+_tokenPattern = _reComp(r'''\s*(?:
+    (?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|
+    (?P<name>[A-Za-z_][A-Za-z0-9_$]*(?:::[A-Za-z_][A-Za-z0-9_]*)*)|
+    (?P<op>&&|\|\||==|!=|<=|>=|[-+*/%^<>!?:(),\[\]])
+    )''', _VERBOSE)
+
+
+def _tokenize(expr):
+    pos = 0
+    tokens = []
+    expr = expr.rstrip()
+    while pos < len(expr):
+        m = _tokenPattern.match(expr, pos)
+        if m is None or m.end() == pos:
+            raise UnsupportedExpression("Can't parse '{}' at position {} "
+                                        "in expression {}".format(expr[pos:],
+                                                                  pos, expr))
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+
+    tokens.append(('end', ''))
+    return tokens
+
+
+class _Parser(object):
+    '''
+    Recursive descent parser with the usual C operator precedence. '^' is
+    exponentiation, as in TFormula.
+    '''
+    _binaryLevels = [
+        ['||'],
+        ['&&'],
+        ['==', '!='],
+        ['<', '<=', '>', '>='],
+        ['+', '-'],
+        ['*', '/', '%'],
+        ]
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = _tokenize(expr)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def next(self):
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def expect(self, op):
+        tok = self.next()
+        if tok[1] != op:
+            raise UnsupportedExpression("Expected '{}' but found '{}' in "
+                                        "expression {}".format(op, tok[1],
+                                                               self.expr))
+
+    def parseList(self):
+        '''
+        Parse a colon-separated list of expressions (as in 'y:x').
+        '''
+        out = [self.parseTernary()]
+        while self.peek()[1] == ':':
+            self.next()
+            out.append(self.parseTernary())
+
+        if self.peek()[0] != 'end':
+            raise UnsupportedExpression("Unexpected '{}' in expression "
+                                        "{}".format(self.peek()[1], self.expr))
+        return out
+
+    def parseTernary(self):
+        cond = self.parseBinary(0)
+        if self.peek()[1] == '?':
+            self.next()
+            ifTrue = self.parseTernary()
+            self.expect(':')
+            ifFalse = self.parseTernary()
+            return _makeNode('ternary', cond, ifTrue, ifFalse)
+        return cond
+
+    def parseBinary(self, level):
+        if level == len(self._binaryLevels):
+            return self.parseUnary()
+
+        left = self.parseBinary(level + 1)
+        while self.peek()[0] == 'op' and self.peek()[1] in self._binaryLevels[level]:
+            op = self.next()[1]
+            right = self.parseBinary(level + 1)
+            left = _makeNode('binary', op, left, right)
+
+        return left
+
+    def parseUnary(self):
+        if self.peek()[0] == 'op' and self.peek()[1] in ('!', '-', '+'):
+            op = self.next()[1]
+            operand = self.parseUnary()
+            if op == '+':
+                return operand
+            return _makeNode('unary', op, operand)
+
+        return self.parsePower()
+
+    def parsePower(self):
+        base = self.parsePrimary()
+        if self.peek()[1] == '^':
+            self.next()
+            exponent = self.parseUnary() # right associative
+            return _makeNode('binary', '^', base, exponent)
+        return base
+
+    def parsePrimary(self):
+        kind, val = self.next()
+
+        if kind == 'num':
+            return _makeNode('num', float(val))
+
+        if kind == 'name':
+            if self.peek()[1] == '(':
+                self.next()
+                args = []
+                if self.peek()[1] != ')':
+                    args.append(self.parseTernary())
+                    while self.peek()[1] == ',':
+                        self.next()
+                        args.append(self.parseTernary())
+                self.expect(')')
+                return _makeNode('call', val, tuple(args))
+
+            if '$' in val:
+                raise UnsupportedExpression("Special variable {} can only be "
+                                            "used with TTree::Draw".format(val))
+            if val in ('true', 'false'):
+                return _makeNode('num', float(val == 'true'))
+
+            if self.peek()[1] == '[':
+                self.next()
+                kind, iVal = self.next()
+                if kind != 'num' or '.' in iVal:
+                    raise UnsupportedExpression("Only constant integer array "
+                                                "indices are supported "
+                                                "({})".format(self.expr))
+                self.expect(']')
+                return _makeNode('index', val, int(iVal))
+
+            return _makeNode('var', val)
+
+        if val == '(':
+            out = self.parseTernary()
+            self.expect(')')
+            return out
+
+        raise UnsupportedExpression("Unexpected '{}' in expression "
+                                    "{}".format(val, self.expr))
+
+
+class _Node(tuple):
+    '''
+    Expression tree node. Its hash is computed once (the tree under it can be
+    deep), and things evaluateExpression finds out about the tree are kept
+    as attributes.
+    '''
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = tuple.__hash__(self)
+            return self._hash
+
+
+# canonical copy of every node made
+_nodes = {}
+
+def _makeNode(*node):
+    '''
+    Canonical copy of an expression tree node, with constant subexpressions
+    folded into numbers.
+    '''
+    node = _foldConstants(node)
+    if not isinstance(node, _Node):
+        node = _Node(node)
+    return _nodes.setdefault(node, node)
+
+
+def _foldConstants(node):
+    kind = node[0]
+
+    if kind == 'ternary' and node[1][0] == 'num':
+        return node[2] if node[1][1] else node[3]
+
+    if kind in ('unary', 'binary'):
+        operands = node[2:]
+    elif kind == 'call' and node[1] in _builtinFunctions:
+        operands = node[2]
+    else:
+        return node
+
+    if all(op[0] == 'num' for op in operands):
+        with _np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            return ('num', float(_compute(node, {})))
+
+    return node
+
+
+def internNode(node):
+    '''
+    The canonical copy of expression tree node (for trees that didn't come
+    from the parser, or from before the table of nodes was emptied).
+    '''
+    canonical = _nodes.get(node)
+    if canonical is not None:
+        return canonical
+
+    kind = node[0]
+    if kind == 'call':
+        return _makeNode(kind, node[1], tuple(internNode(a) for a in node[2]))
+    if kind == 'unary':
+        return _makeNode(kind, node[1], internNode(node[2]))
+    if kind == 'binary':
+        return _makeNode(kind, node[1], internNode(node[2]),
+                         internNode(node[3]))
+    if kind == 'ternary':
+        return _makeNode(kind, *[internNode(n) for n in node[1:]])
+    return _makeNode(*node)
+
+
+# number of parsed strings to remember before starting over
+_maxParsed = 10000
+
+_parsed = {}
+def parseDrawVariables(expr):
+    '''
+    Parse a TTree::Draw variable or colon-separated set of variables into a
+    list of expression trees, in the order they appear in the string.
+    Results are memoized.
+    '''
+    try:
+        return _parsed[expr]
+    except KeyError:
+        pass
+
+    if len(_parsed) >= _maxParsed:
+        # nodes already handed out still work (caches hold on to the nodes
+        # they're for), they just won't be shared with new ones
+        _parsed.clear()
+        _nodes.clear()
+
+    if not expr.strip():
+        out = [_makeNode('num', 1.)]
+    else:
+        out = _Parser(expr).parseList()
+
+    _parsed[expr] = out
+    return out
+
+
+def parseExpression(expr):
+    '''
+    Parse a single (selection, weight, or variable) expression into an
+    expression tree. An empty string means 1.
+    '''
+    out = parseDrawVariables(expr)
+    if len(out) != 1:
+        raise UnsupportedExpression("Expected one expression, got "
+                                    "{} ({})".format(len(out), expr))
+    return out[0]
+
+
+_functions = {
+    'abs' : _np.abs,
+    'fabs' : _np.abs,
+    'TMath::Abs' : _np.abs,
+    'sqrt' : _np.sqrt,
+    'TMath::Sqrt' : _np.sqrt,
+    'exp' : _np.exp,
+    'TMath::Exp' : _np.exp,
+    'log' : _np.log,
+    'TMath::Log' : _np.log,
+    'log10' : _np.log10,
+    'TMath::Log10' : _np.log10,
+    'pow' : _np.power,
+    'TMath::Power' : _np.power,
+    'max' : _np.maximum,
+    'TMath::Max' : _np.maximum,
+    'min' : _np.minimum,
+    'TMath::Min' : _np.minimum,
+    'sin' : _np.sin,
+    'cos' : _np.cos,
+    'tan' : _np.tan,
+    'asin' : _np.arcsin,
+    'acos' : _np.arccos,
+    'atan' : _np.arctan,
+    'atan2' : _np.arctan2,
+    'TMath::ATan2' : _np.arctan2,
+    'sinh' : _np.sinh,
+    'cosh' : _np.cosh,
+    'tanh' : _np.tanh,
+    'TMath::Sign' : lambda a, b: _np.abs(a) * _np.where(_np.asarray(b) < 0., -1., 1.),
+    'TMath::Pi' : lambda: _np.pi,
+    }
+
+# constant calls to these can be folded into numbers when parsing
+_builtinFunctions = frozenset(_functions)
+
+
+def registerFunction(name, f):
+    '''
+    Make function f usable as name(...) in expressions. f must take and
+    return numpy arrays. This is how compiled C++ functions used in weight
+    strings get array equivalents.
+    '''
+    if not hasattr(f, '__call__'):
+        raise ValueError('Failed to register {}: {} is not '
+                         'callable'.format(name, f))
+    _functions[name] = f
+
+
+def hasFunction(name):
+    return name in _functions
+
+
+def branchesNeeded(*nodes):
+    '''
+    Get the branches read by the expression trees in nodes, as a dict of
+    branch name -> number of array elements needed (0 for scalar branches).
+    '''
+    out = {}
+    for node in nodes:
+        _collectBranches(node, out)
+    return out
+
+def _collectBranches(node, out):
+    kind = node[0]
+    if kind == 'var':
+        out.setdefault(node[1], 0)
+    elif kind == 'index':
+        out[node[1]] = max(out.get(node[1], 0), node[2] + 1)
+    elif kind == 'call':
+        for arg in node[2]:
+            _collectBranches(arg, out)
+    elif kind == 'unary':
+        _collectBranches(node[2], out)
+    elif kind == 'binary':
+        _collectBranches(node[2], out)
+        _collectBranches(node[3], out)
+    elif kind == 'ternary':
+        for sub in node[1:]:
+            _collectBranches(sub, out)
+
+
+def _num(x):
+    '''
+    TTreeFormula does everything in double precision, so booleans (and
+    unsigned ints, which would otherwise wrap around) become doubles.
+    '''
+    x = _np.asarray(x)
+    if x.dtype != _np.float64:
+        return x.astype(_np.float64)
+    return x
+
+
+_binaryOps = {
+    '+' : lambda a, b: _np.add(_num(a), _num(b)),
+    '-' : lambda a, b: _np.subtract(_num(a), _num(b)),
+    '*' : lambda a, b: _np.multiply(_num(a), _num(b)),
+    '/' : lambda a, b: _np.true_divide(_num(a), _num(b)),
+    '%' : lambda a, b: _np.fmod(_num(a), _num(b)),
+    '^' : lambda a, b: _np.power(_num(a), _num(b)),
+    '<' : _np.less,
+    '<=' : _np.less_equal,
+    '>' : _np.greater,
+    '>=' : _np.greater_equal,
+    '==' : _np.equal,
+    '!=' : _np.not_equal,
+    '&&' : _np.logical_and,
+    '||' : _np.logical_or,
+    }
+
+
+def evaluateExpression(node, columns, nRows=None, cache=None):
+    '''
+    Evaluate expression tree node on columns, a dict of branch name ->
+    array (2-D arrays, padded with NaN, for indexed vector branches).
+    If nRows is specified, the output is always an array of that length
+    (otherwise constant expressions may come back as scalars).
+
+    Subexpressions that appear more than once in node are only evaluated
+    once. If cache (a dict) is given, the result, repeated subexpressions,
+    and function calls are stored in it (keyed by node) and reused by later
+    calls with the same cache, so it must only be used with the same
+    columns.
+    '''
+    node = internNode(node)
+
+    if cache is not None:
+        try:
+            return cache[(node, nRows)]
+        except KeyError:
+            pass
+        keep = _cachedNodes(node)
+        memo = cache
+    else:
+        keep = _repeatedNodes(node)
+        memo = {}
+
+    with _np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        out = _evaluate(node, columns, memo, keep)
+
+    valid = _validEntries(node, columns)
+    if valid is not None:
+        out = _np.where(valid, _num(out), _np.nan)
+
+    if nRows is not None:
+        out = _num(out)
+        if out.shape != (nRows,):
+            out = _np.array(_np.broadcast_to(out, (nRows,)))
+
+    if cache is not None:
+        cache[(node, nRows)] = out
+
+    return out
+
+
+def _subexpressions(node):
+    kind = node[0]
+    if kind == 'call':
+        return node[2]
+    if kind == 'unary':
+        return node[2:]
+    if kind == 'binary':
+        return node[2:]
+    if kind == 'ternary':
+        return node[1:]
+    return ()
+
+
+def _repeatedNodes(node):
+    '''
+    The (non-trivial) subexpressions that appear more than once in node.
+    Nodes are canonical, so these are the same objects.
+    '''
+    try:
+        return node._repeated
+    except AttributeError:
+        pass
+
+    counts = {}
+    toCount = [node]
+    while toCount:
+        n = toCount.pop()
+        if n[0] in ('num', 'var'):
+            continue
+        counts[n] = counts.get(n, 0) + 1
+        toCount += _subexpressions(n)
+
+    node._repeated = frozenset(n for n, c in counts.iteritems() if c > 1)
+    return node._repeated
+
+
+def _cachedNodes(node):
+    '''
+    The subexpressions of node that are kept in a shared cache: repeated
+    ones and function calls (usually the expensive parts, and often shared
+    between similar weights).
+    '''
+    try:
+        return node._cached
+    except AttributeError:
+        pass
+
+    calls = set()
+    toCheck = [node]
+    while toCheck:
+        n = toCheck.pop()
+        if n[0] == 'call':
+            calls.add(n)
+        toCheck += _subexpressions(n)
+
+    node._cached = _repeatedNodes(node) | frozenset(calls)
+    return node._cached
+
+
+def _indexNodes(node):
+    '''
+    The vector element ('index') nodes in node.
+    '''
+    try:
+        return node._indices
+    except AttributeError:
+        pass
+
+    indices = set()
+    toCheck = [node]
+    while toCheck:
+        n = toCheck.pop()
+        if n[0] == 'index':
+            indices.add(n)
+        toCheck += _subexpressions(n)
+
+    node._indices = frozenset(indices)
+    return node._indices
+
+
+def _validEntries(node, columns):
+    '''
+    Boolean array of the entries in which every vector element used by node
+    exists, or None if node doesn't use any.
+    '''
+    valid = None
+    for n in _indexNodes(node):
+        exists = ~_np.isnan(_num(_compute(n, columns)))
+        valid = exists if valid is None else valid & exists
+    return valid
+
+
+def _evaluate(node, columns, memo, keep):
+    if node not in keep:
+        return _compute(node, columns, memo, keep)
+
+    try:
+        return memo[node]
+    except KeyError:
+        out = _compute(node, columns, memo, keep)
+        memo[node] = out
+        return out
+
+
+def _compute(node, columns, memo=None, keep=frozenset()):
+    kind = node[0]
+
+    if kind == 'num':
+        return node[1]
+
+    if kind == 'var':
+        try:
+            col = columns[node[1]]
+        except KeyError:
+            raise UnsupportedExpression("Unknown variable {}".format(node[1]))
+        if col.ndim != 1 or col.dtype == _np.object_:
+            raise UnsupportedExpression("Vector branch {} must be "
+                                        "indexed".format(node[1]))
+        return col
+
+    if kind == 'index':
+        try:
+            col = columns[node[1]]
+        except KeyError:
+            raise UnsupportedExpression("Unknown variable {}".format(node[1]))
+        return col[:,node[2]]
+
+    if kind == 'call':
+        try:
+            f = _functions[node[1]]
+        except KeyError:
+            raise UnsupportedExpression("No array version of function "
+                                        "{}".format(node[1]))
+        return f(*[_num(_evaluate(a, columns, memo, keep)) for a in node[2]])
+
+    if kind == 'unary':
+        operand = _evaluate(node[2], columns, memo, keep)
+        if node[1] == '!':
+            return _np.logical_not(operand)
+        return _np.negative(_num(operand))
+
+    if kind == 'binary':
+        return _binaryOps[node[1]](_evaluate(node[2], columns, memo, keep),
+                                   _evaluate(node[3], columns, memo, keep))
+
+    if kind == 'ternary':
+        return _np.where(_evaluate(node[1], columns, memo, keep),
+                         _num(_evaluate(node[2], columns, memo, keep)),
+                         _num(_evaluate(node[3], columns, memo, keep)))
+
+    raise UnsupportedExpression("Unknown expression node {}".format(node))
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser as _Args
+    from array import array as _array
+    from sys import exit as _exit
+
+    from rootpy import asrootpy
+    from rootpy.plotting import Hist, Hist2D
+    from ROOT import TTree, std
+    from root_numpy import tree2array
+
+    from Utilities.histArrays import fillHist, histContents
+
+    parser = _Args(description=("Check that expressions evaluated on arrays "
+                                "give the same histograms as TTree::Draw."))
+    parser.add_argument('--n', type=int, default=100000,
+                        help='Number of entries in the test tree.')
+
+    args = parser.parse_args()
+
+    rand = _np.random.RandomState(12345)
+
+    tree = TTree('drawCheck', 'drawCheck')
+    x = _array('f', [0.])
+    nV = _array('i', [0])
+    v = std.vector('float')()
+    tree.Branch('x', x, 'x/F')
+    tree.Branch('nV', nV, 'nV/I')
+    tree.Branch('v', v)
+    for i in xrange(args.n):
+        x[0] = rand.uniform()
+        nV[0] = rand.randint(4)
+        v.clear()
+        for j in xrange(nV[0]):
+            v.push_back(rand.uniform())
+        tree.Fill()
+    tree = asrootpy(tree)
+
+    # (var, selection), with vector elements that are sometimes missing
+    checks = [
+        ('v[1]', ''),
+        ('x', '!(v[1] > 0.5)'),
+        ('x', 'v[0] > 0.2 && x < 0.7'),
+        ('x', 'v[0] < 0.5 || nV < 2'),
+        ('v[1] > 0.5 ? v[2] : x', 'nV > 0'),
+        ('x', '(v[2] != 0.) * (1. + x)'),
+        ('v[0]:x', 'v[1] > 0.3'),
+        ]
+
+    arr = tree2array(tree, branches=['x', 'nV', ('v', _np.nan, 3)])
+    columns = {b : arr[b] for b in arr.dtype.names}
+
+    nBad = 0
+    for var, selection in checks:
+        if ':' in var:
+            hDraw = Hist2D(10, 0., 1., 10, 0., 1.)
+        else:
+            hDraw = Hist(20, 0., 1.)
+        hDraw.sumw2()
+        hArrays = hDraw.empty_clone()
+        hArrays.sumw2()
+
+        tree.Draw(var, selection, 'goff', hDraw)
+
+        varExprs = parseDrawVariables(var)[::-1]
+        fillHist(hArrays, evaluateExpression(parseExpression(selection),
+                                             columns, len(arr)),
+                 *[evaluateExpression(e, columns, len(arr))
+                   for e in varExprs])
+
+        drawn, drawnErr2 = histContents(hDraw)
+        filled, filledErr2 = histContents(hArrays)
+
+        if not (_np.allclose(drawn, filled, rtol=1e-9, atol=0.) and
+                _np.allclose(drawnErr2, filledErr2, rtol=1e-9, atol=0.) and
+                hDraw.GetEntries() == hArrays.GetEntries()):
+            nBad += 1
+            print "Mismatch for '{}' with selection '{}':".format(var,
+                                                                  selection)
+            print "    arrays:      {} entries, {}".format(
+                hArrays.GetEntries(), filled)
+            print "    TTree::Draw: {} entries, {}".format(
+                hDraw.GetEntries(), drawn)
+
+    print "{} of {} expressions differ from TTree::Draw".format(nBad,
+                                                                len(checks))
+    if nBad:
+        _exit(1)
@@ -14,9 +14,17 @@ logging.basicConfig(level=logging.WARNING)
 rlog["/rootpy.compiled"].setLevel(rlog.WARNING)
 
 import rootpy.compiled as _rootComp
+import numpy as _np
 from rootpy.ROOT import TGraphAsymmErrors as _TGAE
 
 from numbers import Number as _NumType
+from os import environ as _env
+from os import makedirs as _makedirs
+from os import stat as _stat
+from os.path import join as _join
+from os.path import isdir as _isdir
+from os.path import abspath as _abspath
+from hashlib import sha1 as _sha1
 
 def makeNumberPretty(n, maxDigits=10):
     '''
@@ -98,6 +106,51 @@ def dictFromJSONFile(fName):
         return loadJSON(f)
 
 
+def cacheDirectory(*subdirs):
+    '''
+    Path to a directory for saved intermediate results,
+    $zzt/Analysis/savedResults/subdirs..., created if it doesn't exist.
+    '''
+    d = _join(_env['zzt'], 'Analysis', 'savedResults', *subdirs)
+    if not _isdir(d):
+        try:
+            _makedirs(d)
+        except OSError: # someone else made it in the meantime
+            if not _isdir(d):
+                raise
+    return d
+
+
+def fileSignature(*fileNames, **kwargs):
+    '''
+    Hash identifying the current version of a list of files, from their
+    paths, sizes, and modification times (contents aren't read, so this is
+    cheap). Any keyword arguments are included in the hash, so the same
+    files can get different signatures for different uses.
+    '''
+    h = _sha1()
+    for fName in fileNames:
+        st = _stat(fName)
+        h.update('{}:{}:{};'.format(_abspath(fName), st.st_size,
+                                    int(st.st_mtime)))
+    for k in sorted(kwargs):
+        h.update('{}={};'.format(k, kwargs[k]))
+
+    return h.hexdigest()
+
+
+def histHash(h):
+    '''
+    Hash of a histogram's binning and contents.
+    '''
+    out = _sha1(h.__class__.__name__)
+    for ax in [h.GetXaxis(), h.GetYaxis(), h.GetZaxis()][:h.GetDimension()]:
+        out.update(repr([ax.GetBinLowEdge(i) for i in xrange(1, ax.GetNbins()+2)]))
+    out.update(repr([(h.GetBinContent(i), h.GetBinError(i))
+                     for i in xrange(h.GetNcells())]))
+    return out.hexdigest()
+
+
 def combineWeights(*wts, **kwargs):
     '''
     Combine all non-null items in wts into a string that multiplies them all
@@ -167,6 +220,41 @@ def _setupDeltaR():
     _strDeltaR = '_f_Delta_R'
     _fDeltaR = _rootComp._f_Delta_R
 
+    # array versions so the strings work in columnar histogramming too
+    from Utilities.drawExpressions import registerFunction as _registerFunction
+    _registerFunction(_strDeltaPhi, _arrayDeltaPhi)
+    _registerFunction(_strDeltaR, _arrayDeltaR)
+
+
+def _arrayDeltaPhi(phi1, phi2):
+    '''
+    Numpy version of _f_Delta_Phi, in single precision like the C++ one.
+    '''
+    pi = _np.float32(3.14159265)
+    out = _np.asarray(phi1, dtype=_np.float32) - _np.asarray(phi2, dtype=_np.float32)
+    out = _np.array(out, ndmin=1)
+    while True:
+        tooHigh = out > pi
+        if not tooHigh.any():
+            break
+        out[tooHigh] -= 2. * pi
+    while True:
+        tooLow = out < -1. * pi
+        if not tooLow.any():
+            break
+        out[tooLow] += 2. * pi
+
+    return out
+
+
+def _arrayDeltaR(eta1, phi1, eta2, phi2):
+    '''
+    Numpy version of _f_Delta_R.
+    '''
+    dPhi = _arrayDeltaPhi(phi1, phi2)
+    dEta = _np.asarray(eta1, dtype=_np.float32) - _np.asarray(eta2, dtype=_np.float32)
+    return _np.sqrt(dPhi * dPhi + dEta * dEta)
+
 
 def deltaPhiFunction():
     if _fDeltaPhi is None:
@@ -0,0 +1,201 @@
+'''
+
+histArrays.py
+
+Move between numpy arrays and ROOT histograms without going through
+TH1::Fill one entry at a time. Bin finding follows TAxis::FindFixBin
+exactly, including underflow and overflow, so histograms filled here are
+the same as ones filled by TTree::Draw.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import numpy as _np
+
+
+def axisEdges(axis):
+    '''
+    Array of the nBins+1 bin edges of a TAxis.
+    '''
+    return _np.array([axis.GetBinLowEdge(i)
+                      for i in xrange(1, axis.GetNbins()+2)],
+                     dtype=_np.float64)
+
+
+def findBins(axis, x):
+    '''
+    Vectorized TAxis::FindFixBin. Returns an int array of ROOT bin numbers,
+    with 0 for underflow and nBins+1 for overflow.
+    '''
+    if axis.GetXbins().GetSize() == 0:
+        return binsFromEdges(axisEdges(axis), x,
+                             (axis.GetXmin(), axis.GetXmax()))
+    return binsFromEdges(axisEdges(axis), x)
+
+
+def binsFromEdges(edges, x, uniformRange=None):
+    '''
+    Same as findBins, for an axis given by its array of bin edges. For
+    uniform binning, uniformRange should be (xMin, xMax) of the axis, so the
+    same arithmetic as ROOT can be used (and give the same answer for values
+    right on a bin edge).
+    '''
+    x = _np.asarray(x, dtype=_np.float64)
+    nBins = len(edges) - 1
+
+    if uniformRange is not None:
+        xMin, xMax = uniformRange
+        with _np.errstate(invalid='ignore'):
+            inRange = (x >= xMin) & (x < xMax)
+            bins = _np.zeros(x.shape, dtype=_np.int64)
+            bins[inRange] = 1 + (nBins * (x[inRange] - xMin) /
+                                 (xMax - xMin)).astype(_np.int64)
+            bins[x >= xMax] = nBins + 1
+    else:
+        with _np.errstate(invalid='ignore'):
+            bins = _np.searchsorted(edges, x, side='right')
+            bins[x >= edges[-1]] = nBins + 1
+
+    return bins
+
+
+def fillHist(h, weights, *values):
+    '''
+    Add weighted entries to histogram h (1-D or 2-D, with sumw2). values are
+    arrays for the x (and y) coordinates. Entries with a NaN coordinate or
+    weight are skipped, like missing elements of a vector branch in
+    TTree::Draw; entries with weight 0 don't count.
+    '''
+    weights = _np.asarray(weights, dtype=_np.float64)
+    contents, sumW2, nEntries = binVariations(h, weights[:,_np.newaxis],
+                                              *values)
+
+    addToHist(h, contents[0], sumW2[0], int(nEntries[0]))
+
+
+def binVariations(h, weights, *values):
+    '''
+    Bin the same values with several sets of weights at once, for
+    histograms with the binning of h (which isn't changed). weights is a
+    2-D array with one row per entry and one column per set of weights.
+    Skipped entries are the same as in fillHist.
+
+    Returns arrays of bin contents and squared weights (one row per set of
+    weights, in ROOT's global bin order) and the number of entries for
+    each set of weights.
+    '''
+    dim = h.GetDimension()
+    if len(values) != dim:
+        raise ValueError("Can't fill {}-D histogram {} with {} "
+                         "variables.".format(dim, h.GetName(), len(values)))
+
+    weights = _np.asarray(weights, dtype=_np.float64)
+    values = [_np.asarray(v, dtype=_np.float64) for v in values]
+
+    keep = _np.ones(weights.shape[0], dtype=bool)
+    for v in values:
+        keep &= ~_np.isnan(v)
+    weights = weights[keep]
+    values = [v[keep] for v in values]
+
+    weights[_np.isnan(weights)] = 0.
+
+    axes = [h.GetXaxis(), h.GetYaxis()][:dim]
+    globalBins = _np.zeros(weights.shape[0], dtype=_np.int64)
+    stride = 1
+    for ax, v in zip(axes, values):
+        globalBins += stride * findBins(ax, v)
+        stride *= ax.GetNbins() + 2
+
+    nCells = stride
+    nVariations = weights.shape[1]
+    contents = _np.zeros((nVariations, nCells))
+    sumW2 = _np.zeros((nVariations, nCells))
+    for i in xrange(nVariations):
+        w = weights[:,i]
+        contents[i] = _np.bincount(globalBins, weights=w, minlength=nCells)
+        sumW2[i] = _np.bincount(globalBins, weights=w**2, minlength=nCells)
+
+    nEntries = _np.count_nonzero(weights, axis=0)
+
+    return contents, sumW2, nEntries
+
+
+def addToHist(h, contents, sumW2, nEntries=0):
+    '''
+    Add arrays of bin contents and squared weights (in ROOT's global bin
+    order, including under/overflow) to histogram h.
+    '''
+    if h.GetSumw2N() == 0:
+        h.Sumw2()
+    hSumW2 = h.GetSumw2()
+
+    entries = h.GetEntries()
+    for i in _np.flatnonzero((contents != 0.) | (sumW2 != 0.)):
+        i = int(i)
+        h.SetBinContent(i, h.GetBinContent(i) + contents[i])
+        hSumW2.SetAt(hSumW2.At(i) + sumW2[i], i)
+    h.SetEntries(entries + nEntries)
+
+
+def histContents(h):
+    '''
+    Bin contents and squared errors of h as arrays in ROOT's global bin
+    order (including under/overflow).
+    '''
+    nCells = h.GetNcells()
+    contents = _np.array([h.GetBinContent(i) for i in xrange(nCells)])
+    if h.GetSumw2N():
+        sumW2 = h.GetSumw2()
+        errs2 = _np.array([sumW2.At(i) for i in xrange(nCells)])
+    else:
+        errs2 = contents.copy()
+    return contents, errs2
+
+
+def rebinIndices(edges, newEdges):
+    '''
+    Indices for numpy.add.reduceat that merge the cells (including underflow
+    and overflow) of an axis with bin edges edges into the cells of an axis
+    with bin edges newEdges. Every edge in newEdges must also be in edges.
+    '''
+    edges = _np.asarray(edges, dtype=_np.float64)
+    newEdges = _np.asarray(newEdges, dtype=_np.float64)
+
+    if _np.any(_np.diff(newEdges) <= 0.):
+        raise ValueError("Bin edges must increase: {}".format(list(newEdges)))
+
+    tolerance = 1e-6 * (edges[-1] - edges[0])
+    iEdges = _np.minimum(_np.searchsorted(edges, newEdges - tolerance),
+                         len(edges) - 1)
+    if _np.any(_np.abs(edges[iEdges] - newEdges) > tolerance):
+        raise ValueError("Can't rebin: not all of {} are bin edges of "
+                         "{}".format(list(newEdges), list(edges)))
+
+    # old cell i+1 is the bin whose low edge is edges[i]; new underflow
+    # starts at old underflow
+    return _np.concatenate(([0], iEdges + 1))
+
+
+def rebinArrays(arrays, cellsPerAxis, indices):
+    '''
+    Merge cells of arrays (e.g. bin contents and squared weights, as from
+    histContents) in ROOT's global bin order. cellsPerAxis is the number of
+    cells (including under/overflow) along each axis; indices has an array
+    from rebinIndices for each axis to rebin, or None for axes to leave
+    alone.
+
+    Returns a list of the rebinned arrays, still in global bin order.
+    '''
+    dim = len(cellsPerAxis)
+    out = []
+    for arr in arrays:
+        # global bin = x + nx * (y + ny * z), so x varies fastest
+        arr = _np.asarray(arr).reshape(cellsPerAxis[::-1])
+        for iAxis, ind in enumerate(indices):
+            if ind is not None:
+                arr = _np.add.reduceat(arr, ind, axis=dim-1-iAxis)
+        out.append(arr.ravel())
+
+    return out
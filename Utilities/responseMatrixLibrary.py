@@ -0,0 +1,169 @@
+'''
+
+responseMatrixLibrary.py
+
+Build all the response matrix maker classes in ResponseMatrixMaker.cxx
+(the .cxx already has the link pragmas for all of them) into one shared
+library, once, and load it from then on. The library lives in
+$zzt/Analysis/savedResults/responseMatrixMaker under a hash of the
+.cxx and .hxx contents and the ROOT version, so it's rebuilt
+automatically after the code changes and never otherwise.
+
+To build ahead of time (e.g. before submitting a lot of jobs):
+    python Utilities/responseMatrixLibrary.py
+
+In code:
+    C = responseMatrixMakerClass('FloatBranchResponseMatrixMaker')
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import logging
+from rootpy import log as rlog; rlog = rlog["/responseMatrixLibrary"]
+# don't show most silly ROOT messages
+logging.basicConfig(level=logging.WARNING)
+
+from rootpy import ROOT as _ROOT
+from rootpy.ROOT import gSystem as _gSystem
+from rootpy.ROOT import gROOT as _gROOT
+
+from Utilities import cacheDirectory as _cacheDirectory
+
+from fcntl import flock as _flock
+from fcntl import LOCK_EX as _LOCK_EX
+from fcntl import LOCK_UN as _LOCK_UN
+from glob import glob as _glob
+from hashlib import sha1 as _sha1
+from os import environ as _env
+from os import remove as _remove
+from os.path import join as _join
+from os.path import isfile as _isfile
+from os.path import basename as _basename
+
+
+_sourceDir = _join(_env['zzt'], 'Utilities')
+SOURCES = [_join(_sourceDir, 'ResponseMatrixMaker.cxx'),
+           _join(_sourceDir, 'ResponseMatrixMaker.hxx')]
+
+_libStem = 'ResponseMatrixMaker_'
+
+# path of the library loaded in this process, if any
+_loaded = []
+
+
+def _libDirectory():
+    return _cacheDirectory('responseMatrixMaker')
+
+
+def sourceHash():
+    '''
+    Hash of the response matrix maker code and the ROOT version.
+    '''
+    h = _sha1(_gROOT.GetVersion())
+    for src in SOURCES:
+        with open(src) as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def libraryPath(codeHash=''):
+    '''
+    Where the library for the current code (or the code with codeHash) is
+    or will be.
+    '''
+    if not codeHash:
+        codeHash = sourceHash()
+    return _join(_libDirectory(), '{}{}.{}'.format(_libStem, codeHash,
+                                                   _gSystem.GetSoExt()))
+
+
+def buildLibrary(force=False):
+    '''
+    Compile the library for the current code if it isn't there already (or
+    always, with force=True), and load it. Other processes trying to build
+    the same library at the same time wait for this one instead.
+
+    Returns the library path.
+    '''
+    codeHash = sourceHash()
+    lib = libraryPath(codeHash)
+
+    with open(_join(_libDirectory(), '{}{}.lock'.format(_libStem, codeHash)),
+              'w') as lockFile:
+        _flock(lockFile, _LOCK_EX)
+        try:
+            if force or not _isfile(lib):
+                rlog.info("Compiling response matrix makers into {}".format(lib))
+                # ACLiC adds the extension itself
+                libBase = lib[:-len(_gSystem.GetSoExt())-1]
+                if not _gSystem.CompileMacro(SOURCES[0], 'kOf', libBase,
+                                             _libDirectory()):
+                    raise RuntimeError("Failed to compile {}".format(SOURCES[0]))
+                _loaded[:] = [lib]
+        finally:
+            _flock(lockFile, _LOCK_UN)
+
+    if not _loaded:
+        if _gSystem.Load(lib) < 0:
+            raise RuntimeError("Failed to load {}".format(lib))
+        _loaded[:] = [lib]
+
+    return lib
+
+
+def loadLibrary():
+    '''
+    Load the library for the current code, building it first if needed.
+    Only does anything the first time it's called in a process.
+    '''
+    if _loaded:
+        return _loaded[0]
+
+    return buildLibrary()
+
+
+def responseMatrixMakerClass(className):
+    '''
+    Get a response matrix maker class (e.g.
+    'SFHistFloatBranchResponseMatrixMaker'), loading the library if needed.
+    '''
+    loadLibrary()
+    return getattr(_ROOT, className)
+
+
+def removeOldLibraries():
+    '''
+    Delete libraries (and ACLiC's other output) for code that has since
+    changed. Returns the number of files removed.
+    '''
+    current = _libStem + sourceHash()
+
+    nRemoved = 0
+    for f in _glob(_join(_libDirectory(), _libStem + '*')):
+        if not _basename(f).startswith(current):
+            _remove(f)
+            nRemoved += 1
+
+    return nRemoved
+
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser as _Args
+
+    parser = _Args(description=("Build the response matrix maker library "
+                                "if the code has changed since it was last "
+                                "built."))
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild even if the library is up to date.')
+    parser.add_argument('--clean', action='store_true',
+                        help='Delete libraries built from old code.')
+
+    args = parser.parse_args()
+
+    lib = buildLibrary(args.force)
+    print "Response matrix maker library: {}".format(lib)
+
+    if args.clean:
+        print "Removed {} old files".format(removeOldLibraries())